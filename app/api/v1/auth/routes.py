@@ -0,0 +1,52 @@
+from typing import Annotated
+
+from fastapi import Depends
+from fastapi.routing import APIRouter
+from fastapi.responses import JSONResponse
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBasic, HTTPBasicCredentials, HTTPBearer
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette import status
+
+from core.dependencies import authenticate_user, get_db_session
+from core.exceptions import HTTPException
+from core.responses import generate_json_response
+from core.security import create_access_token, decode_access_token, revocation_list
+
+auth_route = APIRouter(prefix="/auth")
+
+
+@auth_route.post("/token")
+async def create_token(
+    db_session: Annotated[AsyncSession, Depends(get_db_session)],
+    credentials: Annotated[HTTPBasicCredentials, Depends(HTTPBasic())]
+) -> JSONResponse:
+    # The password is verified once here. The token is then verified without the DB
+    user = await authenticate_user(
+        db_session=db_session,
+        username=credentials.username,
+        password=credentials.password
+    )
+    access_token, expires_in = create_access_token(user=user)
+    return generate_json_response(
+        status_code=status.HTTP_201_CREATED,
+        message="Token is created",
+        data={"access_token": access_token, "token_type": "bearer", "expires_in": expires_in}
+    )
+
+
+@auth_route.post("/logout")
+async def logout(
+    credentials: Annotated[HTTPAuthorizationCredentials | None, Depends(HTTPBearer(auto_error=False))]
+) -> JSONResponse:
+    if credentials is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            message="Not authenticated",
+            headers={"WWW-Authenticate": "Bearer"}
+        )
+    claims = decode_access_token(credentials.credentials)
+    await revocation_list.revoke(token_id=claims["jti"], expires_at=claims["exp"])
+    return generate_json_response(
+        status_code=status.HTTP_200_OK,
+        message="Logged out successfully"
+    )
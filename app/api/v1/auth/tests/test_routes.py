@@ -0,0 +1,102 @@
+from base64 import b64encode
+
+import pytest
+from starlette import status
+from starlette.testclient import TestClient
+
+from main import application
+
+
+@pytest.fixture(scope="function")
+def test_client():
+    api_test_client = TestClient(app=application)
+    yield api_test_client
+    api_test_client.close()
+
+
+def basic_auth(username, password):
+    token = b64encode(f"{username}:{password}".encode('utf-8')).decode("ascii")
+    return f'Basic {token}'
+
+
+def bearer_auth(token):
+    return f'Bearer {token}'
+
+
+def test_create_token(test_client):
+    # without auth header
+    response = test_client.post("http://localhost:8000/api/v1/auth/token")
+    assert response.status_code == status.HTTP_401_UNAUTHORIZED
+    assert response.json()["meta"]["message"] == "Not authenticated"
+
+    # with incorrect credentials
+    response = test_client.post(
+        "http://localhost:8000/api/v1/auth/token",
+        headers={
+            "Authorization": basic_auth("user", "pass")
+        }
+    )
+    assert response.status_code == status.HTTP_401_UNAUTHORIZED
+    assert response.json()["meta"]["message"] == "Incorrect username or password"
+
+    # correct one
+    response = test_client.post(
+        "http://localhost:8000/api/v1/auth/token",
+        headers={
+            "Authorization": basic_auth("user", "user123")
+        }
+    )
+    assert response.status_code == status.HTTP_201_CREATED
+    assert response.json()["data"]["token_type"] == "bearer"
+    access_token = response.json()["data"]["access_token"]
+
+    response = test_client.get(
+        "http://localhost:8000/api/v1/recommendations",
+        headers={
+            "Authorization": bearer_auth(access_token)
+        }
+    )
+    assert response.status_code == status.HTTP_200_OK
+
+    # with invalid token
+    response = test_client.get(
+        "http://localhost:8000/api/v1/recommendations",
+        headers={
+            "Authorization": bearer_auth(f"{access_token}invalid")
+        }
+    )
+    assert response.status_code == status.HTTP_401_UNAUTHORIZED
+    assert response.json()["meta"]["message"] == "Invalid token"
+
+
+def test_logout(test_client):
+    # without auth header
+    response = test_client.post("http://localhost:8000/api/v1/auth/logout")
+    assert response.status_code == status.HTTP_401_UNAUTHORIZED
+    assert response.json()["meta"]["message"] == "Not authenticated"
+
+    # correct one
+    response = test_client.post(
+        "http://localhost:8000/api/v1/auth/token",
+        headers={
+            "Authorization": basic_auth("user", "user123")
+        }
+    )
+    access_token = response.json()["data"]["access_token"]
+
+    response = test_client.post(
+        "http://localhost:8000/api/v1/auth/logout",
+        headers={
+            "Authorization": bearer_auth(access_token)
+        }
+    )
+    assert response.status_code == status.HTTP_200_OK
+
+    response = test_client.get(
+        "http://localhost:8000/api/v1/recommendations",
+        headers={
+            "Authorization": bearer_auth(access_token)
+        }
+    )
+    assert response.status_code == status.HTTP_401_UNAUTHORIZED
+    assert response.json()["meta"]["message"] == "Token has been revoked"
@@ -0,0 +1,140 @@
+import asyncio
+import importlib.util
+from pathlib import Path
+
+import pytest
+import pytest_asyncio
+from sqlalchemy import delete, insert, select
+
+from core.database.base import get_async_session
+from core.database.models import User
+from core.dependencies import authenticate_user
+from core.exceptions import HTTPException
+from core.passwords import (
+    SCRYPT_N,
+    check_password,
+    hash_password,
+    is_password_hashed,
+    needs_rehash,
+    verify_password
+)
+
+MIGRATIONS_PATH = Path(__file__).parents[4] / "migrations" / "versions"
+
+
+@pytest_asyncio.fixture(scope='session')
+def event_loop(request):
+    """Create an instance of the default event loop for each test case."""
+    loop = asyncio.get_event_loop_policy().new_event_loop()
+    yield loop
+    loop.close()
+
+
+@pytest_asyncio.fixture(scope="function")
+async def db_session():
+    session_object = get_async_session()()
+    yield session_object
+    await session_object.execute(
+        delete(User).where(User.username.startswith("test_password_"))
+    )
+    await session_object.commit()
+    await session_object.close()
+
+
+def test_hash_password():
+    password_hash = hash_password("secret")
+    algorithm, n, r, p, salt, key = password_hash.split("$")
+    assert algorithm == "scrypt"
+    assert int(n) == SCRYPT_N
+    assert is_password_hashed(password_hash)
+    assert not needs_rehash(password_hash)
+    # the salt is random
+    assert hash_password("secret") != password_hash
+
+    assert check_password("secret", password_hash)
+    assert not check_password("Secret", password_hash)
+    assert not check_password("", password_hash)
+
+
+def test_check_plaintext_password():
+    # stored before hashing was introduced
+    assert not is_password_hashed("secret")
+    assert check_password("secret", "secret")
+    assert not check_password("other", "secret")
+    assert needs_rehash("secret")
+
+
+def test_check_malformed_password_hash():
+    valid_hash = hash_password("secret")
+    _, n, r, p, salt, key = valid_hash.split("$")
+    malformed_hashes = [
+        "scrypt$",
+        f"scrypt${n}${r}${p}${salt}",
+        f"scrypt$abc${r}${p}${salt}${key}",
+        # not a power of 2
+        f"scrypt$3${r}${p}${salt}${key}",
+        f"scrypt${n}$-1${p}${salt}${key}",
+        f"scrypt${2 ** 70}${r}${p}${salt}${key}",
+        f"scrypt${n}${r}${p}$not-base64!${key}"
+    ]
+    for malformed_hash in malformed_hashes:
+        assert not check_password("secret", malformed_hash), malformed_hash
+
+    # a hash with weaker parameters is made again
+    assert needs_rehash(f"scrypt${SCRYPT_N // 2}${r}${p}${salt}${key}")
+    assert needs_rehash("scrypt$abc")
+
+
+@pytest.mark.asyncio
+async def test_verify_password():
+    password_hash = hash_password("secret")
+    assert await verify_password("secret", password_hash)
+    # answered from the cache of the verified credentials
+    assert await verify_password("secret", password_hash)
+    assert not await verify_password("other", password_hash)
+    assert not await verify_password("secret", "scrypt$3$8$1$c2FsdA==$a2V5")
+
+
+@pytest.mark.asyncio
+async def test_rehash_on_login(db_session):
+    await db_session.execute(
+        insert(User).values(username="test_password_user", password="secret", is_privileged=False)
+    )
+    await db_session.commit()
+
+    with pytest.raises(HTTPException) as he:
+        await authenticate_user(db_session, username="test_password_user", password="other")
+    assert he.value.message == "Incorrect username or password"
+
+    # the plaintext password is hashed on the first login
+    await authenticate_user(db_session, username="test_password_user", password="secret")
+    await db_session.commit()
+    result = await db_session.execute(
+        select(User.password).where(User.username == "test_password_user")
+    )
+    password_hash = result.scalar_one()
+    assert is_password_hashed(password_hash)
+    assert check_password("secret", password_hash)
+
+    # and the hash is kept on the next ones
+    await authenticate_user(db_session, username="test_password_user", password="secret")
+    await db_session.commit()
+    result = await db_session.execute(
+        select(User.password).where(User.username == "test_password_user")
+    )
+    assert result.scalar_one() == password_hash
+
+
+def test_migration_password_hash():
+    """
+    The migration hashing the plaintext passwords has its own copy of the hashing
+    """
+    migration_path = next(MIGRATIONS_PATH.glob("8b2e4c6d1f03_*.py"))
+    spec = importlib.util.spec_from_file_location("hash_user_passwords", migration_path)
+    migration = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(migration)
+
+    password_hash = migration.hash_password("secret")
+    assert check_password("secret", password_hash)
+    assert not check_password("other", password_hash)
+    assert not needs_rehash(password_hash)
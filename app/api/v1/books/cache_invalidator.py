@@ -0,0 +1,147 @@
+"""
+Drops the cached entries of the books changed outside of the API, e.g. by a migration,
+a bulk job or by hand. The DB notifies every change of a book or of its reviews on the
+cache_invalidation channel and the notifications are applied in batches. It runs in the
+background of every worker and can be run on its own:
+    python -m api.v1.books.cache_invalidator
+"""
+import asyncio
+
+import asyncpg
+from sqlalchemy import make_url
+
+from api.v1.books.utils import BOOKS_TAG
+from core.caching.redis import RedisClient, close_redis_connection, get_redis_connection
+from core.config import get_config
+from core.logger import logger
+from core.metrics import Counter
+
+config = get_config()
+
+INVALIDATION_CHANNEL = "cache_invalidation"
+# Refreshed by every listening worker. If it has expired, nobody was listening for a while
+HEARTBEAT_KEY = "cache_invalidation:heartbeat"
+HEARTBEAT_INTERVAL = 5.0
+
+cache_invalidation_notifications = Counter(
+    "cache_invalidation_notifications_total",
+    "Number of book changes notified by the DB"
+)
+cache_invalidation_batches = Counter(
+    "cache_invalidation_batches_total",
+    "Number of batches of invalidated books"
+)
+
+
+def get_listener_dsn() -> str:
+    """
+    Returns the URL of the primary for asyncpg. The notifications are only sent by the primary
+    """
+    url = make_url(config.postgres_url.unicode_string()).set(drivername="postgresql")
+    return url.render_as_string(hide_password=False)
+
+
+class BookCacheInvalidator:
+    """
+    Collects the ids of the changed books and invalidates their keys. A book changed
+    many times in a batch is invalidated once. The app still invalidates its own writes
+    right after the commit, so it reads them back at once. The notifications of these
+    writes only delete the keys a second time.
+    """
+
+    def __init__(self):
+        self.book_ids: set[str] = set()
+        # Set if one of the changes can alter the book lists
+        self.is_list_changed = False
+        self.has_changes = asyncio.Event()
+
+    def receive(self, _connection, _pid: int, _channel: str, payload: str):
+        scope, _, book_id = payload.partition(":")
+        self.book_ids.add(book_id)
+        self.is_list_changed = self.is_list_changed or scope == "books"
+        cache_invalidation_notifications.inc()
+        self.has_changes.set()
+
+    async def flush(self):
+        """
+        Invalidates the books collected so far, batch_size books per round trip. A batch that
+        can't reach redis is kept by the redis client and retried, so no change is lost
+        """
+        book_ids, is_list_changed = list(self.book_ids), self.is_list_changed
+        self.book_ids, self.is_list_changed = set(), False
+        self.has_changes.clear()
+        redis_client = RedisClient()
+        batch_size = config.cache_invalidation.batch_size
+        for start in range(0, len(book_ids), batch_size):
+            batch = book_ids[start:start + batch_size]
+            tags = [f"book:{book_id}" for book_id in batch]
+            if is_list_changed and start == 0:
+                tags.append(BOOKS_TAG)
+            await redis_client.invalidate_tags(tags=tags, keys=[f"book:{book_id}" for book_id in batch])
+            cache_invalidation_batches.inc()
+
+    async def listen(self, is_reconnect: bool):
+        """
+        Listens to the notifications on a dedicated connection, outside the pool, and
+        flushes them every batch_interval seconds. Returns when the connection is lost.
+        The changes made while nobody listened were not notified. So, after a reconnect, or
+        if no other worker was listening, every cached entry is dropped
+        """
+        connection = await asyncpg.connect(get_listener_dsn())
+        is_closed = asyncio.Event()
+        connection.add_termination_listener(lambda _: is_closed.set())
+        try:
+            await connection.add_listener(INVALIDATION_CHANNEL, self.receive)
+            logger.info("Cache invalidator - listening")
+            redis_connection = get_redis_connection()
+            heartbeat = await RedisClient.execute(lambda: redis_connection.get(HEARTBEAT_KEY))
+            if is_reconnect or heartbeat is None:
+                logger.info("Cache invalidator - changes may have been missed, dropping the cache")
+                RedisClient.invalidate_all()
+            while not is_closed.is_set():
+                await RedisClient.execute(
+                    lambda: redis_connection.set(HEARTBEAT_KEY, 1, ex=int(HEARTBEAT_INTERVAL * 3))
+                )
+                has_changes = asyncio.create_task(self.has_changes.wait())
+                closed = asyncio.create_task(is_closed.wait())
+                try:
+                    await asyncio.wait(
+                        [has_changes, closed], timeout=HEARTBEAT_INTERVAL, return_when=asyncio.FIRST_COMPLETED
+                    )
+                finally:
+                    has_changes.cancel()
+                    closed.cancel()
+                if self.has_changes.is_set():
+                    # Lets the rest of a bulk write arrive
+                    await asyncio.sleep(config.cache_invalidation.batch_interval)
+                    await self.flush()
+        finally:
+            if not connection.is_closed():
+                await connection.close()
+
+    async def run(self):
+        """
+        Listens until cancelled, and listens again whenever the connection is lost
+        """
+        is_reconnect = False
+        while True:
+            try:
+                await self.listen(is_reconnect=is_reconnect)
+                logger.info("Cache invalidator - connection lost")
+            except (OSError, asyncpg.PostgresError) as e:
+                logger.error(f"Cache invalidator failed - {e}")
+            is_reconnect = True
+            # The changes received before the connection was lost
+            await self.flush()
+            await asyncio.sleep(config.cache_invalidation.reconnect_interval)
+
+
+async def main():
+    try:
+        await BookCacheInvalidator().run()
+    finally:
+        await close_redis_connection()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,97 @@
+"""
+Loads the most requested books into the cache, so a deploy or a flushed redis doesn't send
+every book read to the DB. It runs in the background on startup and can be run by hand:
+    python -m api.v1.books.cache_warmer --top 1000
+"""
+import argparse
+import asyncio
+import time
+
+import redis.asyncio as redis
+
+from core.caching.access_counter import book_access_counter
+from core.caching.redis import RedisClient, close_redis_connection, get_redis_connection
+from core.config import get_config
+from core.database.base import dispose_async_engine, get_async_session
+from core.database.replicas import dispose_replica_engines
+from core.helpers.db_helper import DbHelper
+from core.logger import logger
+from core.schemas import BookSchema
+
+config = get_config()
+
+# Taken by the worker that warms the cache on startup, so the other workers don't
+WARMER_LOCK_KEY = "cache_warmer:lock"
+WARMER_LOCK_TTL = 60
+
+
+async def warm_book_cache(top_n: int, batch_size: int, rate: float) -> int:
+    """
+    Loads the top_n most read books into the cache in batches, with one query and one
+    pipelined redis round trip per batch. At most rate books per second are loaded.
+    Returns the number of books written to the cache
+    """
+    book_ids = await book_access_counter.get_top(top_n)
+    redis_client = RedisClient()
+    db_session = get_async_session()()
+    db_helper = DbHelper(db_session=db_session)
+    warmed = 0
+    try:
+        for start in range(0, len(book_ids), batch_size):
+            started_at = time.monotonic()
+            batch = book_ids[start:start + batch_size]
+            books = await db_helper.get_books_by_ids(book_ids=batch)
+            # Books that are already cached with the same version are skipped by redis
+            warmed += await redis_client.set_versioned_cache_many([
+                (f"book:{book.id}", BookSchema.model_validate(book).model_dump(), book.version)
+                for book in books
+            ])
+            # Ends the read transaction, so the connection goes back to the pool in between the batches
+            await db_session.rollback()
+            logger.info(f"Cache warmer - {start + len(batch)}/{len(book_ids)} books loaded, {warmed} written")
+            await asyncio.sleep(max(0.0, len(batch) / rate - (time.monotonic() - started_at)))
+    finally:
+        await db_session.close()
+    return warmed
+
+
+async def warm_book_cache_on_startup():
+    """
+    Warms the cache from one worker only. The workers of a deploy start together, so
+    the first one takes the lock and the others skip it
+    """
+    try:
+        is_locked = await get_redis_connection().set(WARMER_LOCK_KEY, 1, nx=True, ex=WARMER_LOCK_TTL)
+    except redis.RedisError as er:
+        logger.info(f"Redis error - {er}")
+        return
+    if not is_locked:
+        return
+    try:
+        await warm_book_cache(
+            top_n=config.cache_warmer.top_n,
+            batch_size=config.cache_warmer.batch_size,
+            rate=config.cache_warmer.rate
+        )
+    except Exception as e:
+        # A cold cache is slower, not broken. So, the app keeps running
+        logger.error(f"Cache warmer failed - {e}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Loads the most requested books into the cache")
+    parser.add_argument("--top", type=int, default=config.cache_warmer.top_n)
+    parser.add_argument("--batch-size", type=int, default=config.cache_warmer.batch_size)
+    parser.add_argument("--rate", type=float, default=config.cache_warmer.rate, help="Books per second")
+    args = parser.parse_args()
+    try:
+        warmed = await warm_book_cache(top_n=args.top, batch_size=args.batch_size, rate=args.rate)
+        logger.info(f"Cache warmer - done, {warmed} books written")
+    finally:
+        await dispose_async_engine()
+        await dispose_replica_engines()
+        await close_redis_connection()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,73 @@
+"""
+Recounts the rating histograms of the books from their reviews. The histograms are kept
+up to date by a trigger on the reviews, so this only fixes histograms changed by hand,
+e.g. after restoring the reviews from a backup:
+    python -m api.v1.books.rating_histograms --batch-size 500
+"""
+import argparse
+import asyncio
+from typing import AsyncIterator
+
+from core.caching.redis import RedisClient, close_redis_connection
+from core.database.base import dispose_async_engine, get_async_session
+from core.database.replicas import dispose_replica_engines
+from core.helpers.db_helper import DbHelper
+from core.logger import logger
+
+
+async def get_batches(db_helper: DbHelper, batch_size: int, book_ids: list[str] | None) -> AsyncIterator[list[str]]:
+    """
+    Yields the given book ids, or the ids of all the books, in batches
+    """
+    if book_ids:
+        for start in range(0, len(book_ids), batch_size):
+            yield book_ids[start:start + batch_size]
+        return
+    last_id = ""
+    while batch := await db_helper.get_book_ids_after(after=last_id, limit=batch_size):
+        yield batch
+        last_id = batch[-1]
+
+
+async def recompute_rating_histograms(batch_size: int, book_ids: list[str] | None = None) -> int:
+    """
+    Recounts the histograms of the given books, or of all the books, in batches. Every
+    batch is committed on its own, so the rows are not locked for the whole run. The
+    cache of the fixed books is dropped. Returns the number of histograms that were wrong
+    """
+    redis_client = RedisClient()
+    db_session = get_async_session()()
+    db_helper = DbHelper(db_session=db_session)
+    fixed = 0
+    try:
+        async for batch in get_batches(db_helper, batch_size, book_ids):
+            fixed_ids = await db_helper.recompute_rating_histograms(book_ids=batch)
+            await db_helper.commit()
+            if not fixed_ids:
+                continue
+            fixed += len(fixed_ids)
+            await redis_client.invalidate_tags(
+                tags=[f"book:{book_id}" for book_id in fixed_ids], keys=[f"book:{book_id}" for book_id in fixed_ids]
+            )
+            logger.info(f"Rating histograms - fixed {', '.join(fixed_ids)}")
+    finally:
+        await db_session.close()
+    return fixed
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Recounts the rating histograms of the books")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--book-id", action="append", dest="book_ids", help="Only this book. Can be repeated")
+    args = parser.parse_args()
+    try:
+        fixed = await recompute_rating_histograms(batch_size=args.batch_size, book_ids=args.book_ids)
+        logger.info(f"Rating histograms - done, {fixed} fixed")
+    finally:
+        await dispose_async_engine()
+        await dispose_replica_engines()
+        await close_redis_connection()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
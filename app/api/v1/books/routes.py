@@ -1,21 +1,43 @@
-from typing import Annotated
+from typing import Annotated, Literal
 
-from fastapi import Depends, Query, Path
+from fastapi import Depends, Header, Query, Path
 from fastapi.routing import APIRouter
 from fastapi.responses import JSONResponse
 from pydantic import AfterValidator
 from sqlalchemy.ext.asyncio import AsyncSession
 from starlette import status
-
-from api.v1.books.utils import BookUtils
-from core.dependencies import get_db_session, get_current_user
-from core.responses import generate_json_response
-from core.schemas import BookSchema, ReviewSchema, UserSchema
+from starlette.requests import Request
+from starlette.responses import Response
+
+from api.v1.books.utils import DEFAULT_BOOK_PAGE_REVIEWS, BookUtils
+from core.dependencies import RateLimiter, get_db_session, get_current_user
+from core.responses import (
+    generate_cache_headers,
+    generate_etag,
+    generate_json_response,
+    generate_not_modified_response,
+    is_etag_matching
+)
+from core.schemas import BookSchema, BookUpdateSchema, ReviewSchema, UserSchema
 
 book_route = APIRouter(prefix="/books")
 
+# The largest page of books, which costs 11 tokens, well within the bucket of a user
+MAX_PAGE_SIZE = 1000
+
+
+def get_page_size_cost(request: Request) -> int:
+    """
+    Large pages cost more. Every 100 books of the page size costs one more token
+    """
+    try:
+        page_size = int(request.query_params.get("pageSize", 25))
+    except ValueError:
+        page_size = 25
+    return 1 + max(page_size, 0) // 100
 
-@book_route.post("")
+
+@book_route.post("", dependencies=[Depends(RateLimiter())])
 async def create_a_book(
     db_session: Annotated[AsyncSession, Depends(get_db_session)],
     _: Annotated[UserSchema, Depends(get_current_user)],
@@ -30,38 +52,57 @@ async def create_a_book(
     )
 
 
-@book_route.get("")
+@book_route.get("", dependencies=[Depends(RateLimiter(cost=get_page_size_cost))])
 async def get_all_books(
     db_session: Annotated[AsyncSession, Depends(get_db_session)],
     _: Annotated[UserSchema, Depends(get_current_user)],
     current_page: Annotated[int, Query(alias="currentPage", gt=0)] = 1,
-    page_size: Annotated[int, Query(alias="pageSize", gt=0)] = 25
+    page_size: Annotated[int, Query(alias="pageSize", gt=0, le=MAX_PAGE_SIZE)] = 25,
+    fields: Annotated[str | None, Query(description="Comma separated fields of the books to return")] = None,
+    genre: Annotated[str | None, Query(min_length=1)] = None,
+    author: Annotated[str | None, Query(min_length=1)] = None,
+    year_from: Annotated[int | None, Query(alias="yearFrom")] = None,
+    year_to: Annotated[int | None, Query(alias="yearTo")] = None,
+    sort_by: Annotated[Literal["title", "year", "rating"] | None, Query(alias="sortBy")] = None,
+    cursor: Annotated[str | None, Query(description="next_cursor of the previous page. Replaces currentPage")] = None
 ) -> JSONResponse:
     book_utils = BookUtils(db_session=db_session)
-    all_books = await book_utils.retrieve_all_books(page_size=page_size, current_page=current_page)
+    books_page = await book_utils.retrieve_books_page(
+        page_size=page_size,
+        current_page=current_page,
+        fields=fields.split(",") if fields else None,
+        filters={"genre": genre, "author": author, "year_from": year_from, "year_to": year_to},
+        sort_by=sort_by,
+        cursor=cursor
+    )
     return generate_json_response(
         status_code=status.HTTP_200_OK,
         message="Books are fetched",
-        data={"books": all_books}
+        data=books_page
     )
 
 
-@book_route.get("/{book_id}")
+@book_route.get("/{book_id}", dependencies=[Depends(RateLimiter())])
 async def get_book_by_id(
     db_session: Annotated[AsyncSession, Depends(get_db_session)],
     _: Annotated[UserSchema, Depends(get_current_user)],
-    book_id: Annotated[str, AfterValidator(lambda x: x.strip()), Path(min_length=1)]
-) -> JSONResponse:
+    book_id: Annotated[str, AfterValidator(lambda x: x.strip()), Path(min_length=1)],
+    if_none_match: Annotated[str | None, Header()] = None
+) -> Response:
     book_utils = BookUtils(db_session=db_session)
     book = await book_utils.retrieve_a_book(book_id=book_id)
+    etag = generate_etag(book_id=book_id, version=book["version"], representation="book")
+    if is_etag_matching(if_none_match=if_none_match, etag=etag):
+        return generate_not_modified_response(etag=etag)
     return generate_json_response(
         status_code=status.HTTP_200_OK,
         message="Book is fetched",
-        data={"book": book}
+        data={"book": book},
+        headers=generate_cache_headers(etag=etag)
     )
 
 
-@book_route.put("/{book_id}")
+@book_route.put("/{book_id}", dependencies=[Depends(RateLimiter())])
 async def update_book_by_id(
     db_session: Annotated[AsyncSession, Depends(get_db_session)],
     _: Annotated[UserSchema, Depends(get_current_user)],
@@ -69,14 +110,31 @@ async def update_book_by_id(
     payload: BookSchema
 ) -> JSONResponse:
     book_utils = BookUtils(db_session=db_session)
-    await book_utils.update_book(book_id=book_id, payload=payload)
+    book = await book_utils.update_book(book_id=book_id, payload=payload)
     return generate_json_response(
         status_code=status.HTTP_200_OK,
-        message="Updated successfully"
+        message="Updated successfully",
+        data={"book": book}
     )
 
 
-@book_route.delete("/{book_id}")
+@book_route.patch("/{book_id}", dependencies=[Depends(RateLimiter())])
+async def partially_update_book_by_id(
+    db_session: Annotated[AsyncSession, Depends(get_db_session)],
+    _: Annotated[UserSchema, Depends(get_current_user)],
+    book_id: Annotated[str, AfterValidator(lambda x: x.strip()), Path(min_length=1)],
+    payload: BookUpdateSchema
+) -> JSONResponse:
+    book_utils = BookUtils(db_session=db_session)
+    book = await book_utils.update_book(book_id=book_id, payload=payload)
+    return generate_json_response(
+        status_code=status.HTTP_200_OK,
+        message="Updated successfully",
+        data={"book": book}
+    )
+
+
+@book_route.delete("/{book_id}", dependencies=[Depends(RateLimiter())])
 async def delete_book_by_id(
     db_session: Annotated[AsyncSession, Depends(get_db_session)],
     _: Annotated[UserSchema, Depends(get_current_user)],
@@ -90,7 +148,7 @@ async def delete_book_by_id(
     )
 
 
-@book_route.post("/{book_id}/reviews")
+@book_route.post("/{book_id}/reviews", dependencies=[Depends(RateLimiter())])
 async def add_a_review(
     db_session: Annotated[AsyncSession, Depends(get_db_session)],
     current_user: Annotated[UserSchema, Depends(get_current_user)],
@@ -106,31 +164,74 @@ async def add_a_review(
     )
 
 
-@book_route.get("/{book_id}/reviews")
+@book_route.get("/{book_id}/reviews", dependencies=[Depends(RateLimiter())])
 async def get_all_reviews(
     db_session: Annotated[AsyncSession, Depends(get_db_session)],
     _: Annotated[UserSchema, Depends(get_current_user)],
-    book_id: Annotated[str, AfterValidator(lambda x: x.strip()), Path(min_length=1)]
-) -> JSONResponse:
+    book_id: Annotated[str, AfterValidator(lambda x: x.strip()), Path(min_length=1)],
+    if_none_match: Annotated[str | None, Header()] = None
+) -> Response:
     book_utils = BookUtils(db_session=db_session)
+    # The version is read before the reviews. So, the ETag can only be older than the
+    # content and never makes a client keep outdated reviews
+    etag = generate_etag(
+        book_id=book_id,
+        version=await book_utils.retrieve_book_version(book_id=book_id),
+        representation="reviews"
+    )
+    if is_etag_matching(if_none_match=if_none_match, etag=etag):
+        return generate_not_modified_response(etag=etag)
     reviews = await book_utils.retrieve_all_reviews(book_id=book_id)
     return generate_json_response(
         status_code=status.HTTP_200_OK,
         message="Reviews are fetched",
-        data={"reviews": reviews}
+        data={"reviews": reviews},
+        headers=generate_cache_headers(etag=etag)
     )
 
 
-@book_route.get("/{book_id}/summary")
+@book_route.get("/{book_id}/summary", dependencies=[Depends(RateLimiter())])
 async def get_summary_and_rating(
     db_session: Annotated[AsyncSession, Depends(get_db_session)],
     _: Annotated[UserSchema, Depends(get_current_user)],
-    book_id: Annotated[str, AfterValidator(lambda x: x.strip()), Path(min_length=1)]
-) -> JSONResponse:
+    book_id: Annotated[str, AfterValidator(lambda x: x.strip()), Path(min_length=1)],
+    if_none_match: Annotated[str | None, Header()] = None
+) -> Response:
     book_utils = BookUtils(db_session=db_session)
+    etag = generate_etag(
+        book_id=book_id,
+        version=await book_utils.retrieve_book_version(book_id=book_id),
+        representation="summary"
+    )
+    if is_etag_matching(if_none_match=if_none_match, etag=etag):
+        return generate_not_modified_response(etag=etag)
     summary_and_ratings = await book_utils.retrieve_summary_and_rating(book_id=book_id)
     return generate_json_response(
         status_code=status.HTTP_200_OK,
         message="Summary and ratings are fetched",
-        data={"summary": summary_and_ratings}
+        data={"summary": summary_and_ratings},
+        headers=generate_cache_headers(etag=etag)
+    )
+
+
+@book_route.get("/{book_id}/page", dependencies=[Depends(RateLimiter())])
+async def get_book_page(
+    db_session: Annotated[AsyncSession, Depends(get_db_session)],
+    _: Annotated[UserSchema, Depends(get_current_user)],
+    book_id: Annotated[str, AfterValidator(lambda x: x.strip()), Path(min_length=1)],
+    reviews_page_size: Annotated[int, Query(alias="reviewsPageSize", gt=0, le=100)] = DEFAULT_BOOK_PAGE_REVIEWS,
+    if_none_match: Annotated[str | None, Header()] = None
+) -> Response:
+    book_utils = BookUtils(db_session=db_session)
+    book = await book_utils.retrieve_a_book(book_id=book_id)
+    # The page holds as many reviews as requested, so every page size is its own representation
+    etag = generate_etag(book_id=book_id, version=book["version"], representation=f"page-{reviews_page_size}")
+    if is_etag_matching(if_none_match=if_none_match, etag=etag):
+        return generate_not_modified_response(etag=etag)
+    book_page = await book_utils.retrieve_book_page(book=book, reviews_page_size=reviews_page_size)
+    return generate_json_response(
+        status_code=status.HTTP_200_OK,
+        message="Book page is fetched",
+        data=book_page,
+        headers=generate_cache_headers(etag=etag)
     )
@@ -0,0 +1,398 @@
+import asyncio
+import time
+from collections import Counter
+
+import pytest
+import pytest_asyncio
+import redis.asyncio as redis
+from sqlalchemy import delete, insert, select, update
+
+from api.v1.books.cache_invalidator import HEARTBEAT_KEY, BookCacheInvalidator
+from api.v1.books.cache_warmer import WARMER_LOCK_KEY, warm_book_cache_on_startup
+from core.caching import redis as redis_cache
+from core.caching.access_counter import BOOK_ACCESS_KEY, book_access_counter
+from core.caching.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+from core.caching.redis import PendingInvalidations, RedisClient, get_redis_connection
+from core.caching.serializers import COMPRESSED_FLAG, FORMAT_JSON, FORMAT_MSGPACK, CacheSerializer
+from core.config import get_config
+from core.database.base import get_async_session
+from core.database.models import Book, Review, User
+from core.deadlines import deadline
+
+config = get_config()
+
+
+@pytest_asyncio.fixture(scope='session')
+def event_loop(request):
+    """Create an instance of the default event loop for each test case."""
+    loop = asyncio.get_event_loop_policy().new_event_loop()
+    yield loop
+    loop.close()
+
+
+@pytest_asyncio.fixture(scope="function")
+async def db_session():
+    session_object = get_async_session()()
+    yield session_object
+    await session_object.execute(
+        delete(Book)
+    )
+    await session_object.commit()
+    await session_object.close()
+
+
+@pytest.fixture(scope="function")
+def circuit_breaker(monkeypatch):
+    circuit_breaker = CircuitBreaker(
+        name="test", failure_threshold=2, slow_call_threshold=0.1, reset_timeout=0.1
+    )
+    monkeypatch.setattr(redis_cache, "redis_circuit_breaker", circuit_breaker)
+    yield circuit_breaker
+
+
+@pytest.fixture(scope="function")
+def pending_invalidations(monkeypatch):
+    pending_invalidations = PendingInvalidations()
+    monkeypatch.setattr(redis_cache, "pending_invalidations", pending_invalidations)
+    yield pending_invalidations
+
+
+@pytest_asyncio.fixture(scope="function")
+async def redis_connection():
+    connection = get_redis_connection(decode_responses=False)
+    yield connection
+    for pattern in ["book:test_*", "tag:test_*"]:
+        async for key in connection.scan_iter(match=pattern):
+            await connection.delete(key)
+
+
+@pytest.mark.asyncio
+async def test_circuit_breaker(circuit_breaker):
+    assert circuit_breaker.state == CLOSED
+
+    # opens after failure_threshold consecutive failures, a slow call being one
+    circuit_breaker.record_failure()
+    assert circuit_breaker.state == CLOSED
+    circuit_breaker.record_success(0.5)
+    assert circuit_breaker.state == OPEN
+    assert not circuit_breaker.allow_request()
+
+    # a single probe is let through after the reset timeout
+    await asyncio.sleep(0.15)
+    assert circuit_breaker.allow_request()
+    assert circuit_breaker.state == HALF_OPEN
+    assert not circuit_breaker.allow_request()
+
+    # opens again if the probe fails
+    circuit_breaker.record_failure()
+    assert circuit_breaker.state == OPEN
+    assert not circuit_breaker.allow_request()
+
+    # and closes if it succeeds
+    await asyncio.sleep(0.15)
+    assert circuit_breaker.allow_request()
+    circuit_breaker.record_success(0.01)
+    assert circuit_breaker.state == CLOSED
+    assert circuit_breaker.failures == 0
+    assert circuit_breaker.allow_request()
+
+    # a probe that never reported back is replaced after the reset timeout
+    circuit_breaker.record_failure()
+    circuit_breaker.record_failure()
+    await asyncio.sleep(0.15)
+    assert circuit_breaker.allow_request()
+    assert not circuit_breaker.allow_request()
+    await asyncio.sleep(0.15)
+    assert circuit_breaker.allow_request()
+
+
+@pytest.mark.asyncio
+async def test_execute_with_open_circuit_breaker(circuit_breaker, pending_invalidations):
+    async def failing_command():
+        raise redis.ConnectionError("Connection refused")
+
+    assert await RedisClient.execute(failing_command, default="miss") == "miss"
+    assert await RedisClient.execute(failing_command, default="miss") == "miss"
+    assert circuit_breaker.state == OPEN
+
+    # redis is not even called while the breaker is open
+    async def command():
+        raise AssertionError("Called while the circuit breaker is open")
+
+    assert await RedisClient.execute(command, default="miss") == "miss"
+
+    async def working_command():
+        return "hit"
+
+    await asyncio.sleep(0.15)
+    assert await RedisClient.execute(working_command, default="miss") == "hit"
+    assert circuit_breaker.state == CLOSED
+
+
+@pytest.mark.asyncio
+async def test_execute_timeout(circuit_breaker, pending_invalidations):
+    async def timing_out_command():
+        raise redis.TimeoutError("Timeout reading from socket")
+
+    # the timeout is a cache miss, and counts as a failure
+    assert await RedisClient.execute(timing_out_command) is None
+    assert circuit_breaker.failures == 1
+
+    async def slow_command():
+        await asyncio.sleep(1)
+        return "hit"
+
+    # past the deadline of the request, the call is given up. It is not a failure of redis
+    started_at = time.monotonic()
+    with deadline(0.05):
+        assert await RedisClient.execute(slow_command, default="miss") == "miss"
+    assert time.monotonic() - started_at < 0.5
+    assert circuit_breaker.failures == 1
+
+    # no time left, so the call is not even made
+    with deadline(0):
+        assert await RedisClient.execute(slow_command, default="miss") == "miss"
+
+
+@pytest.mark.asyncio
+async def test_pending_invalidations(circuit_breaker, pending_invalidations, redis_connection):
+    redis_client = RedisClient()
+    await redis_client.set_cache("book:test_1", "value")
+
+    # the deletion that couldn't reach redis is applied before the next command
+    pending_invalidations.add(keys=["book:test_1"])
+    assert await redis_client.get_cache("book:test_1") is None
+    assert not pending_invalidations
+
+
+@pytest.mark.asyncio
+async def test_pending_invalidations_overflow(
+    circuit_breaker, pending_invalidations, redis_connection, monkeypatch
+):
+    monkeypatch.setattr(pending_invalidations, "max_size", 2)
+    redis_client = RedisClient()
+    await redis_client.set_many([("book:test_1", "value", None), ("book:test_2", "value", None)], tags=["test_tag"])
+
+    # past max_size, the invalidations are no longer tracked one by one
+    pending_invalidations.add(keys=["book:test_1", "book:test_2"], tags=["test_tag"])
+    assert pending_invalidations.is_overflowed
+    assert not pending_invalidations.keys and not pending_invalidations.tags
+
+    # and the cache is bypassed, even if redis is fine
+    async def command():
+        raise AssertionError("Called while the cache is bypassed")
+
+    assert await redis_client.execute(command, default="miss") == "miss"
+    assert await redis_client.get_cache("book:test_1") is None
+    assert await redis_connection.exists("book:test_1", "book:test_2") == 2
+
+    # every cached entry is dropped in the background
+    await pending_invalidations.retry(redis_connection)
+    assert pending_invalidations.is_overflowed
+    await pending_invalidations.retry(redis_connection, include_all=True)
+    assert not pending_invalidations
+    assert await redis_connection.exists("book:test_1", "book:test_2", "tag:test_tag") == 0
+    await redis_client.set_cache("book:test_1", "value")
+    assert await redis_client.get_cache("book:test_1") == "value"
+
+
+@pytest.mark.asyncio
+async def test_warm_book_cache_on_startup(db_session, redis_connection, monkeypatch):
+    result = await db_session.execute(
+        insert(Book).values([
+            {"title": f"TestBookWarm{i}", "author": "TestAuthor", "genre": "TestGenre", "year_published": 2024}
+            for i in range(3)
+        ]).returning(Book.id)
+    )
+    book_ids = list(result.scalars().all())
+    await db_session.commit()
+    await redis_connection.delete(BOOK_ACCESS_KEY, WARMER_LOCK_KEY, *(f"book:{book_id}" for book_id in book_ids))
+    monkeypatch.setattr(config.cache_warmer, "top_n", 2)
+    monkeypatch.setattr(book_access_counter, "counts", Counter())
+
+    # the first book is the most read, the last one is never read
+    for book_id in [book_ids[0], book_ids[0], book_ids[1]]:
+        await book_access_counter.record(book_id)
+    await book_access_counter.flush()
+
+    redis_client = RedisClient()
+    try:
+        await warm_book_cache_on_startup()
+        for book_id in book_ids[:2]:
+            book, version = await redis_client.get_versioned_cache(key=f"book:{book_id}")
+            assert book["id"] == book_id
+            assert version == 1
+        assert await redis_client.get_versioned_cache(key=f"book:{book_ids[2]}") == (None, None)
+
+        # the other workers starting meanwhile skip it
+        await redis_connection.delete(f"book:{book_ids[0]}")
+        await warm_book_cache_on_startup()
+        assert await redis_client.get_versioned_cache(key=f"book:{book_ids[0]}") == (None, None)
+    finally:
+        await redis_connection.delete(BOOK_ACCESS_KEY, WARMER_LOCK_KEY, *(f"book:{book_id}" for book_id in book_ids))
+
+
+@pytest.mark.asyncio
+async def test_many_keys(circuit_breaker, pending_invalidations, redis_connection):
+    redis_client = RedisClient()
+    assert await redis_client.get_many([]) == []
+
+    await redis_client.set_many([("book:test_1", {"title": "TestBook"}, None), ("book:test_2", [1, 2], 60)])
+    assert await redis_client.get_many(["book:test_1", "book:test_3", "book:test_2"]) == [
+        {"title": "TestBook"}, None, [1, 2]
+    ]
+    # an entry without expire gets the configured ttl
+    assert 0 < await redis_connection.ttl("book:test_1") <= config.redis.ttl
+    assert 0 < await redis_connection.ttl("book:test_2") <= 60
+
+    await redis_client.delete_many(["book:test_1", "book:test_3"])
+    assert await redis_client.get_many(["book:test_1", "book:test_2"]) == [None, [1, 2]]
+    assert not pending_invalidations
+
+
+@pytest.mark.asyncio
+async def test_invalidate_tags(circuit_breaker, pending_invalidations, redis_connection):
+    redis_client = RedisClient()
+    await redis_client.set_many(
+        [(f"book:test_{i}", i, None) for i in range(3)], tags=["test_tag", "test_other_tag"]
+    )
+    await redis_client.set_versioned_cache("book:test_3", 3, version=1, tags=["test_tag"])
+    await redis_client.set_many([("book:test_4", 4, None)], tags=["test_other_tag"])
+    await redis_client.set_cache("book:test_5", 5)
+
+    # every key of the tag is deleted, along with the plain keys and the tag itself
+    deleted = await redis_client.invalidate_tags(tags=["test_tag"], keys=["book:test_5"])
+    assert deleted == 5
+    assert await redis_client.get_many([f"book:test_{i}" for i in range(6)]) == [None, None, None, None, 4, None]
+    assert not await redis_connection.exists("tag:test_tag")
+
+    # the keys of the other tag that are already deleted are skipped
+    assert await redis_client.invalidate_tags(tags=["test_other_tag"]) == 1
+    assert await redis_client.get_cache("book:test_4") is None
+
+    # if redis can't be reached, the invalidation is retried later
+    circuit_breaker.record_failure()
+    circuit_breaker.record_failure()
+    assert await redis_client.invalidate_tags(tags=["test_tag"], keys=["book:test_5"]) == 0
+    assert pending_invalidations.tags == {"test_tag"}
+    assert pending_invalidations.keys == {"book:test_5"}
+
+
+@pytest.mark.parametrize("use_msgpack", [True, False])
+def test_serializer_round_trip(use_msgpack):
+    serializer = CacheSerializer(use_msgpack=use_msgpack, compression_threshold=100)
+    value = {"title": "TestBook", "version": 2, "rating": 3.5, "reviews": [{"user": "user"}]}
+    large_value = {"summary": "A summary that compresses well. " * 20}
+
+    data = serializer.dumps(value)
+    assert data[0] == (FORMAT_MSGPACK if use_msgpack else FORMAT_JSON)
+    assert CacheSerializer.loads(data) == value
+
+    # above the threshold, the payload is compressed
+    data = serializer.dumps(large_value)
+    assert data[0] == (FORMAT_MSGPACK if use_msgpack else FORMAT_JSON) | COMPRESSED_FLAG
+    assert len(data) < len(large_value["summary"])
+    assert CacheSerializer.loads(data) == large_value
+
+    # a value written by the other format can be read as well
+    other_serializer = CacheSerializer(use_msgpack=not use_msgpack, compression_threshold=100)
+    assert CacheSerializer.loads(other_serializer.dumps(large_value)) == large_value
+
+
+@pytest.mark.asyncio
+async def test_serializer_unknown_format():
+    # written before the format byte was introduced
+    assert CacheSerializer.loads(b'{"title": "TestBook"}') == {"title": "TestBook"}
+
+    redis_client = RedisClient()
+    # an unknown format byte, a corrupted compressed value and an empty one are cache misses
+    for data in [bytes([0x05]) + b"payload", bytes([FORMAT_JSON | COMPRESSED_FLAG]) + b"not zlib", b""]:
+        with pytest.raises(ValueError):
+            CacheSerializer.loads(data)
+        assert redis_client.decode(data) is None
+    assert redis_client.decode(None) is None
+
+
+async def wait_until(condition, timeout: float = 5.0):
+    started_at = time.monotonic()
+    while not await condition():
+        assert time.monotonic() - started_at < timeout, "Timed out"
+        await asyncio.sleep(0.05)
+
+
+async def listener_has_started(connection) -> bool:
+    # The listener refreshes the heartbeat with a shorter ttl
+    return 0 < await connection.ttl(HEARTBEAT_KEY) <= 15
+
+
+async def is_missing(connection, *keys: str) -> bool:
+    return await connection.exists(*keys) == 0
+
+
+@pytest.mark.asyncio
+async def test_invalidate_on_notify(db_session, pending_invalidations, redis_connection):
+    result = await db_session.execute(
+        insert(Book).values(
+            title="TestBookNotify", author="TestAuthor", genre="TestGenre", year_published=2024
+        ).returning(Book.id)
+    )
+    book_id = result.scalar_one()
+    result = await db_session.execute(select(User.id).where(User.username == "user"))
+    user_id = result.scalar_one()
+    await db_session.commit()
+    # another worker is listening already, so nothing was missed
+    await redis_connection.set(HEARTBEAT_KEY, 1, ex=60)
+
+    redis_client = RedisClient()
+    book_cache_invalidator = BookCacheInvalidator()
+    listener = asyncio.create_task(book_cache_invalidator.listen(is_reconnect=False))
+    try:
+        await wait_until(lambda: listener_has_started(redis_connection))
+        assert not pending_invalidations.is_overflowed
+
+        # a change made outside of the API drops the book and the book lists
+        await redis_client.set_versioned_cache(f"book:{book_id}", {"id": book_id}, version=1)
+        await redis_client.set_many([("book_count:test", 1, None)], tags=["books"])
+        await db_session.execute(update(Book).where(Book.id == book_id).values(title="TestBookNotified"))
+        await db_session.commit()
+        await wait_until(lambda: is_missing(redis_connection, f"book:{book_id}", "book_count:test"))
+
+        # a new review drops the book, but not the book lists
+        await redis_client.set_versioned_cache(f"book:{book_id}", {"id": book_id}, version=2)
+        await redis_client.set_many([("book_count:test", 1, None)], tags=["books"])
+        await db_session.execute(
+            insert(Review).values(review_text="TestReview", rating=4, user_id=user_id, book_id=book_id)
+        )
+        await db_session.commit()
+        await wait_until(lambda: is_missing(redis_connection, f"book:{book_id}"))
+        assert await redis_client.get_cache("book_count:test") == 1
+    finally:
+        listener.cancel()
+        await asyncio.gather(listener, return_exceptions=True)
+        await redis_connection.delete(HEARTBEAT_KEY, "book_count:test", f"book:{book_id}")
+        await db_session.execute(delete(Review).where(Review.book_id == book_id))
+        await db_session.commit()
+
+
+@pytest.mark.parametrize("is_reconnect, has_heartbeat", [(True, True), (False, False)])
+@pytest.mark.asyncio
+async def test_drop_cache_when_changes_missed(pending_invalidations, redis_connection, is_reconnect, has_heartbeat):
+    await redis_connection.delete(HEARTBEAT_KEY)
+    if has_heartbeat:
+        await redis_connection.set(HEARTBEAT_KEY, 1, ex=60)
+
+    # after a reconnect, or if no other worker was listening, every cached entry is dropped
+    listener = asyncio.create_task(BookCacheInvalidator().listen(is_reconnect=is_reconnect))
+
+    async def is_overflowed() -> bool:
+        return pending_invalidations.is_overflowed
+
+    try:
+        await wait_until(is_overflowed)
+    finally:
+        listener.cancel()
+        await asyncio.gather(listener, return_exceptions=True)
+        await redis_connection.delete(HEARTBEAT_KEY)
+
+    # the cache is bypassed until the entries are dropped in the background
+    assert await RedisClient().get_cache("book:test_1") is None
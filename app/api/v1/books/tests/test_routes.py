@@ -1,12 +1,21 @@
-from base64 import b64encode
+import json
+from base64 import b64encode, urlsafe_b64encode
 
 import pytest
+import redis
+import redis.asyncio
 from httpx import AsyncClient
 from fastapi.testclient import TestClient
 from starlette import status
 
+from core.caching import rate_limiter
+from core.caching.circuit_breaker import CLOSED, redis_circuit_breaker
+from core.config import get_config
+from core.dependencies import db_checkouts, db_session_requests
 from main import application
 
+config = get_config()
+
 
 def basic_auth(username, password):
     token = b64encode(f"{username}:{password}".encode('utf-8')).decode("ascii")
@@ -20,6 +29,21 @@ def test_client():
     api_test_client.close()
 
 
+@pytest.fixture(scope="function")
+def small_rate_limit(monkeypatch):
+    """
+    Gives every user a bucket of 20 tokens that barely refills, and drops the buckets afterwards
+    """
+    monkeypatch.setattr(config.rate_limit, "capacity", 20)
+    monkeypatch.setattr(config.rate_limit, "refill_rate", 0.01)
+    yield
+    redis_client = redis.Redis(host=config.redis.host, port=config.redis.port)
+    for key in redis_client.scan_iter("rate_limit:*"):
+        redis_client.delete(key)
+    redis_client.close()
+    rate_limiter.local_rate_limiter.buckets.clear()
+
+
 def test_create_a_book(test_client):
     # without auth header
     response = test_client.post("http://localhost:8000/api/v1/books")
@@ -237,6 +261,17 @@ def test_get_all_books(test_client):
     assert response.json()["meta"]["message"] == ("Invalid value for pageSize in query. "
                                                   "Input should be greater than 0")
 
+    # with too large page_size
+    response = test_client.get(
+        "http://localhost:8000/api/v1/books?pageSize=1001",
+        headers={
+            "Authorization": basic_auth("user", "user123")
+        }
+    )
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.json()["meta"]["message"] == ("Invalid value for pageSize in query. "
+                                                  "Input should be less than or equal to 1000")
+
     # with invalid current_page
     response = test_client.get(
         "http://localhost:8000/api/v1/books?currentPage=-1",
@@ -248,6 +283,47 @@ def test_get_all_books(test_client):
     assert response.json()["meta"]["message"] == ("Invalid value for currentPage in query. "
                                                   "Input should be greater than 0")
 
+    # with invalid fields
+    response = test_client.get(
+        "http://localhost:8000/api/v1/books?fields=title,password",
+        headers={
+            "Authorization": basic_auth("user", "user123")
+        }
+    )
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.json()["meta"]["message"].startswith("Invalid value for fields in query")
+
+    # with invalid sortBy
+    response = test_client.get(
+        "http://localhost:8000/api/v1/books?sortBy=price",
+        headers={
+            "Authorization": basic_auth("user", "user123")
+        }
+    )
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.json()["meta"]["message"] == "Invalid value for sortBy in query"
+
+    # with invalid cursor
+    response = test_client.get(
+        "http://localhost:8000/api/v1/books?sortBy=year&cursor=invalid",
+        headers={
+            "Authorization": basic_auth("user", "user123")
+        }
+    )
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.json()["meta"]["message"] == "Invalid value for cursor in query"
+
+    # with a cursor whose year is not a number
+    cursor = urlsafe_b64encode(json.dumps(["2018", "test_book_id"]).encode("utf8")).decode("ascii")
+    response = test_client.get(
+        f"http://localhost:8000/api/v1/books?sortBy=year&cursor={cursor}",
+        headers={
+            "Authorization": basic_auth("user", "user123")
+        }
+    )
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.json()["meta"]["message"] == "Invalid value for cursor in query"
+
     # correct one
     response = test_client.get(
         "http://localhost:8000/api/v1/books",
@@ -257,6 +333,19 @@ def test_get_all_books(test_client):
     )
     assert response.status_code == status.HTTP_200_OK
     assert isinstance(response.json()["data"]["books"], list) is True
+    assert isinstance(response.json()["data"]["total"], int) is True
+    assert "Accept-Encoding" in response.headers["Vary"]
+    assert "Authorization" in response.headers["Vary"]
+
+    # served from the response cache
+    response = test_client.get(
+        "http://localhost:8000/api/v1/books",
+        headers={
+            "Authorization": basic_auth("user", "user123")
+        }
+    )
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["X-Cache"] == "HIT"
 
 
 def test_get_book_by_id(test_client):
@@ -285,6 +374,17 @@ def test_get_book_by_id(test_client):
     assert response.status_code == status.HTTP_404_NOT_FOUND
     assert response.json()["meta"]["message"] == "Book not found"
 
+    # the deadline passes before the first query
+    response = test_client.get(
+        "http://localhost:8000/api/v1/books/test_book",
+        headers={
+            "Authorization": basic_auth("user", "user123"),
+            "X-Request-Timeout": "0.000001"
+        }
+    )
+    assert response.status_code == status.HTTP_504_GATEWAY_TIMEOUT
+    assert response.json()["meta"]["message"] == "Request deadline exceeded"
+
     # invalid book
     response = test_client.get(
         "http://localhost:8000/api/v1/books/   ",
@@ -321,6 +421,80 @@ def test_get_book_by_id(test_client):
     assert response.json()["data"]["book"] == created_book
 
 
+def test_conditional_get(test_client):
+    payload = {
+        "title": "TestConditionalGet",
+        "author": "TestAuthor",
+        "genre": "TestGenre",
+        "year_published": 2018
+    }
+    response = test_client.post(
+        "http://localhost:8000/api/v1/books",
+        json=payload,
+        headers={
+            "Authorization": basic_auth("user", "user123")
+        }
+    )
+    created_book = response.json()["data"]["book"]
+
+    etags = {}
+    for path in ["", "/reviews", "/summary", "/page", "/page?reviewsPageSize=5"]:
+        response = test_client.get(
+            f"http://localhost:8000/api/v1/books/{created_book['id']}{path}",
+            headers={
+                "Authorization": basic_auth("user", "user123")
+            }
+        )
+        assert response.status_code == status.HTTP_200_OK
+        etag = etags[path] = response.headers["ETag"]
+        assert "Cache-Control" in response.headers
+
+        # unchanged
+        response = test_client.get(
+            f"http://localhost:8000/api/v1/books/{created_book['id']}{path}",
+            headers={
+                "Authorization": basic_auth("user", "user123"),
+                "If-None-Match": etag
+            }
+        )
+        assert response.status_code == status.HTTP_304_NOT_MODIFIED
+        assert response.headers["ETag"] == etag
+        assert response.content == b""
+
+    # every representation of the same book version has its own ETag
+    assert len(set(etags.values())) == len(etags)
+    response = test_client.get(
+        f"http://localhost:8000/api/v1/books/{created_book['id']}/summary",
+        headers={
+            "Authorization": basic_auth("user", "user123"),
+            "If-None-Match": etags["/reviews"]
+        }
+    )
+    assert response.status_code == status.HTTP_200_OK
+
+    # a new review changes the reviews
+    test_client.post(
+        f"http://localhost:8000/api/v1/books/{created_book['id']}/reviews",
+        json={
+            "review_text": "TestReview",
+            "rating": 3.5
+        },
+        headers={
+            "Authorization": basic_auth("user", "user123")
+        }
+    )
+    response = test_client.get(
+        f"http://localhost:8000/api/v1/books/{created_book['id']}/reviews",
+        headers={
+            "Authorization": basic_auth("user", "user123"),
+            "If-None-Match": etags["/reviews"]
+        }
+    )
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["ETag"] != etags["/reviews"]
+    assert len(response.json()["data"]["reviews"]) == 1
+
+
 def test_update_book_by_id(test_client):
     # without auth header
     response = test_client.put("http://localhost:8000/api/v1/books/test_book_id")
@@ -390,6 +564,78 @@ def test_update_book_by_id(test_client):
     assert response.json()["data"]["book"]["year_published"] == 2020
 
 
+def test_partially_update_book_by_id(test_client):
+    # without auth header
+    response = test_client.patch("http://localhost:8000/api/v1/books/test_book_id")
+    assert response.status_code == status.HTTP_401_UNAUTHORIZED
+    assert response.json()["meta"]["message"] == "Not authenticated"
+
+    # non existing book
+    response = test_client.patch(
+        "http://localhost:8000/api/v1/books/test_book",
+        json={
+            "year_published": 2018
+        },
+        headers={
+            "Authorization": basic_auth("user", "user123")
+        }
+    )
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+    assert response.json()["meta"]["message"] == "Book not found"
+
+    # correct one
+    payload = {
+        "title": "TestPartiallyUpdateBookById",
+        "author": "TestAuthor",
+        "genre": "TestGenre",
+        "year_published": 2018
+    }
+    response = test_client.post(
+        "http://localhost:8000/api/v1/books",
+        json=payload,
+        headers={
+            "Authorization": basic_auth("user", "user123")
+        }
+    )
+    created_book = response.json()["data"]["book"]
+
+    # with empty payload
+    response = test_client.patch(
+        f"http://localhost:8000/api/v1/books/{created_book['id']}",
+        json={},
+        headers={
+            "Authorization": basic_auth("user", "user123")
+        }
+    )
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.json()["meta"]["message"] == "Nothing to update"
+
+    response = test_client.patch(
+        f"http://localhost:8000/api/v1/books/{created_book['id']}",
+        json={
+            "genre": "NewTestGenre"
+        },
+        headers={
+            "Authorization": basic_auth("user", "user123")
+        }
+    )
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()["data"]["book"]["version"] == created_book["version"] + 1
+
+    response = test_client.get(
+        f"http://localhost:8000/api/v1/books/{created_book['id']}",
+        headers={
+            "Authorization": basic_auth("user", "user123")
+        }
+    )
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()["data"]["book"] == {
+        **created_book,
+        "genre": "NewTestGenre",
+        "version": created_book["version"] + 1
+    }
+
+
 def test_delete_book_by_id(test_client):
     # without auth header
     response = test_client.delete("http://localhost:8000/api/v1/books/test_book_id")
@@ -566,7 +812,7 @@ def test_add_a_review(test_client):
     assert response.status_code == status.HTTP_201_CREATED
 
 
-def test_get_all_reviews(test_client):
+def test_get_all_reviews(test_client, query_budget):
     # without auth header
     response = test_client.get("http://localhost:8000/api/v1/books/test_book_id/reviews")
     assert response.status_code == status.HTTP_401_UNAUTHORIZED
@@ -607,28 +853,32 @@ def test_get_all_reviews(test_client):
         }
     )
     created_book = response.json()["data"]["book"]
-    test_client.post(
-        f"http://localhost:8000/api/v1/books/{created_book['id']}/reviews",
-        json={
-            "review_text": "TestReview",
-            "rating": 3.5
-        },
-        headers={
-            "Authorization": basic_auth("user", "user123")
-        }
-    )
-
-    response = test_client.get(
-        f"http://localhost:8000/api/v1/books/{created_book['id']}/reviews",
-        headers={
-            "Authorization": basic_auth("user", "user123")
-        }
-    )
+    for review_text in ["TestReview", "TestAnotherReview"]:
+        test_client.post(
+            f"http://localhost:8000/api/v1/books/{created_book['id']}/reviews",
+            json={
+                "review_text": review_text,
+                "rating": 3.5
+            },
+            headers={
+                "Authorization": basic_auth("user", "user123")
+            }
+        )
+
+    # the user lookup and the reviews, whatever the number of reviews
+    with query_budget(2):
+        response = test_client.get(
+            f"http://localhost:8000/api/v1/books/{created_book['id']}/reviews",
+            headers={
+                "Authorization": basic_auth("user", "user123")
+            }
+        )
     assert response.status_code == status.HTTP_200_OK
     assert response.json()["data"]["reviews"][0] == {
             "review_text": "TestReview",
             "user": "user"
         }
+    assert len(response.json()["data"]["reviews"]) == 2
 
 
 def test_get_summary_and_rating(test_client):
@@ -702,4 +952,200 @@ def test_get_summary_and_rating(test_client):
     assert response.status_code == status.HTTP_200_OK
     assert response.json()["data"]["summary"]["rating"] == 3.2
     assert response.json()["data"]["summary"]["summary"] == ""
+    assert response.json()["data"]["summary"]["rating_distribution"]["3.5"] == 1
+    assert response.json()["data"]["summary"]["rating_distribution"]["3.0"] == 1
+
+
+def test_get_book_page(test_client):
+    # without auth header
+    response = test_client.get("http://localhost:8000/api/v1/books/test_book_id/page")
+    assert response.status_code == status.HTTP_401_UNAUTHORIZED
+    assert response.json()["meta"]["message"] == "Not authenticated"
+
+    # non existing book
+    response = test_client.get(
+        "http://localhost:8000/api/v1/books/test_book/page",
+        headers={
+            "Authorization": basic_auth("user", "user123")
+        }
+    )
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+    assert response.json()["meta"]["message"] == "Book not found"
+
+    # correct one
+    payload = {
+        "title": "TestGetBookPage",
+        "author": "TestAuthor",
+        "genre": "TestGenre",
+        "year_published": 2018
+    }
+    response = test_client.post(
+        "http://localhost:8000/api/v1/books",
+        json=payload,
+        headers={
+            "Authorization": basic_auth("user", "user123")
+        }
+    )
+    created_book = response.json()["data"]["book"]
+    for rating in [3.5, 3]:
+        test_client.post(
+            f"http://localhost:8000/api/v1/books/{created_book['id']}/reviews",
+            json={
+                "review_text": f"TestReview{rating}",
+                "rating": rating
+            },
+            headers={
+                "Authorization": basic_auth("user", "user123")
+            }
+        )
+
+    response = test_client.get(
+        f"http://localhost:8000/api/v1/books/{created_book['id']}/page?reviewsPageSize=1",
+        headers={
+            "Authorization": basic_auth("user", "user123")
+        }
+    )
+    assert response.status_code == status.HTTP_200_OK
+    data = response.json()["data"]
+    assert data["book"]["title"] == "TestGetBookPage"
+    assert data["book"]["version"] == created_book["version"] + 2
+    assert data["summary"] == {"summary": "", "rating": 3.2}
+    assert len(data["reviews"]) == 1
+    assert data["reviews"][0]["user"] == "user"
+
+    # not modified until the book changes
+    etag = response.headers["ETag"]
+    response = test_client.get(
+        f"http://localhost:8000/api/v1/books/{created_book['id']}/page?reviewsPageSize=1",
+        headers={
+            "Authorization": basic_auth("user", "user123"),
+            "If-None-Match": etag
+        }
+    )
+    assert response.status_code == status.HTTP_304_NOT_MODIFIED
+
+
+def test_rate_limit(test_client, small_rate_limit):
+    response = test_client.get(
+        "http://localhost:8000/api/v1/books",
+        headers={
+            "Authorization": basic_auth("user", "user123")
+        }
+    )
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["RateLimit-Limit"] == "20"
+    assert response.headers["RateLimit-Remaining"] == "19"
+    assert int(response.headers["RateLimit-Reset"]) > 0
+
+    # a large page costs more
+    response = test_client.get(
+        "http://localhost:8000/api/v1/books?pageSize=1000",
+        headers={
+            "Authorization": basic_auth("user", "user123")
+        }
+    )
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["RateLimit-Remaining"] == "8"
+
+    # not enough tokens left for another one
+    response = test_client.get(
+        "http://localhost:8000/api/v1/books?pageSize=1000",
+        headers={
+            "Authorization": basic_auth("user", "user123")
+        }
+    )
+    assert response.status_code == status.HTTP_429_TOO_MANY_REQUESTS
+    assert response.json()["meta"]["message"] == "Too many requests"
+    # 3 tokens are missing, refilled at 0.01 token per second
+    assert response.headers["Retry-After"] == "300"
+    assert response.headers["RateLimit-Remaining"] == "8"
+
+    # but a small page still fits
+    response = test_client.get(
+        "http://localhost:8000/api/v1/books",
+        headers={
+            "Authorization": basic_auth("user", "user123")
+        }
+    )
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["RateLimit-Remaining"] == "7"
+
+
+def test_rate_limit_without_redis(test_client, small_rate_limit, monkeypatch):
+    # the rate limiter gets a redis nothing listens on
+    monkeypatch.setattr(
+        rate_limiter,
+        "get_redis_connection",
+        lambda: redis.asyncio.Redis(host=config.redis.host, port=1, decode_responses=True)
+    )
+    monkeypatch.setattr(redis_circuit_breaker, "state", CLOSED)
+    monkeypatch.setattr(redis_circuit_breaker, "failures", 0)
+    monkeypatch.setattr(rate_limiter.local_rate_limiter, "max_keys", 1)
+
+    # the buckets of the worker are used instead
+    response = test_client.get(
+        "http://localhost:8000/api/v1/books?pageSize=1000",
+        headers={
+            "Authorization": basic_auth("user", "user123")
+        }
+    )
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["RateLimit-Remaining"] == "9"
+    response = test_client.get(
+        "http://localhost:8000/api/v1/books?pageSize=1000",
+        headers={
+            "Authorization": basic_auth("user", "user123")
+        }
+    )
+    assert response.status_code == status.HTTP_429_TOO_MANY_REQUESTS
+    assert response.json()["meta"]["message"] == "Too many requests"
+    assert response.headers["Retry-After"] == "200"
+
+    # the least recently used bucket is dropped beyond max_keys
+    response = test_client.get(
+        "http://localhost:8000/api/v1/books",
+        headers={
+            "Authorization": basic_auth("admin", "admin123")
+        }
+    )
+    assert response.status_code == status.HTTP_200_OK
+    assert len(rate_limiter.local_rate_limiter.buckets) == 1
 
+
+def test_get_cached_book_without_db(test_client, query_budget):
+    payload = {
+        "title": "TestGetCachedBook",
+        "author": "TestAuthor",
+        "genre": "TestGenre",
+        "year_published": 2018
+    }
+    response = test_client.post(
+        "http://localhost:8000/api/v1/books",
+        json=payload,
+        headers={
+            "Authorization": basic_auth("user", "user123")
+        }
+    )
+    created_book = response.json()["data"]["book"]
+    response = test_client.post(
+        "http://localhost:8000/api/v1/auth/token",
+        headers={
+            "Authorization": basic_auth("user", "user123")
+        }
+    )
+    access_token = response.json()["data"]["access_token"]
+
+    # the token is verified and the book is read from the cache, so no connection is checked out
+    unused_requests = db_session_requests.values[("unused",)]
+    checkouts = db_checkouts.values[()]
+    with query_budget(0):
+        response = test_client.get(
+            f"http://localhost:8000/api/v1/books/{created_book['id']}",
+            headers={
+                "Authorization": f"Bearer {access_token}"
+            }
+        )
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()["data"]["book"] == created_book
+    assert db_session_requests.values[("unused",)] == unused_requests + 1
+    assert db_checkouts.values[()] == checkouts
@@ -1,14 +1,23 @@
 import asyncio
+from datetime import datetime, timedelta, timezone
 
 import pytest
 import pytest_asyncio
 from sqlalchemy import insert, select, delete, update
+from sqlalchemy.engine import make_url
 
-from api.v1.books.utils import BookUtils
-from core.database.base import get_async_session
+from api.v1.books.utils import BOOKS_TAG, BookUtils
+from core.caching.redis import get_redis_connection
+from core.config import get_config
+from core.database import replicas
+from core.database.base import create_engine, get_async_session
 from core.database.models import Book, User, Review
 from core.exceptions import HTTPException
-from core.schemas import BookSchema, ReviewSchema
+from core.helpers import db_helper
+from core.helpers.db_helper import BOOK_LOOKUPS, GET_BOOK_BY_ID, DbHelper
+from core.schemas import BookSchema, BookUpdateSchema, ReviewSchema
+
+config = get_config()
 
 
 @pytest_asyncio.fixture(scope='session')
@@ -66,7 +75,7 @@ async def test_retrieve_all_books(db_session):
         "year_published": 2024
     }
     book_utils = BookUtils(db_session)
-    all_books = await book_utils.retrieve_all_books(page_size=5, current_page=1)
+    all_books = (await book_utils.retrieve_books_page(page_size=5, current_page=1))["books"]
     assert len(all_books) == 0
 
     await db_session.execute(
@@ -74,15 +83,75 @@ async def test_retrieve_all_books(db_session):
     )
     await db_session.commit()
 
-    all_books = await book_utils.retrieve_all_books(page_size=5, current_page=1)
+    all_books = (await book_utils.retrieve_books_page(page_size=5, current_page=1))["books"]
     assert len(all_books) == 1
     assert all_books[0]['title'] == "TestBookRetrieve"
     assert all_books[0]['author'] == "TestAuthor"
+    assert "summary" not in all_books[0]
+
+    all_books = (
+        await book_utils.retrieve_books_page(page_size=5, current_page=1, fields=["id", "year_published"])
+    )["books"]
+    assert all_books[0].keys() == {"id", "year_published"}
+    assert all_books[0]['year_published'] == 2024
+
+    with pytest.raises(HTTPException) as he:
+        await book_utils.retrieve_books_page(page_size=5, current_page=1, fields=["password"])
+    assert he.value.message.startswith("Invalid value for fields in query")
 
-    all_books = await book_utils.retrieve_all_books(page_size=5, current_page=2)
+    all_books = (await book_utils.retrieve_books_page(page_size=5, current_page=2))["books"]
     assert len(all_books) == 0
 
 
+async def test_retrieve_books_page(db_session):
+    books = [("TestBookA", "TestGenre", 1990), ("TestBookB", "TestGenre", 2005), ("TestBookC", "Other", 2010)]
+    for title, genre, year in books:
+        await db_session.execute(
+            insert(Book).values(title=title, author="TestAuthor", genre=genre, year_published=year)
+        )
+    await db_session.commit()
+    book_utils = BookUtils(db_session)
+    # The books are inserted directly, so the cached counts are dropped by hand
+    await book_utils.redis_client.invalidate_tags(tags=[BOOKS_TAG])
+
+    books_page = await book_utils.retrieve_books_page(page_size=5, current_page=1, filters={"genre": "TestGenre"})
+    assert sorted(book["title"] for book in books_page["books"]) == ["TestBookA", "TestBookB"]
+    assert books_page["total"] == 2
+    assert books_page["next_cursor"] is None
+
+    books_page = await book_utils.retrieve_books_page(
+        page_size=5, current_page=1, filters={"year_from": 2000, "year_to": 2010}, sort_by="year"
+    )
+    assert [book["title"] for book in books_page["books"]] == ["TestBookB", "TestBookC"]
+
+    # keyset pagination
+    books_page = await book_utils.retrieve_books_page(page_size=2, current_page=1, sort_by="title")
+    assert [book["title"] for book in books_page["books"]] == ["TestBookA", "TestBookB"]
+    books_page = await book_utils.retrieve_books_page(
+        page_size=2, current_page=1, sort_by="title", cursor=books_page["next_cursor"]
+    )
+    assert [book["title"] for book in books_page["books"]] == ["TestBookC"]
+    assert books_page["next_cursor"] is None
+
+    with pytest.raises(HTTPException) as he:
+        await book_utils.retrieve_books_page(page_size=2, current_page=1, sort_by="title", cursor="invalid")
+    assert he.value.message == "Invalid value for cursor in query"
+
+    # a cursor of another order, whose values don't have the types of the sort keys
+    books_page = await book_utils.retrieve_books_page(page_size=2, current_page=1, sort_by="title")
+    for sort_by in ["year", "rating"]:
+        with pytest.raises(HTTPException) as he:
+            await book_utils.retrieve_books_page(
+                page_size=2, current_page=1, sort_by=sort_by, cursor=books_page["next_cursor"]
+            )
+        assert he.value.status_code == 400
+        assert he.value.message == "Invalid value for cursor in query"
+
+    with pytest.raises(HTTPException) as he:
+        await book_utils.retrieve_books_page(page_size=2, current_page=1, filters={"year_from": 2010, "year_to": 2000})
+    assert he.value.message.startswith("Invalid value for yearFrom in query")
+
+
 async def test_retrieve_a_book(db_session):
     book_payload = {
         "title": "TestBookRetrieveABook",
@@ -135,6 +204,91 @@ async def test_update_book(db_session):
     assert book.title == "NewBookUpdateBook"
 
 
+async def test_partially_update_book(db_session):
+    book_payload = {
+        "title": "TestBookPartiallyUpdateBook",
+        "author": "TestAuthor",
+        "genre": "TestGenre",
+        "year_published": 2024
+    }
+    book_utils = BookUtils(db_session)
+    result = await db_session.execute(
+        insert(Book).values(**book_payload).returning(Book.id)
+    )
+    book_id = result.scalar_one()
+
+    with pytest.raises(HTTPException) as he:
+        await book_utils.update_book(book_id=book_id, payload=BookUpdateSchema())
+    assert he.value.message == "Nothing to update"
+
+    updated_book = await book_utils.update_book(book_id=book_id, payload=BookUpdateSchema(year_published=2020))
+    assert updated_book["id"] == book_id
+    assert updated_book["title"] == "TestBookPartiallyUpdateBook"
+    assert updated_book["year_published"] == 2020
+    assert updated_book["version"] == 2
+
+    # the cache is written from the updated row
+    book = await book_utils.retrieve_a_book(book_id=book_id)
+    assert book == updated_book
+
+
+async def test_update_book_rolled_back(db_session):
+    book_payload = {
+        "title": "TestBookUpdateRolledBack",
+        "author": "TestAuthor",
+        "genre": "TestGenre",
+        "year_published": 2024
+    }
+    result = await db_session.execute(
+        insert(Book).values(**book_payload).returning(Book.id)
+    )
+    book_id = result.scalar_one()
+    await db_session.commit()
+
+    book_utils = BookUtils(db_session)
+    updated_book = await book_utils.update_book(book_id=book_id, payload=BookUpdateSchema(year_published=2020))
+    assert updated_book["year_published"] == 2020
+
+    # nothing is written, neither to the DB nor to the cache, until the unit of work is committed
+    await book_utils.db_helper.rollback()
+    book = await book_utils.retrieve_a_book(book_id=book_id)
+    assert book["year_published"] == 2024
+    assert book["version"] == 1
+
+
+async def test_update_book_committed_with_failed_callback(db_session):
+    book_payload = {
+        "title": "TestBookUpdateFailedCallback",
+        "author": "TestAuthor",
+        "genre": "TestGenre",
+        "year_published": 2024
+    }
+    result = await db_session.execute(
+        insert(Book).values(**book_payload).returning(Book.id)
+    )
+    book_id = result.scalar_one()
+    await db_session.commit()
+
+    book_utils = BookUtils(db_session)
+    await book_utils.update_book(book_id=book_id, payload=BookUpdateSchema(year_published=2020))
+    called = []
+
+    async def failing_callback():
+        raise RuntimeError("side effect failed")
+
+    async def next_callback():
+        called.append(True)
+
+    await book_utils.db_helper.after_commit(failing_callback)
+    await book_utils.db_helper.after_commit(next_callback)
+
+    # the failed callback neither fails the committed write nor skips the next callbacks
+    await book_utils.db_helper.commit()
+    assert called == [True]
+    book = await book_utils.retrieve_a_book(book_id=book_id)
+    assert book["year_published"] == 2020
+
+
 async def test_delete_book(db_session):
     book_payload = {
         "title": "TestBookDeleteBook",
@@ -300,5 +454,155 @@ async def test_retrieve_summary_and_rating(db_session):
     summary_and_rating = await book_utils.retrieve_summary_and_rating(book_id=book_id)
     assert summary_and_rating['rating'] == 3.5
     assert summary_and_rating['summary'] == "TestSummary"
+    assert summary_and_rating['rating_distribution']['4.0'] == 1
+    assert summary_and_rating['rating_distribution']['3.0'] == 1
+    assert sum(summary_and_rating['rating_distribution'].values()) == 2
 
 
+async def test_retrieve_cached_reviews_page(db_session):
+    result = await db_session.execute(
+        select(User.id).where(User.username == "user")
+    )
+    user_id = result.scalar_one()
+    book_payload = {
+        "title": "TestBookCachedReviewsPage",
+        "author": "TestAuthor",
+        "genre": "TestGenre",
+        "year_published": 2024
+    }
+    result = await db_session.execute(
+        insert(Book).values(**book_payload).returning(Book.id)
+    )
+    book_id = result.scalar_one()
+    await db_session.execute(
+        insert(Review).values(review_text="TestReview", rating=4, user_id=user_id, book_id=book_id)
+    )
+    await db_session.commit()
+
+    book_utils = BookUtils(db_session)
+    with pytest.raises(HTTPException) as he:
+        await book_utils.retrieve_cached_reviews_page(book_id="non-existing-id", version=1, page_size=5)
+    assert he.value.message == "Book not found"
+
+    # the caller saw a newer version than the one read, e.g. from a lagging replica
+    reviews = await book_utils.retrieve_cached_reviews_page(book_id=book_id, version=5, page_size=5)
+    assert reviews == [{"review_text": "TestReview", "user": "user", "rating": 4}]
+    # so the page is cached under the version read with it, not as the newer one
+    cached_reviews, cached_version = await book_utils.redis_client.get_versioned_cache(
+        key=f"book:{book_id}:reviews:5"
+    )
+    assert cached_reviews == reviews
+    assert cached_version == 1
+
+
+async def test_read_only_retried_on_primary(db_session, monkeypatch):
+    result = await db_session.execute(
+        insert(Book).values(
+            title="TestBookReplica", author="TestAuthor", genre="TestGenre", year_published=2024
+        ).returning(Book.id)
+    )
+    book_id = result.scalar_one()
+    await db_session.commit()
+
+    # a replica that went down after its last health check
+    replica_url = make_url(config.postgres_url.unicode_string()).set(port=1)
+    replica = replicas.Replica(create_engine(replica_url.render_as_string(hide_password=False)))
+
+    async def get_read_replica(session):
+        return replica
+
+    monkeypatch.setattr(db_helper, "get_read_replica", get_read_replica)
+    try:
+        book = await DbHelper(db_session).get_book(filters={"id": book_id})
+        assert book.title == "TestBookReplica"
+        # and it is skipped until the next health check
+        assert not replica.is_healthy
+    finally:
+        await replica.engine.dispose()
+
+
+async def test_read_your_writes(db_session, monkeypatch):
+    replica = object()
+
+    class ReplicaPool:
+        async def get_replica(self):
+            return replica
+
+    monkeypatch.setattr(config.database, "replica_urls", ["postgresql+asyncpg://replica/db"])
+    monkeypatch.setattr(replicas, "get_replica_pool", ReplicaPool)
+    redis_connection = get_redis_connection()
+    await redis_connection.delete("recent_writes:test_writer")
+
+    db_session.info["user_id"] = "test_writer"
+    assert await replicas.get_read_replica(db_session) is replica
+
+    # the reads after a write of the session go to the primary
+    await replicas.mark_writes(db_session)
+    assert await replicas.get_read_replica(db_session) is None
+
+    # and so do the ones of the next requests of the user, for the read-your-writes window
+    next_session = get_async_session()()
+    next_session.info["user_id"] = "test_writer"
+    other_session = get_async_session()()
+    other_session.info["user_id"] = "test_reader"
+    try:
+        assert await replicas.get_read_replica(next_session) is None
+        assert await replicas.get_read_replica(other_session) is replica
+    finally:
+        await next_session.close()
+        await other_session.close()
+        await redis_connection.delete("recent_writes:test_writer")
+
+
+async def test_prebuilt_statements(db_session):
+    result = await db_session.execute(select(User.id).where(User.username == "user"))
+    user_id = result.scalar_one()
+    result = await db_session.execute(
+        insert(Book).values(
+            title="TestBookPrebuilt", author="TestAuthor", genre="TestGenre", year_published=2024
+        ).returning(Book.id)
+    )
+    book_id = result.scalar_one()
+    result = await db_session.execute(
+        insert(Book).values(
+            title="TestBookWithoutReviews", author="TestAuthor", genre="TestGenre", year_published=2024
+        ).returning(Book.id)
+    )
+    book_without_reviews_id = result.scalar_one()
+    created_at = datetime.now(timezone.utc)
+    await db_session.execute(
+        insert(Review).values([
+            {
+                "review_text": f"TestReview{i}",
+                "rating": i,
+                "user_id": user_id,
+                "book_id": book_id,
+                "created_at": created_at + timedelta(minutes=i)
+            }
+            for i in range(1, 4)
+        ])
+    )
+    await db_session.commit()
+    db_helper = DbHelper(db_session)
+
+    # GET_BOOK_BY_ID
+    assert BOOK_LOOKUPS[frozenset({"id"})] is GET_BOOK_BY_ID
+    book = await db_helper.get_book(filters={"id": book_id})
+    assert book.title == "TestBookPrebuilt"
+    assert await db_helper.get_book(filters={"id": "non-existing-id"}) is None
+
+    # GET_REVIEWS_PAGE, newest first, with the version of the book
+    reviews_page = await db_helper.get_reviews_page(book_id=book_id, page_size=2)
+    assert reviews_page["version"] == book.version
+    assert reviews_page["reviews"] == [
+        {"review_text": "TestReview3", "user": "user", "rating": 3},
+        {"review_text": "TestReview2", "user": "user", "rating": 2}
+    ]
+    reviews_page = await db_helper.get_reviews_page(book_id=book_id, page_size=2, current_page=2)
+    assert reviews_page["reviews"] == [{"review_text": "TestReview1", "user": "user", "rating": 1}]
+    # past the last review, the version is still read
+    reviews_page = await db_helper.get_reviews_page(book_id=book_id, page_size=2, current_page=3)
+    assert reviews_page == {"version": book.version, "reviews": []}
+    reviews_page = await db_helper.get_reviews_page(book_id=book_without_reviews_id, page_size=2)
+    assert reviews_page == {"version": 1, "reviews": []}
+    assert await db_helper.get_reviews_page(book_id="non-existing-id", page_size=2) is None
@@ -1,14 +1,31 @@
+import asyncio
+import base64
+import binascii
 import functools
+import hashlib
 import json
+from typing import Any
 
+from sqlalchemy import Float, Integer
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.types import TypeEngine
 from starlette import status
 
+from core.caching.access_counter import book_access_counter
+from core.caching.leaderboards import book_leaderboards
 from core.caching.redis import RedisClient
 from core.exceptions import HTTPException
-from core.helpers.db_helper import DbHelper
+from core.helpers.db_helper import BOOK_COLUMNS, DbHelper, get_book_sort_keys
 from core.logger import logger
-from core.schemas import BookSchema, ReviewSchema
+from core.database.models import Book
+from core.schemas import BookSchema, BookUpdateSchema, ReviewSchema
+
+# Fields of a book returned by the list endpoint, unless others are requested
+DEFAULT_BOOK_LIST_FIELDS = ("title", "author", "id")
+# Reviews returned with the book page
+DEFAULT_BOOK_PAGE_REVIEWS = 10
+# Everything cached for the whole catalogue, e.g. the book counts, is dropped on every write to the books
+BOOKS_TAG = "books"
 
 
 def only_if_book_exists(func):
@@ -22,7 +39,7 @@ def only_if_book_exists(func):
         First it checks in the cache. If not found then in DB. If not found, then exception
         """
         redis_client = RedisClient()
-        book = await redis_client.get_cache(key=f"book:{kwargs.get('book_id')}")
+        book = await redis_client.has_cache(key=f"book:{kwargs.get('book_id')}")
         if not book:
             book = await self.db_helper.get_book(filters={"id": kwargs.get("book_id")})
             if not book:
@@ -31,6 +48,78 @@ def only_if_book_exists(func):
     return wrapped
 
 
+async def cache_book(db_helper: DbHelper, redis_client: RedisClient, book: Book, is_written: bool = True) -> dict:
+    """
+    Writes a book row to the cache and returns it as a dict. The cache is written once
+    the row is committed and only if the row is newer than the cached entry. If the row
+    was just written and redis can't be reached, the cached entry is deleted later
+    """
+    book_schema = BookSchema.model_validate(book)
+    await db_helper.after_commit(
+        redis_client.set_versioned_cache,
+        key=f"book:{book.id}",
+        value=book_schema.model_dump(),
+        version=book.version,
+        invalidate_on_failure=is_written
+    )
+    return book_schema.model_dump()
+
+
+def encode_cursor(book: dict[str, Any], sort_by: str) -> str:
+    """
+    Encodes the sort keys of the last book of a page as an opaque cursor
+    """
+    values = [book[key] for key in get_book_sort_keys(sort_by)]
+    return base64.urlsafe_b64encode(json.dumps(values).encode("utf8")).decode("ascii")
+
+
+def is_cursor_value_valid(value: Any, column_type: TypeEngine) -> bool:
+    """
+    Checks that a value decoded from a cursor can be compared with a column of the given type.
+    JSON has a single number type, so an integer is a valid float
+    """
+    if isinstance(value, bool):
+        return False
+    if isinstance(column_type, Float):
+        return isinstance(value, (int, float))
+    if isinstance(column_type, Integer):
+        # The integer columns are 32 bits
+        return isinstance(value, int) and -2 ** 31 <= value < 2 ** 31
+    return isinstance(value, column_type.python_type)
+
+
+def decode_cursor(cursor: str, sort_by: str) -> dict[str, Any]:
+    """
+    Decodes a cursor back into the sort keys of the given order. A cursor that was not
+    issued for this order, e.g. with values of other types, is rejected
+    """
+    sort_keys = get_book_sort_keys(sort_by)
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except (ValueError, binascii.Error):
+        values = None
+    if not isinstance(values, list) or len(values) != len(sort_keys) or not all(
+        is_cursor_value_valid(value, BOOK_COLUMNS[key].type) for key, value in zip(sort_keys, values)
+    ):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, message="Invalid value for cursor in query")
+    return dict(zip(sort_keys, values))
+
+
+def build_summary_and_rating(row: dict) -> dict:
+    """
+    Builds the summary and rating of a book from its summary and its rating histogram,
+    which has one count per half star from 0 to 5
+    """
+    histogram = row["rating_histogram"]
+    review_count = sum(histogram)
+    rating_sum = sum(bucket / 2 * count for bucket, count in enumerate(histogram))
+    return {
+        "summary": row["summary"],
+        "rating": round(rating_sum / max(review_count, 1), 1),
+        "rating_distribution": {str(bucket / 2): count for bucket, count in enumerate(histogram)}
+    }
+
+
 class BookUtils:
     """
     A class that encapsulates all the utility methods required for managing book
@@ -51,51 +140,118 @@ class BookUtils:
                 status_code=status.HTTP_409_CONFLICT,
                 message=f"A book with {book.title} of author {book.author} already exists"
             )
-        inserted_book = await self.db_helper.add_book_row(book.model_dump(exclude_none=True))
-        await self.redis_client.set_cache(key=f"book:{inserted_book.id}", value=book.model_dump_json())
-        return BookSchema.model_validate(inserted_book).model_dump()
+        inserted_book = await self.db_helper.add_book_row(book.model_dump(exclude_none=True, exclude={"version"}))
+        await self.db_helper.after_commit(self.redis_client.invalidate_tags, tags=[BOOKS_TAG])
+        return await cache_book(self.db_helper, self.redis_client, inserted_book)
 
-    async def retrieve_all_books(self, page_size: int, current_page: int):
+    async def retrieve_books_page(
+        self,
+        page_size: int,
+        current_page: int,
+        fields: list[str] | None = None,
+        filters: dict[str, Any] | None = None,
+        sort_by: str | None = None,
+        cursor: str | None = None
+    ):
         """
-        This method retrieves all books from DB using pagination and returns to the user.
-        Currently, this method returns only the id, title and the author name. If needed,
-        it can be updated..
+        This method returns a page of the books matching the filters, along with the number
+        of matching books and the cursor of the next page, if there is one. By default, only
+        the id, title and the author name are returned. Other fields can be requested. Only the
+        requested columns are fetched from DB. With a cursor, the page starts right after the
+        last book of the previous page, which stays fast however deep the page is
         """
-        all_books_model = await self.db_helper.get_all_books(page_size=page_size, current_page=current_page)
-        all_books = [
-            {**BookSchema.model_validate(book).model_dump(include={"author", "title", "id"})}
-            for book in all_books_model
-        ]
-        return all_books
+        if fields:
+            # Keeps the requested order, without duplicates
+            fields = tuple(dict.fromkeys(field.strip() for field in fields))
+            if not all(field in BOOK_COLUMNS for field in fields):
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    message=f"Invalid value for fields in query. Allowed fields are {', '.join(BOOK_COLUMNS)}"
+                )
+        else:
+            fields = DEFAULT_BOOK_LIST_FIELDS
+        filters = {name: value for name, value in (filters or {}).items() if value is not None}
+        if filters.get("year_from", 0) > filters.get("year_to", float("inf")):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                message="Invalid value for yearFrom in query. It must not be greater than yearTo"
+            )
+        sort_by = sort_by or "id"
+        rows = await self.db_helper.get_all_books(
+            page_size=page_size,
+            current_page=current_page,
+            fields=fields,
+            filters=filters,
+            sort_by=sort_by,
+            after=decode_cursor(cursor, sort_by) if cursor else None
+        )
+        return {
+            # The sort keys are fetched for the cursor, but only the requested fields are returned
+            "books": [{field: row[field] for field in fields} for row in rows],
+            "total": await self.count_books(filters=filters),
+            "next_cursor": encode_cursor(rows[-1], sort_by) if len(rows) == page_size else None
+        }
+
+    async def count_books(self, filters: dict[str, Any]) -> int:
+        """
+        This method returns the number of books matching the filters. The counts are
+        cached per filter and dropped on every write to the books
+        """
+        filters_hash = hashlib.sha1(json.dumps(filters, sort_keys=True).encode("utf8")).hexdigest()
+        key = f"book_count:{filters_hash}"
+        count = await self.redis_client.get_cache(key=key)
+        if count is None:
+            count = await self.db_helper.count_books(filters=filters)
+            await self.redis_client.set_many([(key, count, None)], tags=[BOOKS_TAG])
+        return count
 
     async def retrieve_a_book(self, book_id: str):
         """
         This method returns the complete details of a book
         """
         # It will first check in cache. If not available, then it fetches from DB
-        book = await self.redis_client.get_cache(key=f"book:{book_id}")
-        if book:
-            book = json.loads(book)
-            return book
-        else:
+        book, _ = await self.redis_client.get_versioned_cache(key=f"book:{book_id}")
+        if not book:
             book = await self.db_helper.get_book(filters={"id": book_id})
             # if book does not exist, it returns an error response
             if not book:
                 raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, message="Book not found")
-            book_dict = BookSchema.model_validate(book).model_dump()
             # updates the cache with the book content
-            await self.redis_client.set_cache(key=f"book:{book_id}", value=json.dumps(book_dict))
-            return book_dict
+            book = await cache_book(self.db_helper, self.redis_client, book, is_written=False)
+        # The most read books are loaded into the cache by the cache warmer
+        await book_access_counter.record(book_id)
+        return book
+
+    async def retrieve_book_version(self, book_id: str) -> int:
+        """
+        This method returns the current version of a book. It is answered from the cache
+        whenever possible, so conditional requests don't need to touch the DB
+        """
+        version = await self.redis_client.get_cache_version(key=f"book:{book_id}")
+        if version is None:
+            book = await self.retrieve_a_book(book_id=book_id)
+            version = book["version"]
+        return version
 
     @only_if_book_exists
-    async def update_book(self, book_id: str, payload: BookSchema):
+    async def update_book(self, book_id: str, payload: BookSchema | BookUpdateSchema):
         """
-        This method updates the book based on user request
+        This method updates the book based on user request. For partial updates, only
+        the provided fields are updated. Returns the updated book
         """
+        if not payload.model_dump(exclude_none=True, exclude={"id", "version"}):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, message="Nothing to update")
         # First it updates in DB
-        await self.db_helper.update_book_record(book_id=book_id, payload=payload)
-        # then it updates the cache
-        await self.redis_client.set_cache(key=f"book:{book_id}", value=payload.model_dump_json())
+        updated_book = await self.db_helper.update_book_record(book_id=book_id, payload=payload)
+        # The book can be deleted in between the existence check and the update
+        if not updated_book:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, message="Book not found")
+        # then it updates the cache from the updated row
+        book = await cache_book(self.db_helper, self.redis_client, updated_book)
+        await self.db_helper.after_commit(self.redis_client.invalidate_tags, tags=[BOOKS_TAG])
+        # A new genre or year moves the book to other leaderboards
+        await self.db_helper.after_commit(book_leaderboards.update_book, book=book)
+        return book
 
     @only_if_book_exists
     async def delete_book(self, book_id: str):
@@ -104,15 +260,22 @@ class BookUtils:
         """
         # First it deletes from DB
         await self.db_helper.delete_book_record(book_id=book_id)
-        # then it deletes from cache
-        await self.redis_client.unset_cache(key=f"book:{book_id}")
+        # then it deletes the book and everything cached for it, once the delete is committed
+        await self.db_helper.after_commit(
+            self.redis_client.invalidate_tags, tags=[f"book:{book_id}", BOOKS_TAG], keys=[f"book:{book_id}"]
+        )
+        await self.db_helper.after_commit(book_leaderboards.remove_book, book_id=book_id)
 
     @only_if_book_exists
     async def store_a_review(self, book_id: str, payload: ReviewSchema):
         """
         This method stores a review for a book
         """
-        await self.db_helper.create_review_for_book(book_id=book_id, review=payload)
+        book = await self.db_helper.create_review_for_book(book_id=book_id, review=payload)
+        # A new review changes the version of the book, so the cache is refreshed
+        book = await cache_book(self.db_helper, self.redis_client, book)
+        # and the book moves on the leaderboards, once the review is committed
+        await self.db_helper.after_commit(book_leaderboards.record_review, book=book, rating=payload.rating)
 
     @only_if_book_exists
     async def retrieve_all_reviews(self, book_id: str):
@@ -120,34 +283,80 @@ class BookUtils:
         This method prepares all the reviews for a book. Review text and the username
         of the user who wrote the review is returned
         """
-        # First it fetches all the reviews from DB
-        review_models, _ = await self.db_helper.get_all_reviews_for_book(book_id=book_id)
-        # Then it filters the fields
-        reviews = [
-            {
-                "review_text": review.review_text,
-                "user": review.user.username
-            }
-            for review in review_models
-        ]
-        return reviews
+        return await self.db_helper.get_all_reviews_for_book(book_id=book_id)
 
-    @only_if_book_exists
     async def retrieve_summary_and_rating(self, book_id: str):
         """
-        This method prepares the summary and the average rating of a book
-        """
-        # First it fetches the book object and all the reviews for the book
-        review_models, book = await self.db_helper.get_all_reviews_for_book(book_id=book_id)
-        # Then it prepares a list of ratings
-        ratings = [
-            review.rating for review in review_models
-        ]
-        # Then it calculates the average rating
-        rating = round(sum(ratings)/max(len(ratings), 1), 1)
-        summary = book.summary
-        # returns the summary and the average rating
+        This method prepares the summary, the average rating and the rating distribution of
+        a book. They come from a single row, whatever the number of reviews. The result
+        is mirrored in the cache, where the book page reads it
+        """
+        row = await self.db_helper.get_book_summary_and_histogram(book_id=book_id)
+        # if book does not exist, it returns an error response
+        if not row:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, message="Book not found")
+        summary_and_rating = build_summary_and_rating(row)
+        await self.redis_client.set_versioned_cache(
+            key=f"book:{book_id}:summary", value=summary_and_rating, version=row["version"], tags=[f"book:{book_id}"]
+        )
+        return summary_and_rating
+
+    async def retrieve_book_page(self, book: dict, reviews_page_size: int = DEFAULT_BOOK_PAGE_REVIEWS):
+        """
+        This method prepares everything the book detail screen shows: the book, its summary
+        and rating, and the first page of its reviews. The book is the one returned by
+        retrieve_a_book, so its existence is checked only once. The summary and the reviews
+        are fetched concurrently, from the cache or each on its own pooled connection
+        """
+        summary_and_rating, reviews = await asyncio.gather(
+            self.retrieve_cached_summary_and_rating(book_id=book["id"], version=book["version"]),
+            self.retrieve_cached_reviews_page(book_id=book["id"], version=book["version"], page_size=reviews_page_size)
+        )
         return {
-            "summary": summary,
-            "rating": rating
+            "book": book,
+            "summary": summary_and_rating,
+            "reviews": reviews
         }
+
+    async def retrieve_cached_summary_and_rating(self, book_id: str, version: int):
+        """
+        This method returns the summary and the average rating of a book at the given version.
+        The result is cached on its own, so it is reused until the book changes
+        """
+        key = f"book:{book_id}:summary"
+        summary_and_rating, cached_version = await self.redis_client.get_versioned_cache(key=key)
+        if summary_and_rating is not None and cached_version == version:
+            return summary_and_rating
+        async with self.db_helper.concurrent_session() as db_helper:
+            row = await db_helper.get_book_summary_and_histogram(book_id=book_id)
+        if not row:
+            # Deleted in between
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, message="Book not found")
+        summary_and_rating = build_summary_and_rating(row)
+        # Deleting the book deletes everything tagged with it
+        await self.redis_client.set_versioned_cache(
+            key=key, value=summary_and_rating, version=row["version"], tags=[f"book:{book_id}"]
+        )
+        return summary_and_rating
+
+    async def retrieve_cached_reviews_page(self, book_id: str, version: int, page_size: int):
+        """
+        This method returns the first page of the reviews of a book at the given version.
+        Like the summary, the page is cached on its own until the book changes. It is cached
+        under the version read along with the reviews, so a page read from a lagging replica
+        is never stored as the current one
+        """
+        key = f"book:{book_id}:reviews:{page_size}"
+        reviews, cached_version = await self.redis_client.get_versioned_cache(key=key)
+        if reviews is not None and cached_version == version:
+            return reviews
+        async with self.db_helper.concurrent_session() as db_helper:
+            reviews_page = await db_helper.get_reviews_page(book_id=book_id, page_size=page_size)
+        if not reviews_page:
+            # Deleted in between
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, message="Book not found")
+        reviews = reviews_page["reviews"]
+        await self.redis_client.set_versioned_cache(
+            key=key, value=reviews, version=reviews_page["version"], tags=[f"book:{book_id}"]
+        )
+        return reviews
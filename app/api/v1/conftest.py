@@ -0,0 +1,22 @@
+from contextlib import contextmanager
+
+import pytest
+
+from core.database.query_counter import count_queries
+
+
+@pytest.fixture(scope="function")
+def query_budget():
+    """
+    Checks that the block sends at most budget queries, and none of them twice, the sign of
+    a N+1 pattern. The queries of the app running in the thread of the test client are counted
+    """
+    @contextmanager
+    def check_query_budget(budget: int):
+        with count_queries(is_global=True) as query_counter:
+            yield query_counter
+        repeated = query_counter.get_repeated()
+        assert not repeated, f"Repeated queries: {repeated}"
+        assert query_counter.count <= budget, f"{query_counter.count} queries: {query_counter.statements}"
+
+    return check_query_budget
@@ -0,0 +1,85 @@
+"""
+Rebuilds the leaderboards from the reviews in the DB. The leaderboards are updated as the
+reviews are added, so this only fixes the updates missed while redis was unavailable.
+It runs periodically in the background and can be run by hand:
+    python -m api.v1.leaderboards.reconciler
+"""
+import asyncio
+from typing import Any
+
+import redis.asyncio as redis
+
+from core.caching.leaderboards import DECAY_RATE, book_leaderboards
+from core.caching.redis import close_redis_connection, get_redis_connection
+from core.config import get_config
+from core.database.base import dispose_async_engine, get_async_session
+from core.database.replicas import dispose_replica_engines
+from core.helpers.db_helper import DbHelper
+from core.logger import logger
+
+config = get_config()
+
+# Taken by the worker that rebuilds the leaderboards, so the other workers don't
+RECONCILER_LOCK_KEY = "leaderboards:lock"
+# Reviews created during a rebuild that are replayed at once
+REPLAY_BATCH_SIZE = 1000
+
+
+async def reconcile_leaderboards() -> int:
+    """
+    Rebuilds the leaderboards from the DB. Returns the number of ranked books
+    """
+    db_session = get_async_session()()
+    db_helper = DbHelper(db_session=db_session)
+    try:
+        until = await db_helper.get_review_stats_until()
+        rows = await db_helper.get_review_stats(decay_rate=DECAY_RATE, until=until)
+        # Ends the read transaction, so the replay sees the reviews committed meanwhile
+        await db_session.rollback()
+        after = {"after_created_at": until, "after_id": ""}
+
+        async def get_new_reviews() -> list[dict[str, Any]]:
+            reviews = await db_helper.get_reviews_created_after(**after, limit=REPLAY_BATCH_SIZE)
+            await db_session.rollback()
+            if reviews:
+                after.update(after_created_at=reviews[-1]["created_at"], after_id=reviews[-1]["id"])
+            return reviews
+
+        await book_leaderboards.rebuild(rows, get_new_reviews=get_new_reviews)
+    finally:
+        await db_session.close()
+    return len(rows)
+
+
+async def reconcile_leaderboards_periodically():
+    """
+    Rebuilds the leaderboards every reconcile interval, from one worker only. The lock
+    expires with the interval, so the next rebuild can be taken by any worker
+    """
+    interval = config.leaderboards.reconcile_interval
+    while True:
+        try:
+            is_locked = await get_redis_connection().set(RECONCILER_LOCK_KEY, 1, nx=True, ex=int(interval))
+            if is_locked:
+                ranked = await reconcile_leaderboards()
+                logger.info(f"Leaderboards - rebuilt with {ranked} books")
+        except redis.RedisError as er:
+            logger.info(f"Redis error - {er}")
+        except Exception as e:
+            # The boards are still updated incrementally. So, the app keeps running
+            logger.error(f"Leaderboards rebuild failed - {e}")
+        await asyncio.sleep(interval)
+
+
+async def main():
+    try:
+        ranked = await reconcile_leaderboards()
+        logger.info(f"Leaderboards - rebuilt with {ranked} books")
+    finally:
+        await dispose_async_engine()
+        await dispose_replica_engines()
+        await close_redis_connection()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
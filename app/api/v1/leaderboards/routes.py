@@ -0,0 +1,32 @@
+from typing import Annotated, Literal
+
+from fastapi import Depends, Path, Query
+from fastapi.routing import APIRouter
+from fastapi.responses import JSONResponse
+from starlette import status
+
+from api.v1.leaderboards.utils import LeaderboardUtils
+from core.dependencies import RateLimiter, get_current_user
+from core.responses import generate_json_response
+from core.schemas import UserSchema
+
+leaderboard_route = APIRouter(prefix="/leaderboards")
+
+
+@leaderboard_route.get("/{board}", dependencies=[Depends(RateLimiter())])
+async def get_leaderboard(
+    _: Annotated[UserSchema, Depends(get_current_user)],
+    board: Annotated[Literal["top-rated", "trending"], Path()],
+    genre: Annotated[str | None, Query(min_length=1)] = None,
+    decade: Annotated[int | None, Query(gt=1000)] = None,
+    current_page: Annotated[int, Query(alias="currentPage", gt=0)] = 1,
+    page_size: Annotated[int, Query(alias="pageSize", gt=0, le=100)] = 25
+) -> JSONResponse:
+    books = await LeaderboardUtils.retrieve_leaderboard(
+        board=board, page_size=page_size, current_page=current_page, genre=genre, decade=decade
+    )
+    return generate_json_response(
+        status_code=status.HTTP_200_OK,
+        message="Leaderboard is fetched",
+        data={"books": books}
+    )
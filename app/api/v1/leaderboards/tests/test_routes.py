@@ -0,0 +1,122 @@
+from base64 import b64encode
+
+import pytest
+from starlette import status
+from starlette.testclient import TestClient
+
+from main import application
+
+
+@pytest.fixture(scope="function")
+def test_client():
+    api_test_client = TestClient(app=application)
+    yield api_test_client
+    api_test_client.close()
+
+
+def basic_auth(username, password):
+    token = b64encode(f"{username}:{password}".encode('utf-8')).decode("ascii")
+    return f'Basic {token}'
+
+
+def test_get_leaderboard(test_client):
+    # without auth header
+    response = test_client.get("http://localhost:8000/api/v1/leaderboards/top-rated")
+    assert response.status_code == status.HTTP_401_UNAUTHORIZED
+    assert response.json()["meta"]["message"] == "Not authenticated"
+
+    # unknown board
+    response = test_client.get(
+        "http://localhost:8000/api/v1/leaderboards/worst-rated",
+        headers={
+            "Authorization": basic_auth("user", "user123")
+        }
+    )
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.json()["meta"]["message"] == "Invalid value for board in path"
+
+    # genre and decade together
+    response = test_client.get(
+        "http://localhost:8000/api/v1/leaderboards/top-rated?genre=TestLeaderboardGenre&decade=2010",
+        headers={
+            "Authorization": basic_auth("user", "user123")
+        }
+    )
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.json()["meta"]["message"] == "Only one of genre and decade can be given"
+
+    # a decade must start a decade
+    response = test_client.get(
+        "http://localhost:8000/api/v1/leaderboards/top-rated?decade=2015",
+        headers={
+            "Authorization": basic_auth("user", "user123")
+        }
+    )
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    # reviewed books are ranked
+    created_books = []
+    for title, ratings in [("TestLeaderboardGood", [5, 5, 4.5]), ("TestLeaderboardBad", [1, 1.5])]:
+        response = test_client.post(
+            "http://localhost:8000/api/v1/books",
+            json={
+                "title": title,
+                "author": "TestAuthor",
+                "genre": "TestLeaderboardGenre",
+                "year_published": 2018
+            },
+            headers={
+                "Authorization": basic_auth("user", "user123")
+            }
+        )
+        created_book = response.json()["data"]["book"]
+        created_books.append(created_book)
+        for rating in ratings:
+            test_client.post(
+                f"http://localhost:8000/api/v1/books/{created_book['id']}/reviews",
+                json={
+                    "review_text": "TestReview",
+                    "rating": rating
+                },
+                headers={
+                    "Authorization": basic_auth("user", "user123")
+                }
+            )
+
+    response = test_client.get(
+        "http://localhost:8000/api/v1/leaderboards/top-rated?genre=testleaderboardgenre",
+        headers={
+            "Authorization": basic_auth("user", "user123")
+        }
+    )
+    assert response.status_code == status.HTTP_200_OK
+    books = response.json()["data"]["books"]
+    assert [book["id"] for book in books] == [book["id"] for book in created_books]
+    assert books[0]["rank"] == 1
+    assert books[0]["reviews"] == 3
+    assert books[0]["rating"] == 4.8
+
+    response = test_client.get(
+        "http://localhost:8000/api/v1/leaderboards/trending?decade=2010&pageSize=1",
+        headers={
+            "Authorization": basic_auth("user", "user123")
+        }
+    )
+    assert response.status_code == status.HTTP_200_OK
+    assert len(response.json()["data"]["books"]) == 1
+
+    # deleted books leave the boards
+    for created_book in created_books:
+        test_client.delete(
+            f"http://localhost:8000/api/v1/books/{created_book['id']}",
+            headers={
+                "Authorization": basic_auth("user", "user123")
+            }
+        )
+    response = test_client.get(
+        "http://localhost:8000/api/v1/leaderboards/top-rated?genre=TestLeaderboardGenre",
+        headers={
+            "Authorization": basic_auth("user", "user123")
+        }
+    )
+    assert response.json()["data"]["books"] == []
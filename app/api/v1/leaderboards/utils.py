@@ -0,0 +1,38 @@
+from starlette import status
+
+from core.caching.leaderboards import book_leaderboards
+from core.exceptions import HTTPException
+
+
+class LeaderboardUtils:
+    """
+    A class that encapsulates all the utility methods required for the leaderboards
+    """
+
+    @staticmethod
+    async def retrieve_leaderboard(
+        board: str, page_size: int, current_page: int, genre: str | None = None, decade: int | None = None
+    ):
+        """
+        This method returns a page of a leaderboard, overall or of a genre or a decade
+        """
+        if genre is not None and decade is not None:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                message="Only one of genre and decade can be given"
+            )
+        if decade is not None and decade % 10:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                message="Invalid value for decade in query. It must be a multiple of 10"
+            )
+        books = await book_leaderboards.get_page(
+            board=board, page_size=page_size, current_page=current_page, genre=genre, decade=decade
+        )
+        # The boards live only in redis
+        if books is None:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                message="Leaderboards are not available. Please try again later"
+            )
+        return books
@@ -5,14 +5,14 @@ from fastapi.routing import APIRouter
 from fastapi.responses import JSONResponse
 from starlette import status
 
-from core.dependencies import get_current_user
+from core.dependencies import RateLimiter, get_current_user
 from core.responses import generate_json_response
 from core.schemas import UserSchema
 
 recommendation_route = APIRouter(prefix="")
 
 
-@recommendation_route.get("/recommendations")
+@recommendation_route.get("/recommendations", dependencies=[Depends(RateLimiter())])
 async def get_recommendations(
     current_user: Annotated[UserSchema, Depends(get_current_user)],
 ) -> JSONResponse:
@@ -44,3 +44,5 @@ def test_get_recommendations(test_client):
     )
     assert response.status_code == status.HTTP_200_OK
     assert response.json()["data"]["recommended_books"] == []
+    assert int(response.headers["RateLimit-Limit"]) > 0
+    assert int(response.headers["RateLimit-Remaining"]) < int(response.headers["RateLimit-Limit"])
@@ -1,13 +1,19 @@
 from fastapi.routing import APIRouter
 
+from .auth.routes import auth_route
 from .books.routes import book_route
+from .leaderboards.routes import leaderboard_route
 from .recommendations.routes import recommendation_route
+from .search.routes import search_route
 from .summary.routes import summary_route
 
 
 v1_router = APIRouter(prefix="/api/v1")
 
+v1_router.include_router(auth_route)
 v1_router.include_router(book_route)
+v1_router.include_router(leaderboard_route)
 v1_router.include_router(recommendation_route)
+v1_router.include_router(search_route)
 v1_router.include_router(summary_route)
 
@@ -0,0 +1,47 @@
+from typing import Annotated
+
+from fastapi import Depends, Path, Query
+from fastapi.routing import APIRouter
+from fastapi.responses import JSONResponse
+from pydantic import AfterValidator
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette import status
+
+from api.v1.search.utils import SearchUtils
+from core.dependencies import RateLimiter, get_db_session, get_current_user
+from core.responses import generate_json_response
+from core.schemas import UserSchema
+
+search_route = APIRouter(prefix="")
+
+
+@search_route.get("/search", dependencies=[Depends(RateLimiter())])
+async def search_books(
+    db_session: Annotated[AsyncSession, Depends(get_db_session)],
+    _: Annotated[UserSchema, Depends(get_current_user)],
+    query: Annotated[str, AfterValidator(lambda x: x.strip()), Query(alias="q", min_length=1)],
+    limit: Annotated[int, Query(gt=0, le=50)] = 10
+) -> JSONResponse:
+    search_utils = SearchUtils(db_session=db_session)
+    books = await search_utils.search_books(query=query, limit=limit)
+    return generate_json_response(
+        status_code=status.HTTP_200_OK,
+        message="Books are fetched",
+        data={"books": books}
+    )
+
+
+@search_route.get("/books/{book_id}/similar", dependencies=[Depends(RateLimiter())])
+async def get_similar_books(
+    db_session: Annotated[AsyncSession, Depends(get_db_session)],
+    _: Annotated[UserSchema, Depends(get_current_user)],
+    book_id: Annotated[str, AfterValidator(lambda x: x.strip()), Path(min_length=1)],
+    limit: Annotated[int, Query(gt=0, le=50)] = 10
+) -> JSONResponse:
+    search_utils = SearchUtils(db_session=db_session)
+    books = await search_utils.retrieve_similar_books(book_id=book_id, limit=limit)
+    return generate_json_response(
+        status_code=status.HTTP_200_OK,
+        message="Similar books are fetched",
+        data={"books": books}
+    )
@@ -0,0 +1,63 @@
+from base64 import b64encode
+
+import pytest
+from starlette import status
+from starlette.testclient import TestClient
+
+from main import application
+
+
+@pytest.fixture(scope="function")
+def test_client():
+    api_test_client = TestClient(app=application)
+    yield api_test_client
+    api_test_client.close()
+
+
+def basic_auth(username, password):
+    token = b64encode(f"{username}:{password}".encode('utf-8')).decode("ascii")
+    return f'Basic {token}'
+
+
+def test_search_books(test_client):
+    # without auth header
+    response = test_client.get("http://localhost:8000/api/v1/search?q=dragons")
+    assert response.status_code == status.HTTP_401_UNAUTHORIZED
+    assert response.json()["meta"]["message"] == "Not authenticated"
+
+    # without query
+    response = test_client.get(
+        "http://localhost:8000/api/v1/search",
+        headers={
+            "Authorization": basic_auth("user", "user123")
+        }
+    )
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.json()["meta"]["message"] == "Missing q in query"
+
+    # with invalid limit
+    response = test_client.get(
+        "http://localhost:8000/api/v1/search?q=dragons&limit=0",
+        headers={
+            "Authorization": basic_auth("user", "user123")
+        }
+    )
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.json()["meta"]["message"] == "Invalid value for limit in query. Input should be greater than 0"
+
+
+def test_get_similar_books(test_client):
+    # without auth header
+    response = test_client.get("http://localhost:8000/api/v1/books/test_book_id/similar")
+    assert response.status_code == status.HTTP_401_UNAUTHORIZED
+    assert response.json()["meta"]["message"] == "Not authenticated"
+
+    # non existing book
+    response = test_client.get(
+        "http://localhost:8000/api/v1/books/test_book/similar",
+        headers={
+            "Authorization": basic_auth("user", "user123")
+        }
+    )
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+    assert response.json()["meta"]["message"] == "Book not found"
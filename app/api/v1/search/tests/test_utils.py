@@ -0,0 +1,100 @@
+import asyncio
+
+import pytest
+import pytest_asyncio
+from sqlalchemy import delete, insert
+
+from api.v1.search.utils import SearchUtils
+from core.database.base import get_async_session
+from core.database.models import Book
+from core.exceptions import HTTPException
+
+
+@pytest_asyncio.fixture(scope='session')
+def event_loop(request):
+    """Create an instance of the default event loop for each test case."""
+    loop = asyncio.get_event_loop_policy().new_event_loop()
+    yield loop
+    loop.close()
+
+
+# All test coroutines will be treated as marked.
+pytestmark = pytest.mark.asyncio
+
+
+@pytest_asyncio.fixture(scope="function")
+async def db_session():
+    session_object = get_async_session()()
+    yield session_object
+    await session_object.execute(
+        delete(Book)
+    )
+    await session_object.commit()
+    await session_object.close()
+
+
+@pytest_asyncio.fixture(scope="function")
+async def book_ids(db_session):
+    books = [
+        {
+            "title": "The Dragon Keeper",
+            "author": "TestAuthor",
+            "genre": "Fantasy",
+            "year_published": 2020,
+            "summary": "A young girl raises a dragon in the mountains"
+        },
+        {
+            "title": "Tax Law Basics",
+            "author": "TestAuthor",
+            "genre": "Law",
+            "year_published": 2021,
+            "summary": "An introduction to income taxes"
+        },
+        {
+            "title": "Mountain Riders",
+            "author": "TestAuthor",
+            "genre": "Fantasy",
+            "year_published": 2022,
+            "summary": "The riders of the last dragons"
+        }
+    ]
+    result = await db_session.execute(insert(Book).values(books).returning(Book.id))
+    book_ids = list(result.scalars().all())
+    await db_session.commit()
+    yield book_ids
+
+
+async def test_search_books(db_session, book_ids):
+    search_utils = SearchUtils(db_session)
+
+    # the words are matched by their stem, and a word of the title weighs more
+    found_books = await search_utils.search_books(query="dragons", limit=10)
+    assert [book["id"] for book in found_books] == [book_ids[0], book_ids[2]]
+    assert found_books[0]["title"] == "The Dragon Keeper"
+    assert 0 < found_books[1]["score"] <= found_books[0]["score"] < 1
+
+    # every word must match, unless excluded
+    found_books = await search_utils.search_books(query="dragon mountain", limit=10)
+    assert sorted(book["id"] for book in found_books) == sorted([book_ids[0], book_ids[2]])
+    found_books = await search_utils.search_books(query="dragon -riders", limit=10)
+    assert [book["id"] for book in found_books] == [book_ids[0]]
+
+    found_books = await search_utils.search_books(query="dragon", limit=1)
+    assert len(found_books) == 1
+
+    # no book has the word
+    assert await search_utils.search_books(query="spaceships", limit=10) == []
+
+
+async def test_retrieve_similar_books(db_session, book_ids):
+    search_utils = SearchUtils(db_session)
+    with pytest.raises(HTTPException) as he:
+        await search_utils.retrieve_similar_books(book_id="non-existing-book", limit=10)
+    assert he.value.message == "Book not found"
+
+    similar_books = await search_utils.retrieve_similar_books(book_id=book_ids[0], limit=10)
+    assert [book["id"] for book in similar_books] == [book_ids[2]]
+    assert similar_books[0]["title"] == "Mountain Riders"
+
+    # no other book shares a word with it
+    assert await search_utils.retrieve_similar_books(book_id=book_ids[1], limit=10) == []
@@ -0,0 +1,49 @@
+import re
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette import status
+
+from core.exceptions import HTTPException
+from core.helpers.db_helper import DbHelper
+from core.schemas import BookSchema
+
+WORD_PATTERN = re.compile(r"\w+")
+
+
+class SearchUtils:
+    """
+    A class that encapsulates all the utility methods required for searching books
+    """
+
+    def __init__(self, db_session: AsyncSession):
+        self.db_helper = DbHelper(db_session=db_session)
+
+    async def search_books(self, query: str, limit: int):
+        """
+        This method returns the books whose title and summary match the query, the best first.
+        The words are matched by their stem, e.g. dragons matches dragon
+        """
+        return await self.find_books(query=query, limit=limit)
+
+    async def retrieve_similar_books(self, book_id: str, limit: int):
+        """
+        This method returns the books sharing the most words with the title and the summary of a book
+        """
+        book = await self.db_helper.get_book(filters={"id": book_id})
+        if not book:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, message="Book not found")
+        # Any of the words of the book. "or" is an operator of the query, so the word itself is dropped
+        words = dict.fromkeys(
+            word for word in WORD_PATTERN.findall(f"{book.title} {book.summary}".lower()) if word != "or"
+        )
+        return await self.find_books(query=" or ".join(words), limit=limit, exclude_id=book_id)
+
+    async def find_books(self, query: str, limit: int, exclude_id: str = ""):
+        """
+        This method returns the details of the matching books, with their rank as score
+        """
+        found_books = await self.db_helper.search_books(query=query, limit=limit, exclude_id=exclude_id)
+        return [
+            {**BookSchema.model_validate(book).model_dump(), "score": round(score, 4)}
+            for book, score in found_books
+        ]
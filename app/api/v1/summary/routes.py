@@ -8,14 +8,16 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from starlette import status
 
 from api.v1.summary.utils import SummaryUtils
-from core.dependencies import get_db_session, get_current_user
+from core.dependencies import RateLimiter, get_db_session, get_current_user
 from core.responses import generate_json_response
 from core.schemas import UserSchema
 
 summary_route = APIRouter(prefix="")
 
 
-@summary_route.post("/generate-summary")
+# Generating a summary is expensive. So, it costs more and only a couple of them
+# can run at the same time for a user
+@summary_route.post("/generate-summary", dependencies=[Depends(RateLimiter(cost=10, max_concurrency=2))])
 async def generate_summary(
     db_session: Annotated[AsyncSession, Depends(get_db_session)],
     _: Annotated[UserSchema, Depends(get_current_user)],
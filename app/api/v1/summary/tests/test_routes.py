@@ -1,9 +1,12 @@
+import asyncio
 from base64 import b64encode
+from concurrent.futures import ThreadPoolExecutor
 
 import pytest
 from starlette import status
 from starlette.testclient import TestClient
 
+from api.v1.summary.utils import SummaryUtils
 from core.logger import logger
 from main import application
 
@@ -88,3 +91,36 @@ def test_generate_summary(test_client):
     assert response.status_code == status.HTTP_200_OK
     assert response.json()["data"]["summary"]["summary"].startswith("This is a sample summary")
 
+
+def test_generate_summary_concurrency(monkeypatch):
+    async def generate_summary_for_book(self, book_id):
+        await asyncio.sleep(1)
+
+    monkeypatch.setattr(SummaryUtils, "generate_summary_for_book", generate_summary_for_book)
+
+    def post_generate_summary(_):
+        api_test_client = TestClient(app=application)
+        response = api_test_client.post(
+            "http://localhost:8000/api/v1/generate-summary?book_id=test_book",
+            headers={
+                "Authorization": basic_auth("user", "user123")
+            }
+        )
+        api_test_client.close()
+        return response
+
+    # only 2 summaries of a user are generated at the same time
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        responses = list(executor.map(post_generate_summary, range(3)))
+    assert sorted(response.status_code for response in responses) == [
+        status.HTTP_201_CREATED,
+        status.HTTP_201_CREATED,
+        status.HTTP_429_TOO_MANY_REQUESTS
+    ]
+    rejected_response = next(response for response in responses if response.status_code == 429)
+    assert rejected_response.json()["meta"]["message"] == "Too many concurrent requests"
+    assert rejected_response.headers["Retry-After"] == "1"
+
+    # the slots are released once the requests are done
+    response = post_generate_summary(0)
+    assert response.status_code == status.HTTP_201_CREATED
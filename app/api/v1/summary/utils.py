@@ -2,7 +2,7 @@ from datetime import datetime
 
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from api.v1.books.utils import only_if_book_exists
+from api.v1.books.utils import cache_book, only_if_book_exists
 from core.caching.redis import RedisClient
 from core.helpers.db_helper import DbHelper
 from core.logger import logger
@@ -34,4 +34,7 @@ class SummaryUtils:
         summary = (f"This is a sample summary generated at {datetime_to_string(datetime.now())}. "
                    f"Actual summary to be generated by Llama3 generative AI model."
                    f" This functionality is not implemented. Thanks!")
-        await self.db_helper.store_summary(book_id=book_id, summary=summary)
+        book = await self.db_helper.store_summary(book_id=book_id, summary=summary)
+        # The summary changes the version of the book, so the cache is refreshed
+        if book:
+            await cache_book(self.db_helper, self.redis_client, book)
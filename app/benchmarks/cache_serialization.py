@@ -0,0 +1,61 @@
+"""
+Compares the size and the encode/decode cost of the cached values with the previous
+JSON text and the CacheSerializer formats.
+
+Run from the app directory:
+    python -m benchmarks.cache_serialization
+"""
+import json
+import time
+
+from core.caching.serializers import CacheSerializer, msgpack
+from core.schemas import BookSchema
+
+
+def time_per_call(func, iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - start) / iterations * 1_000_000
+
+
+def generate_values() -> dict[str, object]:
+    book = BookSchema(
+        id="0" * 32, title="The Book Title", author="The Author", genre="Fiction", year_published=2001, version=3
+    ).model_dump()
+    return {
+        "book": book,
+        "book with summary": {**book, "summary": "This is a sample summary of the book. " * 100},
+        "200 reviews": [
+            {"review_text": f"A review of the book, number {i}. It was a good read.", "user": f"user{i}", "rating": 4.5}
+            for i in range(200)
+        ],
+    }
+
+
+def main(iterations: int = 20_000):
+    serializers = {"json": CacheSerializer(use_msgpack=False), "json+zlib": CacheSerializer(use_msgpack=False)}
+    if msgpack is not None:
+        serializers["msgpack"] = CacheSerializer(compression_threshold=1 << 30)
+        serializers["msgpack+zlib"] = CacheSerializer()
+    # Without compression, to compare with the text
+    serializers["json"].compression_threshold = 1 << 30
+
+    for name, value in generate_values().items():
+        print(f"\n{name}")
+        print(f"{'format':<16}{'bytes':>8}{'encode µs':>12}{'decode µs':>12}")
+        # What was stored before: JSON text, decoded from UTF-8 by redis-py and then parsed
+        text = json.dumps(value)
+        encoded_text = text.encode("utf8")
+        encode = time_per_call(lambda: json.dumps(value).encode("utf8"), iterations)
+        decode = time_per_call(lambda: json.loads(encoded_text.decode("utf8")), iterations)
+        print(f"{'text (before)':<16}{len(encoded_text):>8}{encode:>12.2f}{decode:>12.2f}")
+        for serializer_name, serializer in serializers.items():
+            data = serializer.dumps(value)
+            encode = time_per_call(lambda: serializer.dumps(value), iterations)
+            decode = time_per_call(lambda: serializer.loads(data), iterations)
+            print(f"{serializer_name:<16}{len(data):>8}{encode:>12.2f}{decode:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Compares bytes on the wire and CPU cost of the response compression.
+
+Run from the app directory:
+    python -m benchmarks.compression
+"""
+import json
+import time
+import zlib
+
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from core.middlewares.compression import CompressionMiddleware, brotli
+
+
+def generate_books_payload(page_size: int) -> dict:
+    """
+    Generates a payload shaped like the response of GET /books
+    """
+    return {
+        "meta": {"message": "Books are fetched"},
+        "data": {
+            "books": [
+                {
+                    "title": f"The Book Title Number {i}",
+                    "author": f"Author {i % 97}",
+                    "id": f"{i:032x}"
+                }
+                for i in range(page_size)
+            ]
+        }
+    }
+
+
+def time_per_call(func, iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - start) / iterations * 1_000_000
+
+
+def gzip_compress(body: bytes, level: int) -> bytes:
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    return compressor.compress(body) + compressor.flush()
+
+
+def benchmark_codecs(body: bytes, iterations: int):
+    print(f"{'codec':<16}{'bytes':>10}{'ratio':>8}{'µs/response':>14}")
+    print(f"{'identity':<16}{len(body):>10}{1:>8.2f}{0:>14.1f}")
+    for level in (1, 6, 9):
+        compressed = gzip_compress(body, level)
+        cost = time_per_call(lambda: gzip_compress(body, level), iterations)
+        print(f"{f'gzip-{level}':<16}{len(compressed):>10}{len(body) / len(compressed):>8.2f}{cost:>14.1f}")
+    if brotli is None:
+        print("brotli is not installed, skipping")
+        return
+    for quality in (1, 4, 11):
+        compressed = brotli.compress(body, quality=quality)
+        cost = time_per_call(lambda: brotli.compress(body, quality=quality), max(iterations // 10, 1))
+        print(f"{f'br-{quality}':<16}{len(compressed):>10}{len(body) / len(compressed):>8.2f}{cost:>14.1f}")
+
+
+def benchmark_middleware(payload: dict, iterations: int):
+    """
+    Measures the end to end cost of a request through the middleware
+    """
+    async def endpoint(_):
+        return JSONResponse(payload)
+
+    for accept_encoding in ("identity", "gzip", "br"):
+        app = Starlette(routes=[Route("/books", endpoint)])
+        app.add_middleware(CompressionMiddleware)
+        client = TestClient(app)
+        response = client.get("/books", headers={"Accept-Encoding": accept_encoding})
+        wire_bytes = int(response.headers["content-length"])
+        cost = time_per_call(
+            lambda: client.get("/books", headers={"Accept-Encoding": accept_encoding}),
+            iterations
+        )
+        encoding = response.headers.get("content-encoding", "identity")
+        print(f"{accept_encoding:<16}{encoding:<10}{wire_bytes:>10}{cost:>14.1f}")
+
+
+if __name__ == "__main__":
+    for page_size in (25, 500):
+        payload = generate_books_payload(page_size)
+        body = json.dumps(payload).encode()
+        print(f"\nGET /books?pageSize={page_size}")
+        benchmark_codecs(body, iterations=200)
+        print(f"\n{'accept-encoding':<16}{'sent':<10}{'bytes':>10}{'µs/request':>14}")
+        benchmark_middleware(payload, iterations=200)
@@ -0,0 +1,59 @@
+"""
+Measures how much the password verification stalls the event loop under concurrent logins.
+
+Run from the app directory:
+    python -m benchmarks.password_hashing
+"""
+import asyncio
+import statistics
+import time
+
+from core.passwords import check_password, hash_password, verified_credentials, verify_password
+
+PASSWORD = "user123"
+
+
+async def measure_loop_lag(stop: asyncio.Event, interval: float = 0.001) -> list[float]:
+    """
+    Sleeps for the interval repeatedly and records how late the loop woke it up, in ms
+    """
+    lags = []
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append((time.perf_counter() - start - interval) * 1000)
+    return lags
+
+
+async def inline_verify(password: str, password_hash: str) -> bool:
+    # What the verification would cost without the hasher threads
+    return check_password(password, password_hash)
+
+
+async def run(verify, password_hash: str, logins: int) -> tuple[float, float, float]:
+    stop = asyncio.Event()
+    lag_task = asyncio.create_task(measure_loop_lag(stop))
+    await asyncio.sleep(0.01)
+    start = time.perf_counter()
+    await asyncio.gather(*(verify(PASSWORD, password_hash) for _ in range(logins)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    lags = await lag_task
+    return elapsed * 1000, statistics.median(lags), max(lags)
+
+
+async def main():
+    password_hash = hash_password(PASSWORD)
+    print(f"{'mode':<12}{'logins':>8}{'total ms':>12}{'p50 lag ms':>12}{'max lag ms':>12}")
+    for logins in (1, 16, 64):
+        for mode, verify in (("inline", inline_verify), ("offloaded", verify_password), ("cached", verify_password)):
+            if mode == "offloaded":
+                verified_credentials.entries.clear()
+            elif mode == "cached":
+                await verify_password(PASSWORD, password_hash)
+            elapsed, median_lag, max_lag = await run(verify, password_hash, logins)
+            print(f"{mode:<12}{logins:>8}{elapsed:>12.1f}{median_lag:>12.2f}{max_lag:>12.2f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,69 @@
+"""
+Compares the throughput of listing books as full ORM objects with the column projection
+used by DbHelper.get_all_books. It runs against an in-memory sqlite DB, so it measures
+the hydration and serialisation cost on the app side, not the DB.
+
+Run from the app directory:
+    python -m benchmarks.row_projection
+"""
+import time
+
+from sqlalchemy import create_engine, insert, select
+from sqlalchemy.orm import Session
+
+from api.v1.books.utils import DEFAULT_BOOK_LIST_FIELDS
+from core.database.models import Book
+from core.helpers.db_helper import get_books_page_query
+from core.schemas import BookSchema
+
+PAGE_SIZE = 10_000
+# Summaries are generated text of a few KB
+SUMMARY = "This is a sample summary of the book. " * 100
+
+
+def full_entities(session: Session) -> list[dict]:
+    # How the books were listed before
+    books = session.execute(select(Book).offset(0).limit(PAGE_SIZE)).scalars().all()
+    return [BookSchema.model_validate(book).model_dump(include={"author", "title", "id"}) for book in books]
+
+
+def projection(session: Session) -> list[dict]:
+    result = session.execute(get_books_page_query(DEFAULT_BOOK_LIST_FIELDS), {"offset": 0, "limit": PAGE_SIZE})
+    return [dict(row) for row in result.mappings()]
+
+
+def main(iterations: int = 5):
+    engine = create_engine("sqlite://")
+    Book.__table__.create(engine)
+    with Session(engine) as session:
+        session.execute(
+            insert(Book),
+            [
+                {
+                    "id": f"{i:032x}",
+                    "title": f"The Book Title Number {i}",
+                    "author": f"Author {i % 97}",
+                    "genre": "Fiction",
+                    "year_published": 2000 + i % 24,
+                    "summary": SUMMARY
+                }
+                for i in range(PAGE_SIZE)
+            ]
+        )
+        session.commit()
+
+    print(f"{'read path':<16}{'ms/page':>10}{'rows/sec':>12}")
+    for name, read_page in (("ORM entities", full_entities), ("projection", projection)):
+        elapsed = 0.0
+        for _ in range(iterations):
+            # A new session per page, like a request
+            with Session(engine) as session:
+                start = time.perf_counter()
+                books = read_page(session)
+                elapsed += time.perf_counter() - start
+        assert len(books) == PAGE_SIZE
+        print(f"{name:<16}{elapsed / iterations * 1000:>10.1f}{PAGE_SIZE * iterations / elapsed:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
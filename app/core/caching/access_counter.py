@@ -0,0 +1,63 @@
+import time
+from collections import Counter
+
+import redis.asyncio as redis
+
+from core.caching.redis import get_redis_connection
+from core.config import get_config
+from core.logger import logger
+
+config = get_config()
+
+BOOK_ACCESS_KEY = "book_access"
+
+
+class AccessCounter:
+    """
+    Counts the reads of the members (e.g. book ids) in a redis sorted set, so the most
+    requested ones can be found later. The counts are buffered in the worker and flushed
+    periodically with a pipeline, so a read doesn't pay for a round trip. Only the most
+    read members are kept in the set.
+    """
+
+    def __init__(self, key: str):
+        self.key = key
+        self.counts: Counter[str] = Counter()
+        self.flushed_at = time.monotonic()
+
+    async def record(self, member: str):
+        self.counts[member] += 1
+        if time.monotonic() - self.flushed_at > config.cache_warmer.access_flush_interval:
+            await self.flush()
+
+    async def flush(self):
+        """
+        Adds the buffered counts to the sorted set and trims it to the most read members
+        """
+        # Swapped before the round trip, so that the reads in between are counted in the next flush
+        self.flushed_at = time.monotonic()
+        counts, self.counts = self.counts, Counter()
+        if not counts:
+            return
+        try:
+            async with get_redis_connection().pipeline(transaction=False) as pipe:
+                for member, count in counts.items():
+                    pipe.zincrby(self.key, count, member)
+                pipe.zremrangebyrank(self.key, 0, -config.cache_warmer.max_tracked - 1)
+                await pipe.execute()
+        except redis.RedisError as er:
+            # The counts are only a hint, so they are dropped
+            logger.info(f"Redis error - {er}")
+
+    async def get_top(self, count: int) -> list[str]:
+        """
+        Returns the most read members, the most read first
+        """
+        try:
+            return await get_redis_connection().zrevrange(self.key, 0, count - 1)
+        except redis.RedisError as er:
+            logger.info(f"Redis error - {er}")
+            return []
+
+
+book_access_counter = AccessCounter(key=BOOK_ACCESS_KEY)
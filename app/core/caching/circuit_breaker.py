@@ -0,0 +1,100 @@
+import time
+
+from core.config import get_config
+from core.logger import logger
+from core.metrics import Counter, Gauge
+
+config = get_config()
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+STATE_VALUES = {CLOSED: 0, OPEN: 1, HALF_OPEN: 2}
+
+circuit_breaker_state = Gauge(
+    "circuit_breaker_state",
+    "State of the circuit breaker. 0 is closed, 1 is open and 2 is half open",
+    ("name",)
+)
+circuit_breaker_transitions = Counter(
+    "circuit_breaker_transitions_total",
+    "Number of state changes of the circuit breaker",
+    ("name", "state")
+)
+circuit_breaker_rejected_calls = Counter(
+    "circuit_breaker_rejected_calls_total",
+    "Number of calls skipped because the circuit breaker was open",
+    ("name",)
+)
+
+
+class CircuitBreaker:
+    """
+    Stops calling a dependency that keeps failing or responding slowly. After
+    failure_threshold consecutive failed or slow calls, the breaker opens and the calls
+    are skipped. After reset_timeout seconds, it is half open and a single call is let
+    through as a probe. The breaker closes if the probe succeeds and opens again if not.
+    """
+
+    def __init__(self, name: str, failure_threshold: int, slow_call_threshold: float, reset_timeout: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.slow_call_threshold = slow_call_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        # Set while the probe of the half open state is in flight
+        self.probe_started_at: float | None = None
+        circuit_breaker_state.set(STATE_VALUES[CLOSED], name=name)
+
+    def transition(self, state: str):
+        logger.info(f"Circuit breaker {self.name} - {self.state} -> {state}")
+        self.state = state
+        circuit_breaker_state.set(STATE_VALUES[state], name=self.name)
+        circuit_breaker_transitions.inc(name=self.name, state=state)
+
+    def allow_request(self) -> bool:
+        """
+        Returns True if the call can be made
+        """
+        if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.transition(HALF_OPEN)
+        if self.state == CLOSED:
+            return True
+        # A probe that never reported back (e.g. cancelled) is replaced after the reset timeout
+        if self.state == HALF_OPEN and (
+            self.probe_started_at is None or time.monotonic() - self.probe_started_at > self.reset_timeout
+        ):
+            self.probe_started_at = time.monotonic()
+            return True
+        circuit_breaker_rejected_calls.inc(name=self.name)
+        return False
+
+    def record_success(self, duration: float):
+        """
+        Records a call that succeeded in the given seconds. A slow call counts as a failure
+        """
+        if duration > self.slow_call_threshold:
+            self.record_failure()
+            return
+        self.failures = 0
+        if self.state == HALF_OPEN:
+            self.probe_started_at = None
+            self.transition(CLOSED)
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == HALF_OPEN or (self.state == CLOSED and self.failures >= self.failure_threshold):
+            self.probe_started_at = None
+            self.opened_at = time.monotonic()
+            self.transition(OPEN)
+
+
+redis_circuit_breaker = CircuitBreaker(
+    name="redis",
+    failure_threshold=config.redis.circuit_breaker_failure_threshold,
+    slow_call_threshold=config.redis.circuit_breaker_slow_call_threshold,
+    reset_timeout=config.redis.circuit_breaker_reset_timeout
+)
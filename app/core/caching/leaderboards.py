@@ -0,0 +1,303 @@
+import math
+import time
+from typing import Any, Awaitable, Callable
+
+from core.caching.redis import RedisClient, get_redis_connection
+from core.config import get_config
+
+config = get_config()
+
+TOP_RATED = "top-rated"
+TRENDING = "trending"
+BOARDS = (TOP_RATED, TRENDING)
+
+# The sorted sets are written under this suffix by a rebuild and then renamed at once
+REBUILD_SUFFIX = ":rebuild"
+# Sorted sets written in one pipeline by a rebuild
+REBUILD_BATCH_SIZE = 1000
+
+# A review adds exp(decay_rate * t) to the trending score of its book, so the older
+# reviews count exponentially less. The sum is kept as its logarithm, which doesn't
+# overflow and is updated with a single log-add. Since every score decays at the same
+# rate, the order of the books never needs to be recomputed.
+DECAY_RATE = math.log(2) / config.leaderboards.trending_half_life
+
+# Adds a review to the stats of a book and updates its scores on every board it is on.
+# KEYS[1] is the stats hash, KEYS[2..4] the top rated and KEYS[5..7] the trending boards.
+# ARGV holds the book id, the rating, the trending score of the review, the prior rating
+# and weight, and then the title, author, genre and decade of the book
+RECORD_REVIEW_SCRIPT = """
+local count = redis.call('HINCRBY', KEYS[1], 'count', 1)
+local total = tonumber(redis.call('HINCRBYFLOAT', KEYS[1], 'sum', ARGV[2]))
+local trend = tonumber(ARGV[3])
+local current = redis.call('HGET', KEYS[1], 'trend')
+if current then
+    current = tonumber(current)
+    local high = math.max(current, trend)
+    trend = high + math.log(1 + math.exp(math.min(current, trend) - high))
+end
+redis.call('HSET', KEYS[1], 'trend', trend, 'title', ARGV[6], 'author', ARGV[7], 'genre', ARGV[8], 'decade', ARGV[9])
+local rating = (tonumber(ARGV[4]) * tonumber(ARGV[5]) + total) / (tonumber(ARGV[5]) + count)
+for i = 2, 4 do
+    redis.call('ZADD', KEYS[i], rating, ARGV[1])
+end
+for i = 5, 7 do
+    redis.call('ZADD', KEYS[i], trend, ARGV[1])
+end
+return 1
+"""
+
+
+def get_decade(year: int) -> int:
+    return year // 10 * 10
+
+
+def get_board_key(board: str, genre: str | None = None, decade: int | None = None) -> str:
+    """
+    Returns the key of the overall board, or of the board of a genre or a decade
+    """
+    if genre is not None:
+        return f"leaderboard:{board}:genre:{genre.strip().lower()}"
+    if decade is not None:
+        return f"leaderboard:{board}:decade:{decade}"
+    return f"leaderboard:{board}:all"
+
+
+def get_stats_key(book_id: str) -> str:
+    return f"leaderboard:book:{book_id}"
+
+
+def get_book_board_keys(board: str, genre: str, decade: int) -> list[str]:
+    """
+    Returns the keys of every board of the given kind a book is on
+    """
+    return [get_board_key(board), get_board_key(board, genre=genre), get_board_key(board, decade=decade)]
+
+
+def get_review_script_arguments(
+    book: dict[str, Any], rating: float, reviewed_at: float, suffix: str = ""
+) -> tuple[list[str], list[Any]]:
+    """
+    Returns the keys and the arguments of the script recording a review, on the boards
+    written under the given suffix
+    """
+    decade = get_decade(book["year_published"])
+    keys = [
+        get_stats_key(book["id"]),
+        *get_book_board_keys(TOP_RATED, book["genre"], decade),
+        *get_book_board_keys(TRENDING, book["genre"], decade)
+    ]
+    args = [
+        book["id"],
+        float(rating),
+        DECAY_RATE * reviewed_at,
+        config.leaderboards.prior_rating,
+        config.leaderboards.prior_weight,
+        book["title"],
+        book["author"],
+        book["genre"],
+        decade
+    ]
+    return [key + suffix for key in keys], args
+
+
+def get_bayesian_rating(count: int, total: float) -> float:
+    prior_weight = config.leaderboards.prior_weight
+    return (config.leaderboards.prior_rating * prior_weight + total) / (prior_weight + count)
+
+
+class BookLeaderboards:
+    """
+    Keeps the top rated and the trending books, overall, per genre and per decade of
+    publication, in redis sorted sets. They are updated incrementally as the reviews are
+    added, so a page of a board is a single ZREVRANGE. The per book stats are kept in a
+    hash next to the boards. A periodic rebuild from the DB fixes any missed update.
+    """
+
+    async def record_review(self, book: dict[str, Any], rating: float, reviewed_at: float | None = None):
+        """
+        Adds a review of the given rating to the stats of the book and moves it on its boards
+        """
+        connection = get_redis_connection()
+        script = connection.register_script(RECORD_REVIEW_SCRIPT)
+        keys, args = get_review_script_arguments(book, rating, reviewed_at or time.time())
+        await RedisClient.execute(lambda: script(keys=keys, args=args))
+
+    async def update_book(self, book: dict[str, Any]):
+        """
+        Updates the details of a ranked book. If its genre or decade changed, it is moved
+        to the boards of the new ones with its scores
+        """
+        connection = get_redis_connection()
+        stats_key = get_stats_key(book["id"])
+        genre, decade, trend = await RedisClient.execute(
+            lambda: connection.hmget(stats_key, ["genre", "decade", "trend"]), default=(None, None, None)
+        )
+        if genre is None:
+            # Not reviewed yet, so not ranked
+            return
+        new_decade = get_decade(book["year_published"])
+
+        async def command():
+            rating = await connection.zscore(get_board_key(TOP_RATED), book["id"])
+            async with connection.pipeline(transaction=False) as pipe:
+                pipe.hset(stats_key, mapping={
+                    "title": book["title"], "author": book["author"], "genre": book["genre"], "decade": new_decade
+                })
+                if (genre.strip().lower(), int(decade)) != (book["genre"].strip().lower(), new_decade):
+                    for board, score in [(TOP_RATED, rating), (TRENDING, trend)]:
+                        for key in get_book_board_keys(board, genre, int(decade))[1:]:
+                            pipe.zrem(key, book["id"])
+                        if score is not None:
+                            for key in get_book_board_keys(board, book["genre"], new_decade)[1:]:
+                                pipe.zadd(key, {book["id"]: float(score)})
+                await pipe.execute()
+
+        await RedisClient.execute(command)
+
+    async def remove_book(self, book_id: str):
+        """
+        Removes a deleted book from its boards
+        """
+        connection = get_redis_connection()
+        stats_key = get_stats_key(book_id)
+        genre, decade = await RedisClient.execute(
+            lambda: connection.hmget(stats_key, ["genre", "decade"]), default=(None, None)
+        )
+        if genre is None:
+            return
+
+        async def command():
+            async with connection.pipeline(transaction=False) as pipe:
+                for board in BOARDS:
+                    for key in get_book_board_keys(board, genre, int(decade)):
+                        pipe.zrem(key, book_id)
+                pipe.delete(stats_key)
+                await pipe.execute()
+
+        await RedisClient.execute(command)
+
+    async def get_page(
+        self, board: str, page_size: int, current_page: int, genre: str | None = None, decade: int | None = None
+    ) -> list[dict[str, Any]] | None:
+        """
+        Returns a page of a board, best first. Returns None if redis is not available
+        """
+        connection = get_redis_connection()
+        start = (current_page - 1) * page_size
+        ranked = await RedisClient.execute(
+            lambda: connection.zrevrange(
+                get_board_key(board, genre=genre, decade=decade), start, start + page_size - 1, withscores=True
+            )
+        )
+        if ranked is None:
+            return None
+
+        async def command():
+            async with connection.pipeline(transaction=False) as pipe:
+                for book_id, _ in ranked:
+                    pipe.hmget(get_stats_key(book_id), ["title", "author", "count", "sum"])
+                return await pipe.execute()
+
+        all_stats = await RedisClient.execute(command, default=[]) if ranked else []
+        if len(all_stats) != len(ranked):
+            return None
+        now = DECAY_RATE * time.time()
+        books = []
+        for rank, ((book_id, score), (title, author, count, total)) in enumerate(zip(ranked, all_stats), start + 1):
+            count = int(count or 0)
+            books.append({
+                "rank": rank,
+                "id": book_id,
+                "title": title,
+                "author": author,
+                "reviews": count,
+                "rating": round(float(total or 0) / max(count, 1), 1),
+                # The Bayesian rating, or the number of reviews decayed to now
+                "score": round(score if board == TOP_RATED else math.exp(score - now), 2)
+            })
+        return books
+
+    async def rebuild(
+        self,
+        rows: list[dict[str, Any]],
+        get_new_reviews: Callable[[], Awaitable[list[dict[str, Any]]]]
+    ):
+        """
+        Replaces the boards and the stats with the given rows, computed from the DB until
+        a time. Everything is written under temporary keys, then the reviews created since
+        that time are replayed on them, as returned by get_new_reviews until it returns
+        none, and the keys are renamed. So the reviews recorded during the rebuild are not
+        lost, but for the ones committed during the last round trip, which the next
+        rebuild counts. The reads never see a half built board. The boards left without
+        books and the stats of the books no longer reviewed are deleted
+        """
+        connection = get_redis_connection()
+        leftovers = [key async for key in connection.scan_iter(match=f"leaderboard:*{REBUILD_SUFFIX}")]
+        if leftovers:
+            await connection.delete(*leftovers)
+        rebuilt_keys, rebuilt_stats_keys = set(), set()
+        for start in range(0, len(rows), REBUILD_BATCH_SIZE):
+            async with connection.pipeline(transaction=False) as pipe:
+                for row in rows[start:start + REBUILD_BATCH_SIZE]:
+                    decade = get_decade(row["year_published"])
+                    stats_key = get_stats_key(row["id"])
+                    pipe.hset(stats_key + REBUILD_SUFFIX, mapping={
+                        "title": row["title"],
+                        "author": row["author"],
+                        "genre": row["genre"],
+                        "decade": decade,
+                        "count": row["count"],
+                        "sum": float(row["sum"]),
+                        "trend": float(row["trend"])
+                    })
+                    rebuilt_stats_keys.add(stats_key)
+                    for board, score in [
+                        (TOP_RATED, get_bayesian_rating(row["count"], float(row["sum"]))),
+                        (TRENDING, float(row["trend"]))
+                    ]:
+                        for key in get_book_board_keys(board, row["genre"], decade):
+                            pipe.zadd(key + REBUILD_SUFFIX, {row["id"]: score})
+                            rebuilt_keys.add(key)
+                await pipe.execute()
+        script = connection.register_script(RECORD_REVIEW_SCRIPT)
+        while reviews := await get_new_reviews():
+            async with connection.pipeline(transaction=False) as pipe:
+                for review in reviews:
+                    book = {**review, "id": review["book_id"]}
+                    keys, args = get_review_script_arguments(
+                        book, review["rating"], float(review["reviewed_at"]), suffix=REBUILD_SUFFIX
+                    )
+                    await script(keys=keys, args=args, client=pipe)
+                    rebuilt_stats_keys.add(keys[0].removesuffix(REBUILD_SUFFIX))
+                    rebuilt_keys.update(key.removesuffix(REBUILD_SUFFIX) for key in keys[1:])
+                await pipe.execute()
+        stale_keys = [
+            key
+            for board in BOARDS
+            async for key in connection.scan_iter(match=f"leaderboard:{board}:*")
+            if not key.endswith(REBUILD_SUFFIX) and key not in rebuilt_keys
+        ]
+        orphaned_stats_keys = [
+            key
+            async for key in connection.scan_iter(match=get_stats_key("*"))
+            if not key.endswith(REBUILD_SUFFIX) and key not in rebuilt_stats_keys
+        ]
+        # The stats are renamed first, so the books of the new boards have their stats
+        rebuilt_stats_keys = list(rebuilt_stats_keys)
+        for start in range(0, len(rebuilt_stats_keys), REBUILD_BATCH_SIZE):
+            async with connection.pipeline(transaction=False) as pipe:
+                for key in rebuilt_stats_keys[start:start + REBUILD_BATCH_SIZE]:
+                    pipe.rename(key + REBUILD_SUFFIX, key)
+                await pipe.execute()
+        async with connection.pipeline(transaction=False) as pipe:
+            for key in rebuilt_keys:
+                pipe.rename(key + REBUILD_SUFFIX, key)
+            if stale_keys:
+                pipe.delete(*stale_keys)
+            for start in range(0, len(orphaned_stats_keys), REBUILD_BATCH_SIZE):
+                pipe.delete(*orphaned_stats_keys[start:start + REBUILD_BATCH_SIZE])
+            await pipe.execute()
+
+
+book_leaderboards = BookLeaderboards()
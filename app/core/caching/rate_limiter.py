@@ -0,0 +1,191 @@
+import math
+import time
+from collections import OrderedDict
+from typing import NamedTuple
+
+import redis.asyncio as redis
+
+from core.caching.circuit_breaker import redis_circuit_breaker
+from core.caching.redis import get_redis_connection
+from core.config import get_config
+from core.logger import logger
+
+config = get_config()
+
+# Token bucket. The bucket is refilled lazily based on the time elapsed since the last
+# request, so a single hash per user is enough. The time of the redis server is used,
+# so all the workers agree on it.
+TOKEN_BUCKET_SCRIPT = """
+redis.replicate_commands()
+local capacity = tonumber(ARGV[1])
+local refill_rate = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'timestamp')
+local tokens = tonumber(bucket[1]) or capacity
+local timestamp = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - timestamp) * refill_rate / 1000)
+local allowed = 0
+local retry_after = 0
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+else
+    retry_after = math.ceil((cost - tokens) * 1000 / refill_rate)
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'timestamp', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity * 1000 / refill_rate))
+return {allowed, math.floor(tokens), retry_after}
+"""
+
+# The counter expires on its own, in case a worker dies before releasing its slots
+ACQUIRE_CONCURRENCY_SCRIPT = """
+local current = redis.call('INCR', KEYS[1])
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+if current > tonumber(ARGV[1]) then
+    redis.call('DECR', KEYS[1])
+    return 0
+end
+return 1
+"""
+
+RELEASE_CONCURRENCY_SCRIPT = """
+if tonumber(redis.call('GET', KEYS[1]) or '0') > 0 then
+    redis.call('DECR', KEYS[1])
+end
+return 1
+"""
+
+
+class RateLimitResult(NamedTuple):
+    is_allowed: bool
+    limit: int
+    remaining: int
+    # Seconds until the request can be retried
+    retry_after: int
+    # Seconds until the bucket is full again
+    reset: int
+
+
+class LocalRateLimiter:
+    """
+    In-process token buckets and concurrency counters. Used when redis is not available,
+    so the limits are applied per worker instead of globally. The buckets are a bounded LRU,
+    the least recently used bucket is dropped first. It is the one most likely to be full
+    again, so dropping it hardly loosens the limit
+    """
+
+    def __init__(self, max_keys: int):
+        self.max_keys = max_keys
+        self.buckets: OrderedDict[str, tuple[float, float]] = OrderedDict()
+        self.concurrency: dict[str, int] = {}
+
+    def acquire(self, key: str, cost: int, capacity: int, refill_rate: float) -> tuple[bool, float, float]:
+        now = time.monotonic()
+        tokens, timestamp = self.buckets.get(key, (capacity, now))
+        tokens = min(capacity, tokens + (now - timestamp) * refill_rate)
+        is_allowed = tokens >= cost
+        if is_allowed:
+            tokens -= cost
+        self.buckets[key] = (tokens, now)
+        self.buckets.move_to_end(key)
+        while len(self.buckets) > self.max_keys:
+            self.buckets.popitem(last=False)
+        if is_allowed:
+            return True, tokens, 0
+        return False, tokens, (cost - tokens) / refill_rate
+
+    def acquire_concurrency(self, key: str, limit: int) -> bool:
+        if self.concurrency.get(key, 0) >= limit:
+            return False
+        self.concurrency[key] = self.concurrency.get(key, 0) + 1
+        return True
+
+    def release_concurrency(self, key: str):
+        # A counter back at zero is dropped, so only the users with requests in flight are kept
+        if self.concurrency.get(key, 0) > 1:
+            self.concurrency[key] -= 1
+        else:
+            self.concurrency.pop(key, None)
+
+
+local_rate_limiter = LocalRateLimiter(max_keys=config.rate_limit.local_max_keys)
+
+
+class RateLimiterClient:
+    """
+    A class that encapsulates the redis backed rate limiting. Every check is one atomic
+    script call. If redis is not available, it falls back to the in-process limiter
+    """
+
+    def __init__(self):
+        self.redis_client = get_redis_connection()
+        self.token_bucket_script = self.redis_client.register_script(TOKEN_BUCKET_SCRIPT)
+        self.acquire_concurrency_script = self.redis_client.register_script(ACQUIRE_CONCURRENCY_SCRIPT)
+        self.release_concurrency_script = self.redis_client.register_script(RELEASE_CONCURRENCY_SCRIPT)
+        # Slots taken from the in-process limiter must be released there as well
+        self.local_concurrency_keys = set()
+
+    async def acquire(self, key: str, cost: int) -> RateLimitResult:
+        """
+        Takes tokens worth the cost from the bucket of the key
+        """
+        capacity = config.rate_limit.capacity
+        refill_rate = config.rate_limit.refill_rate
+        # While the circuit breaker is open, redis is not even tried
+        result = None
+        if redis_circuit_breaker.allow_request():
+            started_at = time.monotonic()
+            try:
+                result = await self.token_bucket_script(
+                    keys=[f"rate_limit:{key}"], args=[capacity, refill_rate, cost]
+                )
+                redis_circuit_breaker.record_success(time.monotonic() - started_at)
+            except redis.RedisError as er:
+                logger.info(f"Redis error - {er}")
+                redis_circuit_breaker.record_failure()
+        if result is not None:
+            is_allowed, remaining, retry_after_ms = result
+            retry_after = retry_after_ms / 1000
+        else:
+            is_allowed, remaining, retry_after = local_rate_limiter.acquire(
+                key=key, cost=cost, capacity=capacity, refill_rate=refill_rate
+            )
+        return RateLimitResult(
+            is_allowed=bool(is_allowed),
+            limit=capacity,
+            remaining=int(remaining),
+            retry_after=math.ceil(retry_after),
+            reset=math.ceil((capacity - int(remaining)) / refill_rate)
+        )
+
+    async def acquire_concurrency(self, key: str, limit: int) -> bool:
+        """
+        Takes a slot for an in-flight request. Returns False if all the slots are taken
+        """
+        try:
+            is_acquired = await self.acquire_concurrency_script(
+                keys=[f"concurrency:{key}"], args=[limit, config.rate_limit.concurrency_ttl]
+            )
+            return bool(is_acquired)
+        except redis.RedisError as er:
+            logger.info(f"Redis error - {er}")
+            is_acquired = local_rate_limiter.acquire_concurrency(key=key, limit=limit)
+            if is_acquired:
+                self.local_concurrency_keys.add(key)
+            return is_acquired
+
+    async def release_concurrency(self, key: str):
+        """
+        Releases the slot of a finished request
+        """
+        if key in self.local_concurrency_keys:
+            self.local_concurrency_keys.discard(key)
+            local_rate_limiter.release_concurrency(key=key)
+            return
+        try:
+            await self.release_concurrency_script(keys=[f"concurrency:{key}"])
+        except redis.RedisError as er:
+            # The slot is freed when the counter expires
+            logger.info(f"Redis error - {er}")
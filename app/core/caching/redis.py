@@ -1,46 +1,401 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable
+from weakref import WeakKeyDictionary
+
 import redis.asyncio as redis
 
+from core.caching.circuit_breaker import redis_circuit_breaker
+from core.caching.serializers import CacheSerializer
 from core.config import get_config
+from core.deadlines import get_remaining_time
 from core.logger import logger
 
 config = get_config()
 
+# Like the DB engine, the connection pools are bound to the event loop that created them.
+# The cached values are binary, so RedisClient has its own pool that doesn't decode responses
+CONNECTIONS: WeakKeyDictionary[asyncio.AbstractEventLoop, dict[bool, redis.Redis]] = WeakKeyDictionary()
+
+serializer = CacheSerializer(
+    use_msgpack=config.redis.serializer == "msgpack",
+    compression_threshold=config.redis.compression_threshold
+)
+
+# Versioned entries are stored as a hash with the fields "version" and "value".
+# The value is written only if the given version is newer than the cached one, so an
+# older write finishing late can never overwrite a newer one. A plain string left
+# under the key by an older deployment is replaced.
+SET_IF_NEWER_SCRIPT = """
+if redis.call('TYPE', KEYS[1]).ok == 'string' then
+    redis.call('DEL', KEYS[1])
+end
+local current = redis.call('HGET', KEYS[1], 'version')
+if current and tonumber(current) >= tonumber(ARGV[2]) then
+    return 0
+end
+redis.call('HSET', KEYS[1], 'version', ARGV[2], 'value', ARGV[1])
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+return 1
+"""
+
+# Deletes the keys of the tag sets, the tag sets and the plain keys in one round trip.
+# KEYS holds ARGV[1] tag sets followed by the plain keys. Members are deleted in chunks,
+# since unpack is limited in the number of values
+INVALIDATE_TAGS_SCRIPT = """
+local deleted = 0
+for i = 1, tonumber(ARGV[1]) do
+    local members = redis.call('SMEMBERS', KEYS[i])
+    for j = 1, #members, 1000 do
+        deleted = deleted + redis.call('DEL', unpack(members, j, math.min(j + 999, #members)))
+    end
+    redis.call('DEL', KEYS[i])
+end
+for i = tonumber(ARGV[1]) + 1, #KEYS do
+    deleted = deleted + redis.call('DEL', KEYS[i])
+end
+return deleted
+"""
+
+
+# Patterns of the keys dropped when the invalidations can't be tracked one by one
+CACHE_KEY_PATTERNS = ("book:*", "book_count:*", "tag:*")
+
+
+def get_tag_key(tag: str) -> str:
+    return f"tag:{tag}"
+
+
+class PendingInvalidations:
+    """
+    Keys and tags whose invalidation could not reach redis, e.g. while the circuit breaker
+    was open. They are retried before any other command of this worker, so it never reads
+    back an entry it failed to invalidate, and periodically in the background. Past
+    max_size, they are no longer tracked one by one. Every cached entry is then dropped in
+    the background, and the cache is bypassed until it is done
+    """
+
+    max_size = 100000
+
+    def __init__(self):
+        self.keys: set[str] = set()
+        self.tags: set[str] = set()
+        self.is_overflowed = False
+
+    def __bool__(self) -> bool:
+        return bool(self.keys or self.tags or self.is_overflowed)
+
+    def add(self, keys: list[str] = (), tags: list[str] = ()):
+        self.keys.update(keys)
+        self.tags.update(tags)
+        if len(self.keys) + len(self.tags) > self.max_size:
+            self.keys, self.tags, self.is_overflowed = set(), set(), True
+
+    def invalidate_all(self):
+        self.keys, self.tags, self.is_overflowed = set(), set(), True
+
+    async def retry(self, connection: redis.Redis, include_all: bool = False):
+        """
+        Applies the pending invalidations. Dropping every entry takes many round trips, so it is
+        done only with include_all. The redis connection errors are raised, so the caller counts
+        them as failures. The invalidations added meanwhile are kept for the next retry
+        """
+        keys, tags, is_overflowed = list(self.keys), list(self.tags), self.is_overflowed and include_all
+        try:
+            if is_overflowed:
+                for pattern in CACHE_KEY_PATTERNS:
+                    async for key in connection.scan_iter(match=pattern, count=1000):
+                        await connection.unlink(key)
+            elif keys or tags:
+                script = connection.register_script(INVALIDATE_TAGS_SCRIPT)
+                await script(keys=[get_tag_key(tag) for tag in tags] + keys, args=[len(tags)])
+        except redis.ResponseError as er:
+            # Retrying would fail the same way
+            logger.info(f"Redis error - {er}")
+        self.keys.difference_update(keys)
+        self.tags.difference_update(tags)
+        if is_overflowed:
+            self.is_overflowed = False
+
+
+pending_invalidations = PendingInvalidations()
+
+
+def get_redis_connection(decode_responses: bool = True) -> redis.Redis:
+    """
+    Returns the redis connection of the running event loop. The connection pool
+    is created on first use and shared afterwards
+    """
+    connections = CONNECTIONS.setdefault(asyncio.get_running_loop(), {})
+    connection = connections.get(decode_responses)
+    if connection is None:
+        connection = redis.Redis(
+            host=config.redis.host,
+            port=config.redis.port,
+            decode_responses=decode_responses,
+            max_connections=config.redis.max_connections,
+            # A slow redis must not hold the requests. The cache is bypassed instead
+            socket_timeout=config.redis.socket_timeout,
+            socket_connect_timeout=config.redis.socket_connect_timeout
+        )
+        connections[decode_responses] = connection
+    return connection
+
+
+async def close_redis_connection():
+    """
+    Closes the connection pools of the running event loop
+    """
+    connections = CONNECTIONS.pop(asyncio.get_running_loop(), {})
+    for connection in connections.values():
+        await connection.aclose()
+
 
 class RedisClient:
 
     redis_client = None
 
-    def __init__(self):
+    def __init__(self, value_serializer: CacheSerializer | None = None):
         """
-        Creates the redis client
+        Creates the redis client on top of the shared connection pool. The values
+        are encoded with the given serializer, by default the configured one
         """
-        self.redis_client = redis.Redis(host=config.redis.host, port=config.redis.port, decode_responses=True)
+        self.redis_client = get_redis_connection(decode_responses=False)
+        self.serializer = value_serializer or serializer
+        self.set_if_newer_script = self.redis_client.register_script(SET_IF_NEWER_SCRIPT)
+        self.invalidate_tags_script = self.redis_client.register_script(INVALIDATE_TAGS_SCRIPT)
 
-    async def get_cache(self, key: str) -> str | None:
+    @staticmethod
+    async def execute(command: Callable[[], Awaitable], default: Any = None) -> Any:
         """
-        This method returns the value from the cache. If not available, returns None
+        This method runs a redis command through the circuit breaker. While the breaker is
+        open, the command is skipped and the default is returned, so the caller goes straight
+        to the DB. Errors are logged and the default is returned as well. The command is given
+        at most the time left to the request. The pending invalidations are applied first
         """
+        remaining_time = get_remaining_time()
+        if remaining_time is not None and remaining_time <= 0:
+            return default
+        # Any entry may be stale until they are all dropped
+        if pending_invalidations.is_overflowed:
+            return default
+        if not redis_circuit_breaker.allow_request():
+            return default
+        started_at = time.monotonic()
         try:
-            value = await self.redis_client.get(key)
-            return value
-        except redis.ConnectionError as er:
+            if pending_invalidations:
+                await pending_invalidations.retry(get_redis_connection(decode_responses=False))
+                started_at = time.monotonic()
+            if remaining_time is not None and remaining_time < config.redis.socket_timeout:
+                # The call is bounded by the time left to the request rather than by the socket timeout
+                async with asyncio.timeout(remaining_time):
+                    result = await command()
+            else:
+                result = await command()
+        except TimeoutError:
+            # The deadline of the request passed. Redis itself may be fine
+            return default
+        except (redis.ConnectionError, redis.TimeoutError) as er:
             logger.info(f"Redis error - {er}")
+            redis_circuit_breaker.record_failure()
+            return default
+        except redis.ResponseError as er:
+            # e.g. a key of an unexpected type. Redis itself is fine
+            logger.info(f"Redis error - {er}")
+            redis_circuit_breaker.record_success(time.monotonic() - started_at)
+            return default
+        redis_circuit_breaker.record_success(time.monotonic() - started_at)
+        return result
 
-    async def set_cache(self, key: str, value: str, expire: int = 300):
+    def decode(self, value: bytes | None) -> Any:
         """
-        This method stores the value in cache with ttl 300 seconds
+        This method decodes a cached value. A value that can't be decoded is treated as missing
         """
+        if value is None:
+            return None
         try:
-            await self.redis_client.set(key, value, ex=expire)
-        except redis.ConnectionError as er:
-            logger.info(f"Redis error - {er}")
+            return self.serializer.loads(value)
+        except ValueError as er:
+            logger.info(f"Cache decode error - {er}")
+            return None
+
+    async def get_cache(self, key: str) -> Any:
+        """
+        This method returns the value from the cache. If not available, returns None
+        """
+        return self.decode(await self.execute(lambda: self.redis_client.get(key)))
+
+    async def set_cache(self, key: str, value: Any, expire: int | None = None):
+        """
+        This method stores the value in cache. By default, the configured ttl is used
+        """
+        await self.execute(
+            lambda: self.redis_client.set(key, self.serializer.dumps(value), ex=expire or config.redis.ttl)
+        )
 
     async def unset_cache(self, key: str):
         """
-        This method deletes the value from the cache
+        This method deletes the value from the cache. If redis can't be reached, the
+        deletion is retried later
         """
+        await self.delete_many([key])
+
+    async def has_cache(self, key: str) -> bool:
+        """
+        This method checks if the key is available in the cache
+        """
+        return bool(await self.execute(lambda: self.redis_client.exists(key), default=False))
+
+    async def get_many(self, keys: list[str]) -> list[Any]:
+        """
+        This method returns the values of many keys in one round trip. A missing value is None
+        """
+        if not keys:
+            return []
+        values = await self.execute(lambda: self.redis_client.mget(keys), default=[None] * len(keys))
+        return [self.decode(value) for value in values]
+
+    async def set_many(self, entries: list[tuple[str, Any, int | None]], tags: list[str] | None = None):
+        """
+        This method stores many (key, value, expire) entries in one round trip. An entry
+        without expire uses the configured ttl. The keys are added to the given tags,
+        so they can be invalidated together with invalidate_tags
+        """
+        if not entries:
+            return
+        # The tags live at least as long as their keys, so they never miss one of them
+        tag_expire = max(config.redis.ttl, *(expire or 0 for _, _, expire in entries))
+
+        async def command():
+            async with self.redis_client.pipeline(transaction=False) as pipe:
+                for key, value, expire in entries:
+                    pipe.set(key, self.serializer.dumps(value), ex=expire or config.redis.ttl)
+                for tag in tags or []:
+                    pipe.sadd(get_tag_key(tag), *(key for key, _, _ in entries))
+                    pipe.expire(get_tag_key(tag), tag_expire)
+                await pipe.execute()
+
+        await self.execute(command)
+
+    async def delete_many(self, keys: list[str]):
+        """
+        This method deletes many keys in one round trip. If redis can't be reached, the
+        deletion is retried later
+        """
+        if not keys:
+            return
+        deleted = await self.execute(lambda: self.redis_client.delete(*keys))
+        if deleted is None:
+            pending_invalidations.add(keys=keys)
+
+    async def invalidate_tags(self, tags: list[str], keys: list[str] | None = None) -> int:
+        """
+        This method deletes every key of the given tags, along with the given plain keys,
+        in one round trip. Returns the number of keys deleted. If redis can't be reached,
+        the invalidation is retried later
+        """
+        keys = keys or []
+        deleted = await self.execute(
+            lambda: self.invalidate_tags_script(keys=[get_tag_key(tag) for tag in tags] + keys, args=[len(tags)])
+        )
+        if deleted is None:
+            pending_invalidations.add(keys=keys, tags=tags)
+            return 0
+        return deleted
+
+    @staticmethod
+    def invalidate_all():
+        """
+        This method drops every cached entry, when the changes can't be tracked one by one.
+        It is done in the background and the cache of this worker is bypassed until then
+        """
+        pending_invalidations.invalidate_all()
+
+    async def get_versioned_cache(self, key: str) -> tuple[Any, int | None]:
+        """
+        This method returns the value and the version of a versioned entry.
+        If not available, returns (None, None)
+        """
+        value, version = await self.execute(
+            lambda: self.redis_client.hmget(key, ["value", "version"]), default=(None, None)
+        )
+        value = self.decode(value)
+        if value is None or version is None:
+            return None, None
+        return value, int(version)
+
+    async def get_cache_version(self, key: str) -> int | None:
+        """
+        This method returns only the version of a versioned entry. If not available, returns None
+        """
+        version = await self.execute(lambda: self.redis_client.hget(key, "version"))
+        return int(version) if version is not None else None
+
+    async def set_versioned_cache(
+        self,
+        key: str,
+        value: Any,
+        version: int,
+        expire: int | None = None,
+        tags: list[str] | None = None,
+        invalidate_on_failure: bool = False
+    ) -> bool:
+        """
+        This method stores the value only if the version is newer than the cached one.
+        The key is added to the given tags, like with set_many. Returns True if the value is written.
+        After a write to the DB, the cached entry is older than the value. So, with
+        invalidate_on_failure, the key is deleted later if redis can't be reached
+        """
+        args = [self.serializer.dumps(value), version, expire or config.redis.ttl]
+        if not tags:
+            is_written = await self.execute(lambda: self.set_if_newer_script(keys=[key], args=args))
+            if is_written is None and invalidate_on_failure:
+                pending_invalidations.add(keys=[key])
+            return bool(is_written)
+
+        async def command():
+            async with self.redis_client.pipeline(transaction=False) as pipe:
+                await self.set_if_newer_script(keys=[key], args=args, client=pipe)
+                for tag in tags:
+                    pipe.sadd(get_tag_key(tag), key)
+                    pipe.expire(get_tag_key(tag), max(config.redis.ttl, expire or 0))
+                return (await pipe.execute())[0]
+
+        is_written = await self.execute(command)
+        if is_written is None and invalidate_on_failure:
+            pending_invalidations.add(keys=[key])
+        return bool(is_written)
+
+    async def set_versioned_cache_many(self, entries: list[tuple[str, Any, int]], expire: int | None = None) -> int:
+        """
+        This method stores many (key, value, version) entries in one round trip. Like
+        set_versioned_cache, an entry is written only if its version is newer than the cached one.
+        Returns the number of entries written
+        """
+        async def command():
+            async with self.redis_client.pipeline(transaction=False) as pipe:
+                for key, value, version in entries:
+                    await self.set_if_newer_script(
+                        keys=[key], args=[self.serializer.dumps(value), version, expire or config.redis.ttl], client=pipe
+                    )
+                return sum(await pipe.execute())
+
+        return await self.execute(command, default=0)
+
+
+async def retry_pending_invalidations_periodically():
+    """
+    Applies the pending invalidations of this worker, even if it serves no other redis command
+    """
+    while True:
+        await asyncio.sleep(config.redis.invalidation_retry_interval)
+        if not pending_invalidations or not redis_circuit_breaker.allow_request():
+            continue
         try:
-            await self.redis_client.delete(key)
-        except redis.ConnectionError as er:
+            await pending_invalidations.retry(get_redis_connection(decode_responses=False), include_all=True)
+        except (redis.ConnectionError, redis.TimeoutError) as er:
             logger.info(f"Redis error - {er}")
-
+            redis_circuit_breaker.record_failure()
+        else:
+            # Dropping every entry is expected to be slow
+            redis_circuit_breaker.record_success(0)
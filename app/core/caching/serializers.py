@@ -0,0 +1,68 @@
+import json
+import zlib
+from typing import Any
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - msgpack is optional
+    msgpack = None
+
+# The first byte of a cached value tells how the rest is encoded. The high bit tells
+# if the payload is compressed. Values written before the format byte was introduced
+# are JSON text, which never starts with one of these bytes.
+FORMAT_JSON = 0x01
+FORMAT_MSGPACK = 0x02
+COMPRESSED_FLAG = 0x80
+
+
+def _default(value: Any) -> str:
+    # e.g. Decimal ratings
+    return str(value)
+
+
+class CacheSerializer:
+    """
+    Encodes the cached values as msgpack, or as JSON if msgpack is not installed.
+    Payloads above the compression threshold are compressed with zlib, since summaries
+    and review lists compress well. Any value written by a known format can be read,
+    so the format can be switched with a rolling deploy.
+    """
+
+    def __init__(self, use_msgpack: bool = True, compression_threshold: int = 1024, compression_level: int = 6):
+        self.format = FORMAT_MSGPACK if use_msgpack and msgpack is not None else FORMAT_JSON
+        self.compression_threshold = compression_threshold
+        self.compression_level = compression_level
+
+    def dumps(self, value: Any) -> bytes:
+        if self.format == FORMAT_MSGPACK:
+            payload = msgpack.packb(value, default=_default)
+        else:
+            payload = json.dumps(value, separators=(",", ":"), default=_default).encode("utf8")
+        header = self.format
+        if len(payload) > self.compression_threshold:
+            payload = zlib.compress(payload, self.compression_level)
+            header |= COMPRESSED_FLAG
+        return bytes([header]) + payload
+
+    @staticmethod
+    def loads(data: bytes) -> Any:
+        """
+        Decodes a cached value. Raises ValueError if the value can't be decoded
+        """
+        if not data:
+            raise ValueError("Empty value")
+        header = data[0]
+        if header & ~COMPRESSED_FLAG not in (FORMAT_JSON, FORMAT_MSGPACK):
+            # Written before the format byte was introduced
+            return json.loads(data)
+        payload = data[1:]
+        if header & COMPRESSED_FLAG:
+            try:
+                payload = zlib.decompress(payload)
+            except zlib.error as er:
+                raise ValueError(f"Invalid compressed value - {er}") from er
+        if header & ~COMPRESSED_FLAG == FORMAT_MSGPACK:
+            if msgpack is None:
+                raise ValueError("msgpack is required to read this value")
+            return msgpack.unpackb(payload)
+        return json.loads(payload)
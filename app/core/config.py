@@ -5,6 +5,172 @@ from pydantic_settings import BaseSettings, SettingsConfigDict
 class Redis(BaseModel):
     host: str
     port: int
+    # Book entries are written with compare-and-set on the row version and dropped on
+    # every change notified by the DB, so they can live much longer than a plain read-through cache
+    ttl: int = 24 * 60 * 60
+    max_connections: int = 50
+    # Seconds
+    socket_timeout: float = 0.25
+    socket_connect_timeout: float = 0.25
+    # The circuit breaker opens after this many consecutive failed or slow calls. While it is
+    # open, the cache is bypassed. After the reset timeout, one call probes if redis is back
+    circuit_breaker_failure_threshold: int = 5
+    # Seconds after which a successful call still counts as a failure
+    circuit_breaker_slow_call_threshold: float = 0.1
+    circuit_breaker_reset_timeout: float = 5.0
+    # "msgpack" or "json". Values of both formats can always be read
+    serializer: str = "msgpack"
+    # Cached values larger than this many bytes are compressed
+    compression_threshold: int = 1024
+    # Seconds between two retries of the invalidations that could not reach redis
+    invalidation_retry_interval: float = 1.0
+
+
+class Auth(BaseModel):
+    secret_key: str
+    algorithm: str = "HS256"
+    # Seconds
+    access_token_ttl: int = 15 * 60
+    # Seconds between two refreshes of the revoked tokens of a worker
+    revocation_refresh_interval: float = 5.0
+    # Threads hashing the passwords. At most this many hashes run at the same time
+    password_hash_workers: int = 4
+    # Recently verified credentials are not hashed again for this many seconds
+    credential_cache_ttl: int = 5 * 60
+    credential_cache_size: int = 1024
+
+
+class Database(BaseModel):
+    pool_size: int = 10
+    max_overflow: int = 10
+    pool_timeout: int = 30
+    pool_recycle: int = 30 * 60
+    # Prepared statements cached per connection. Set to 0 behind pgbouncer in transaction mode
+    prepared_statement_cache_size: int = 500
+    # Read only queries are sent to these replicas, round-robin. Writes always go to the primary
+    replica_urls: list[PostgresDsn] = []
+    # Seconds between two health checks of the replicas
+    replica_check_interval: float = 5.0
+    # A replica lagging behind the primary by more seconds than this is not read from
+    replica_max_lag: float = 5.0
+    # After a write, the reads of the same user go to the primary for this many seconds,
+    # so the user always sees their own writes
+    read_your_writes_window: float = 5.0
+    # Development only. Counts the queries of every request and logs the requests sending
+    # more than query_budget queries, or the same statement repeated_query_threshold times
+    query_counter_enabled: bool = False
+    query_budget: int = 10
+    repeated_query_threshold: int = 3
+
+
+class Logging(BaseModel):
+    level: str = "INFO"
+    # "json" for one JSON object per line, or "text"
+    format: str = "json"
+    # Records waiting to be written. The records logged while the queue is full are dropped
+    queue_size: int = 10000
+    # At most this many records of the same message are written per interval seconds
+    repeated_message_burst: int = 5
+    repeated_message_interval: float = 60.0
+
+
+class Server(BaseModel):
+    debug: bool = False
+    host: str = "0.0.0.0"
+    port: int = 8000
+    # Defaults to the number of CPUs
+    workers: int | None = None
+    # Seconds given to the in-flight requests to finish on shutdown
+    graceful_timeout: int = 30
+    timeout: int = 60
+    keepalive: int = 5
+
+
+class Deadlines(BaseModel):
+    enabled: bool = True
+    # Seconds a request is given. The queries and the redis calls fail once it has passed
+    timeout: float = 10.0
+    # Per route prefix overrides of the timeout
+    timeouts: dict[str, float] = {}
+    # Callers can shorten the timeout of their request, in seconds, with this header. Only internal
+    # callers, sending internal_token in the internal token header, can lengthen it, up to max_timeout
+    header: str = "X-Request-Timeout"
+    max_timeout: float = 30.0
+    internal_token: str | None = None
+    internal_token_header: str = "X-Internal-Token"
+    # The connections have a statement timeout of timeout seconds. A transaction begun with a
+    # remaining time within this many seconds of it keeps it, which saves a round trip
+    statement_timeout_tolerance: float = 1.0
+
+
+class RateLimit(BaseModel):
+    enabled: bool = True
+    # Every user has a bucket of this many tokens, refilled at refill_rate tokens per second.
+    # A request takes tokens worth its cost, 1 by default
+    capacity: int = 100
+    refill_rate: float = 10.0
+    # Seconds after which the in-flight counter of a user expires, in case a worker
+    # dies before releasing its slots
+    concurrency_ttl: int = 60
+    # Number of users whose buckets are kept by a worker while redis is not available
+    local_max_keys: int = 10000
+
+
+class Compression(BaseModel):
+    enabled: bool = True
+    # Responses smaller than this are not worth the CPU of compressing them
+    minimum_size: int = 1024
+    gzip_level: int = 6
+    brotli_quality: int = 4
+    # Per route prefix overrides of the minimum size
+    minimum_sizes: dict[str, int] = {}
+    exclude_paths: list[str] = []
+
+
+class ResponseCache(BaseModel):
+    enabled: bool = True
+    # "memory" for a per-process cache or "redis" for a cache shared by all the workers
+    backend: str = "memory"
+    max_entries: int = 1024
+    # Exact path -> ttl in seconds. A hit is served before the authentication and the rate
+    # limit run, and is not invalidated on writes. So, only public paths whose response is
+    # the same for every caller, and may be stale for the ttl, should be listed here
+    paths: dict[str, int] = {}
+
+
+class CacheWarmer(BaseModel):
+    enabled: bool = True
+    # The most requested books are loaded into the cache on startup
+    top_n: int = 1000
+    batch_size: int = 100
+    # Books loaded per second, so the warmer doesn't overload the DB
+    rate: float = 500.0
+    # Seconds between two flushes of the book reads counted by a worker
+    access_flush_interval: float = 10.0
+    # Number of books whose read count is kept
+    max_tracked: int = 10000
+
+
+class Leaderboards(BaseModel):
+    enabled: bool = True
+    # The ratings are a Bayesian average, as if every book had prior_weight more reviews
+    # rated prior_rating. So, a book with a single 5 doesn't top the board
+    prior_rating: float = 3.0
+    prior_weight: int = 10
+    # Seconds after which a review counts half for the trending score
+    trending_half_life: float = 3 * 24 * 60 * 60
+    # Seconds between two rebuilds of the leaderboards from the DB
+    reconcile_interval: float = 60 * 60
+
+
+class CacheInvalidation(BaseModel):
+    enabled: bool = True
+    # Seconds the notifications are collected for, so a bulk write is invalidated in a few round trips
+    batch_interval: float = 0.05
+    # Books invalidated per round trip
+    batch_size: int = 500
+    # Seconds between two attempts to listen again after the DB connection is lost
+    reconnect_interval: float = 5.0
 
 
 class Config(BaseSettings):
@@ -12,6 +178,20 @@ class Config(BaseSettings):
 
     postgres_url: PostgresDsn = Field(alias="POSTGRES_URL")
     redis: Redis
+    auth: Auth
+    database: Database = Database()
+    server: Server = Server()
+    logging: Logging = Logging()
+    deadlines: Deadlines = Deadlines()
+    # Sent along with the ETag of cacheable responses. "no-cache" lets a shared cache
+    # store the response but revalidate it with the ETag on every request
+    cache_control: str = Field(default="public, no-cache", alias="CACHE_CONTROL")
+    rate_limit: RateLimit = RateLimit()
+    compression: Compression = Compression()
+    response_cache: ResponseCache = ResponseCache()
+    cache_warmer: CacheWarmer = CacheWarmer()
+    leaderboards: Leaderboards = Leaderboards()
+    cache_invalidation: CacheInvalidation = CacheInvalidation()
 
 
 CONFIG = None
@@ -1,13 +1,20 @@
+import asyncio
 from datetime import datetime
+from weakref import WeakKeyDictionary
 
-from sqlalchemy import TIMESTAMP, text
-from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
-from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy import TIMESTAMP, event, make_url, text
+from sqlalchemy.orm import DeclarativeBase, Mapped, Session, mapped_column
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine, async_sessionmaker
 
 from core.config import get_config
+from core.deadlines import get_remaining_time
 
 config = get_config()
 
+# Pooled connections are bound to the event loop that created them. So, one engine is
+# kept per event loop. In production there is exactly one loop per worker process.
+SESSION_MAKERS: WeakKeyDictionary[asyncio.AbstractEventLoop, async_sessionmaker] = WeakKeyDictionary()
+
 
 class Base(DeclarativeBase):
 
@@ -26,15 +33,90 @@ class Base(DeclarativeBase):
     )
 
 
-def get_async_session():
-    engine = create_async_engine(
-            config.postgres_url.unicode_string(),
-            echo=False,
-        )
-    session = async_sessionmaker(bind=engine, expire_on_commit=False, autoflush=False, autocommit=False)
-    return session
+class RoutingSession(Session):
+    """
+    Sends the queries to the read replica set in the session info, if any.
+    Else, to the primary
+    """
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        replica = self.info.get("replica")
+        if replica is not None:
+            return replica.engine.sync_engine
+        return super().get_bind(mapper=mapper, clause=clause, **kwargs)
 
 
+@event.listens_for(RoutingSession, "after_begin")
+def count_connection_checkouts(session: Session, *_):
+    """
+    A session checks out a pooled connection only when it begins a transaction, i.e. on
+    its first query. The checkouts are counted, so the requests served without the DB can be told apart
+    """
+    session.info["checkouts"] = session.info.get("checkouts", 0) + 1
+
 
+@event.listens_for(RoutingSession, "after_begin")
+def apply_statement_timeout(_session: Session, _transaction, connection):
+    """
+    Bounds the statements of the transaction by the time left to the request, so a stuck
+    query is cancelled by the server. The connections already have the request timeout as
+    their statement timeout, so the common case costs no extra round trip. Outside a
+    request, e.g. in a background job, the statements are not bounded
+    """
+    if not config.deadlines.enabled:
+        return
+    remaining_time = get_remaining_time()
+    statement_timeout = 0 if remaining_time is None else max(remaining_time, 0.001)
+    if abs(statement_timeout - config.deadlines.timeout) > config.deadlines.statement_timeout_tolerance:
+        connection.exec_driver_sql(f"SET LOCAL statement_timeout = {round(statement_timeout * 1000)}")
 
 
+def create_engine(url: str | None = None) -> AsyncEngine:
+    url = make_url(url or config.postgres_url.unicode_string())
+    # Prepared statements are cached per pooled connection, so they are reused
+    # for as long as the connection lives
+    if "prepared_statement_cache_size" not in url.query:
+        url = url.update_query_dict(
+            {"prepared_statement_cache_size": str(config.database.prepared_statement_cache_size)}
+        )
+    connect_args = {}
+    if config.deadlines.enabled:
+        connect_args["server_settings"] = {"statement_timeout": str(round(config.deadlines.timeout * 1000))}
+    return create_async_engine(
+        url,
+        echo=False,
+        connect_args=connect_args,
+        pool_size=config.database.pool_size,
+        max_overflow=config.database.max_overflow,
+        pool_timeout=config.database.pool_timeout,
+        pool_recycle=config.database.pool_recycle,
+    )
+
+
+def get_async_session() -> async_sessionmaker:
+    """
+    Returns the session maker of the running event loop. The engine and its connection
+    pool are created on first use and reused afterwards
+    """
+    loop = asyncio.get_running_loop()
+    session = SESSION_MAKERS.get(loop)
+    if session is None:
+        engine = create_engine()
+        session = async_sessionmaker(
+            bind=engine,
+            sync_session_class=RoutingSession,
+            expire_on_commit=False,
+            autoflush=False,
+            autocommit=False
+        )
+        SESSION_MAKERS[loop] = session
+    return session
+
+
+async def dispose_async_engine():
+    """
+    Closes all the pooled connections of the running event loop
+    """
+    session = SESSION_MAKERS.pop(asyncio.get_running_loop(), None)
+    if session is not None:
+        await session.kw["bind"].dispose()
@@ -1,9 +1,18 @@
 import uuid
 
-from sqlalchemy import String, Integer, ForeignKey, Float, Boolean
+from sqlalchemy import ARRAY, Index, String, Integer, ForeignKey, Float, Boolean, text
 
 from core.database.base import Base
-from sqlalchemy.orm import Mapped, mapped_column, relationship
+from sqlalchemy.orm import Mapped, backref, mapped_column, relationship
+
+
+# One bucket per half star, from 0 to 5
+RATING_HISTOGRAM_BUCKETS = 11
+# The full text search document of a book, its title weighing more than its summary. The
+# search queries must use this very expression to use the GIN index built on it
+BOOK_SEARCH_DOCUMENT = (
+    "(setweight(to_tsvector('english', title), 'A') || setweight(to_tsvector('english', summary), 'B'))"
+)
 
 
 def generate_uuid():
@@ -19,6 +28,32 @@ class Book(Base):
     genre: Mapped[str] = mapped_column(String, nullable=False)
     year_published: Mapped[int] = mapped_column(Integer, nullable=False)
     summary: Mapped[str] = mapped_column(String, nullable=False, default="")
+    # Incremented on every write to the row. Cache entries are compared against it
+    # so that an older write can never overwrite a newer one in the cache.
+    version: Mapped[int] = mapped_column(Integer, nullable=False, default=1, server_default=text("1"))
+    # Number of reviews per half star rating. Kept up to date by a trigger on the reviews,
+    # so the rating distribution and the average never need a scan of the reviews.
+    rating_histogram: Mapped[list[int]] = mapped_column(
+        ARRAY(Integer),
+        nullable=False,
+        server_default=text("'{0,0,0,0,0,0,0,0,0,0,0}'")
+    )
+    # Kept by a DB trigger from the histogram, so the books can be sorted by rating with an index
+    average_rating: Mapped[float] = mapped_column(Float, nullable=False, server_default=text("0"))
+
+    # For the filtered and sorted browsing of the books, with keyset pagination on the id,
+    # and for the full text search
+    __table_args__ = (
+        Index("ix_books_genre_title", "genre", "title", "id"),
+        Index("ix_books_genre_year_published", "genre", "year_published", "id"),
+        Index("ix_books_genre_average_rating", "genre", "average_rating", "id"),
+        Index("ix_books_author_title", "author", "title", "id"),
+        Index("ix_books_author_year_published", "author", "year_published", "id"),
+        Index("ix_books_title", "title", "id"),
+        Index("ix_books_year_published", "year_published", "id"),
+        Index("ix_books_average_rating", "average_rating", "id"),
+        Index("ix_books_search", text(BOOK_SEARCH_DOCUMENT), postgresql_using="gin"),
+    )
 
 
 class Review(Base):
@@ -26,9 +61,11 @@ class Review(Base):
 
     id: Mapped[str] = mapped_column(String, default=generate_uuid, primary_key=True)
     book_id: Mapped[str] = mapped_column(ForeignKey("books.id", ondelete="CASCADE"))
-    book: Mapped["Book"] = relationship(backref="reviews")
+    # The relationships are never loaded implicitly. A lazy load would send one query per
+    # review, so the queries join the related rows instead and an implicit load raises
+    book: Mapped["Book"] = relationship(backref=backref("reviews", lazy="raise"), lazy="raise")
     user_id: Mapped[str] = mapped_column(ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
-    user: Mapped["User"] = relationship(backref="reviews")
+    user: Mapped["User"] = relationship(backref=backref("reviews", lazy="raise"), lazy="raise")
     review_text: Mapped[str] = mapped_column(String, nullable=False)
     rating: Mapped[float] = mapped_column(Float, nullable=False)
 
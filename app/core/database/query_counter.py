@@ -0,0 +1,83 @@
+import re
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Literals and the placeholders of expanded lists, replaced so the same query with other
+# values has the same fingerprint
+LITERALS = re.compile(r"'(?:[^']|'')*'|(?<![$\w])\d+(?:\.\d+)?\b")
+PLACEHOLDER_LISTS = re.compile(r"\((?:\s*(?:\$\d+|\?|%s)\s*,)+\s*(?:\$\d+|\?|%s)\s*\)")
+WHITESPACE = re.compile(r"\s+")
+
+# Counter of the running request or block, if any
+CURRENT_QUERY_COUNTER: ContextVar["QueryCounter | None"] = ContextVar("current_query_counter", default=None)
+# Counters that see the queries of every task and thread, e.g. of a test client running the app
+GLOBAL_QUERY_COUNTERS: list["QueryCounter"] = []
+
+
+def get_statement_fingerprint(statement: str) -> str:
+    """
+    Returns the statement without its values, e.g. to tell the same query repeated with
+    other ids, the sign of a N+1 pattern
+    """
+    statement = PLACEHOLDER_LISTS.sub("(...)", statement)
+    statement = LITERALS.sub("?", statement)
+    return WHITESPACE.sub(" ", statement).strip()
+
+
+class QueryCounter:
+    """
+    Records the statements sent to the DB, by any engine, while it is active
+    """
+
+    def __init__(self):
+        self.statements: list[str] = []
+
+    @property
+    def count(self) -> int:
+        return len(self.statements)
+
+    def get_repeated(self, threshold: int = 2) -> dict[str, int]:
+        """
+        Returns the fingerprints of the statements sent at least threshold times, with their count
+        """
+        fingerprints = Counter(get_statement_fingerprint(statement) for statement in self.statements)
+        return {fingerprint: count for fingerprint, count in fingerprints.items() if count >= threshold}
+
+
+@contextmanager
+def count_queries(is_global: bool = False) -> Iterator[QueryCounter]:
+    """
+    Counts the queries of the block. By default, only the queries of the current task and
+    of the tasks it starts are counted. A global counter counts the queries of every task
+    """
+    query_counter = QueryCounter()
+    if is_global:
+        GLOBAL_QUERY_COUNTERS.append(query_counter)
+        try:
+            yield query_counter
+        finally:
+            GLOBAL_QUERY_COUNTERS.remove(query_counter)
+        return
+    token = CURRENT_QUERY_COUNTER.set(query_counter)
+    try:
+        yield query_counter
+    finally:
+        CURRENT_QUERY_COUNTER.reset(token)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def record_statement(_connection, _cursor, statement: str, *_):
+    """
+    The async engines run their sync core in a greenlet of the calling task, so the
+    counter of the task is visible here
+    """
+    query_counter = CURRENT_QUERY_COUNTER.get()
+    if query_counter is not None:
+        query_counter.statements.append(statement)
+    for global_query_counter in GLOBAL_QUERY_COUNTERS:
+        global_query_counter.statements.append(statement)
@@ -0,0 +1,168 @@
+import asyncio
+import time
+from weakref import WeakKeyDictionary
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+
+from core.caching.redis import RedisClient, get_redis_connection
+from core.config import get_config
+from core.database.base import create_engine
+from core.logger import logger
+
+config = get_config()
+
+# Seconds the replica is behind the primary. A replica that has replayed everything it
+# received is not lagging, even if the primary had no writes for a while
+REPLICA_LAG_QUERY = text(
+    """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+    """
+)
+
+# Seconds given to a replica to answer the health check
+HEALTH_CHECK_TIMEOUT = 1.0
+
+# Like the primary engine, the replica engines are bound to the event loop that created them
+REPLICA_POOLS: WeakKeyDictionary[asyncio.AbstractEventLoop, "ReplicaPool"] = WeakKeyDictionary()
+
+
+class ReplicaUnavailableError(Exception):
+    """
+    Raised when a query fails because the replica can't be reached. The query is retried on the primary
+    """
+
+
+class Replica:
+
+    def __init__(self, engine: AsyncEngine):
+        self.engine = engine
+        self.is_healthy = True
+        # Seconds
+        self.lag = 0.0
+
+    @property
+    def is_available(self) -> bool:
+        return self.is_healthy and self.lag <= config.database.replica_max_lag
+
+    async def measure_lag(self) -> float:
+        async with self.engine.connect() as connection:
+            result = await connection.execute(REPLICA_LAG_QUERY)
+            return float(result.scalar_one())
+
+    async def check(self):
+        """
+        Measures the replication lag. A replica that doesn't answer is marked unhealthy. The
+        timeout covers the connection as well, so an unreachable replica doesn't hold the
+        request checking it for the whole connect timeout
+        """
+        try:
+            self.lag = await asyncio.wait_for(self.measure_lag(), HEALTH_CHECK_TIMEOUT)
+            self.is_healthy = True
+        except Exception as e:
+            logger.error(f"Replica {self.engine.url.host} is unhealthy - {e}")
+            self.is_healthy = False
+
+
+class ReplicaPool:
+    """
+    The replicas are picked round-robin. Their health and lag are checked lazily, at most
+    once per check interval, so a replica that is down or lagging is skipped until it recovers
+    """
+
+    def __init__(self, urls: list[str]):
+        self.replicas = [Replica(create_engine(url)) for url in urls]
+        self.index = 0
+        self.checked_at = float("-inf")
+
+    async def check_replicas(self):
+        # Set before the round trips, so that concurrent requests don't check as well
+        self.checked_at = time.monotonic()
+        await asyncio.gather(*(replica.check() for replica in self.replicas))
+
+    async def get_replica(self) -> Replica | None:
+        """
+        Returns the next available replica. If none is available, returns None
+        """
+        if time.monotonic() - self.checked_at > config.database.replica_check_interval:
+            await self.check_replicas()
+        available_replicas = [replica for replica in self.replicas if replica.is_available]
+        if not available_replicas:
+            return None
+        self.index = (self.index + 1) % len(available_replicas)
+        return available_replicas[self.index]
+
+    async def dispose(self):
+        for replica in self.replicas:
+            await replica.engine.dispose()
+
+
+def get_replica_pool() -> ReplicaPool:
+    """
+    Returns the replica pool of the running event loop. The engines are created on first use
+    """
+    loop = asyncio.get_running_loop()
+    replica_pool = REPLICA_POOLS.get(loop)
+    if replica_pool is None:
+        replica_pool = ReplicaPool([url.unicode_string() for url in config.database.replica_urls])
+        REPLICA_POOLS[loop] = replica_pool
+    return replica_pool
+
+
+async def dispose_replica_engines():
+    """
+    Closes all the pooled replica connections of the running event loop
+    """
+    replica_pool = REPLICA_POOLS.pop(asyncio.get_running_loop(), None)
+    if replica_pool is not None:
+        await replica_pool.dispose()
+
+
+async def has_recent_writes(user_id: str) -> bool:
+    """
+    Checks if the user wrote within the read-your-writes window. The window is kept in
+    redis, since the next request of the user can be served by any worker. If redis can't
+    tell, the primary is the safe choice
+    """
+    recent_writes = await RedisClient.execute(
+        lambda: get_redis_connection().exists(f"recent_writes:{user_id}"),
+        default=1
+    )
+    return bool(recent_writes)
+
+
+async def get_read_replica(session: AsyncSession) -> Replica | None:
+    """
+    Returns the replica the read only queries of the session should go to. Returns None if
+    the reads should go to the primary, i.e. no replica is configured or available, the
+    session has written already or its user wrote recently
+    """
+    if not config.database.replica_urls or session.info.get("has_writes"):
+        return None
+    if "has_recent_writes" not in session.info:
+        user_id = session.info.get("user_id")
+        session.info["has_recent_writes"] = bool(user_id) and await has_recent_writes(user_id)
+    if session.info["has_recent_writes"]:
+        return None
+    return await get_replica_pool().get_replica()
+
+
+async def mark_writes(session: AsyncSession):
+    """
+    Marks that the session has written to the primary. The next reads of the session and,
+    for the read-your-writes window, of its user go to the primary
+    """
+    if session.info.get("has_writes"):
+        return
+    session.info["has_writes"] = True
+    user_id = session.info.get("user_id")
+    if not config.database.replica_urls or not user_id:
+        return
+    await RedisClient.execute(
+        lambda: get_redis_connection().set(
+            f"recent_writes:{user_id}", 1, px=int(config.database.read_your_writes_window * 1000)
+        )
+    )
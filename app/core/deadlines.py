@@ -0,0 +1,46 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator
+
+from starlette import status
+
+from core.exceptions import HTTPException
+
+# Time, on the monotonic clock, by which the current request must be answered
+request_deadline: ContextVar[float | None] = ContextVar("request_deadline", default=None)
+
+
+def get_remaining_time() -> float | None:
+    """
+    Returns the seconds left to the current request, or None if it has no deadline
+    """
+    deadline = request_deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def is_deadline_exceeded() -> bool:
+    remaining_time = get_remaining_time()
+    return remaining_time is not None and remaining_time <= 0
+
+
+def raise_deadline_exceeded():
+    raise HTTPException(status_code=status.HTTP_504_GATEWAY_TIMEOUT, message="Request deadline exceeded")
+
+
+@contextmanager
+def deadline(timeout: float) -> Iterator[None]:
+    """
+    Gives the block timeout seconds. A block inside another one never gets more time than the outer one
+    """
+    new_deadline = time.monotonic() + timeout
+    current_deadline = request_deadline.get()
+    if current_deadline is not None:
+        new_deadline = min(new_deadline, current_deadline)
+    token = request_deadline.set(new_deadline)
+    try:
+        yield
+    finally:
+        request_deadline.reset(token)
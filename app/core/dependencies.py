@@ -1,53 +1,148 @@
-import secrets
-from typing import AsyncGenerator, Annotated
+from typing import AsyncGenerator, Annotated, Callable
 
 from fastapi import Depends
-from fastapi.security import HTTPBasicCredentials, HTTPBasic
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBasicCredentials, HTTPBasic, HTTPBearer
 from sqlalchemy.ext.asyncio import AsyncSession
 from starlette import status
+from starlette.requests import Request
 
+from core.caching.rate_limiter import RateLimiterClient
+from core.config import get_config
 from core.database.base import get_async_session
 from core.exceptions import HTTPException
 from core.helpers.db_helper import DbHelper
+from core.metrics import Counter
+from core.passwords import make_password_hash, needs_rehash, verify_password
 from core.schemas import UserSchema
+from core.security import get_user_from_token
+
+config = get_config()
+
+db_session_requests = Counter(
+    "db_session_requests_total",
+    "Number of requests by whether they checked out a DB connection",
+    ("db",)
+)
+db_checkouts = Counter("db_checkouts_total", "Number of DB connections checked out by the requests")
 
 
 async def get_db_session() -> AsyncGenerator[AsyncSession, None]:
     """
-    This function yields the async db session and closes it upon completion
+    This function yields the async db session of the request. The session checks out a
+    pooled connection only on its first query, so a request answered from the cache never
+    touches the DB. The writes of the request are one unit of work, committed once the
+    route returns or rolled back if it fails. The session is closed upon completion
     """
     db = get_async_session()()
+    db_helper = DbHelper(db)
     try:
         yield db
+        await db_helper.commit()
+    except Exception:
+        await db_helper.rollback()
+        raise
     finally:
         await db.close()
+        db_checkouts.inc(db.info.get("checkouts", 0))
+        db_session_requests.inc(db="used" if db.info.get("checkouts") else "unused")
 
 
-async def get_current_user(
-    credentials: Annotated[HTTPBasicCredentials, Depends(HTTPBasic())],
-    db_session: Annotated[AsyncSession, Depends(get_db_session)]
-) -> UserSchema:
+async def authenticate_user(db_session: AsyncSession, username: str, password: str) -> UserSchema:
     """
-    This function returns the current user if credential matches.
-    Else, returns error response
+    This function verifies the username and password against the hash stored in the DB and
+    returns the user. Else, returns error response
     """
     db_helper = DbHelper(db_session)
-    provided_username = credentials.username
-    provided_password = credentials.password
-    user_from_db = await db_helper.get_user(filters={"username": provided_username})
+    user_from_db = await db_helper.get_user(filters={"username": username})
     if not user_from_db:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             message="Incorrect username or password"
         )
     user = UserSchema.model_validate(user_from_db)
-    # Uses compare digest from secrets to prevent timing analysis
-    is_correct_password = secrets.compare_digest(
-        provided_password.encode("utf8"), user.password.encode("utf8")
-    )
+    # Hashing is CPU bound, so it runs off the event loop
+    is_correct_password = await verify_password(password=password, password_hash=user.password)
     if not is_correct_password:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             message="Incorrect username or password"
         )
+    # Passwords stored before hashing was introduced are hashed on the next login
+    if needs_rehash(user.password):
+        await db_helper.update_user_password(user_id=user.id, password_hash=await make_password_hash(password))
     return user
+
+
+async def get_current_user(
+    bearer_credentials: Annotated[HTTPAuthorizationCredentials | None, Depends(HTTPBearer(auto_error=False))],
+    basic_credentials: Annotated[HTTPBasicCredentials | None, Depends(HTTPBasic(auto_error=False))],
+    db_session: Annotated[AsyncSession, Depends(get_db_session)]
+) -> UserSchema:
+    """
+    This function returns the current user. A bearer token is verified without touching the DB.
+    HTTP Basic credentials are still accepted and verified against the DB.
+    Else, returns error response
+    """
+    if bearer_credentials:
+        user = await get_user_from_token(bearer_credentials.credentials)
+    elif basic_credentials:
+        user = await authenticate_user(
+            db_session=db_session,
+            username=basic_credentials.username,
+            password=basic_credentials.password
+        )
+    else:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            message="Not authenticated",
+            headers={"WWW-Authenticate": "Bearer"}
+        )
+    # The session routes the reads of a user who wrote recently to the primary
+    db_session.info["user_id"] = user.id
+    return user
+
+
+class RateLimiter:
+    """
+    Dependency that rate limits the requests of the current user with a token bucket.
+    The cost of a request can be a number or a function of the request. Optionally, the
+    number of in-flight requests of a user can be capped for the expensive endpoints.
+    The limits are stored in the request state and sent as headers by RateLimitHeadersMiddleware.
+    """
+
+    def __init__(self, cost: int | Callable[[Request], int] = 1, max_concurrency: int | None = None):
+        self.cost = cost
+        self.max_concurrency = max_concurrency
+
+    async def __call__(
+        self,
+        request: Request,
+        current_user: Annotated[UserSchema, Depends(get_current_user)]
+    ) -> AsyncGenerator[None, None]:
+        if not config.rate_limit.enabled:
+            yield
+            return
+        rate_limiter_client = RateLimiterClient()
+        cost = self.cost(request) if callable(self.cost) else self.cost
+        result = await rate_limiter_client.acquire(key=current_user.id, cost=cost)
+        request.state.rate_limit = result
+        if not result.is_allowed:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                message="Too many requests",
+                headers={"Retry-After": str(result.retry_after)}
+            )
+        if self.max_concurrency is None:
+            yield
+            return
+        concurrency_key = f"{request.scope['route'].path}:{current_user.id}"
+        if not await rate_limiter_client.acquire_concurrency(key=concurrency_key, limit=self.max_concurrency):
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                message="Too many concurrent requests",
+                headers={"Retry-After": "1"}
+            )
+        try:
+            yield
+        finally:
+            await rate_limiter_client.release_concurrency(key=concurrency_key)
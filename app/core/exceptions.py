@@ -3,6 +3,6 @@ from fastapi.exceptions import HTTPException as FastAPIHTTPException
 
 class HTTPException(FastAPIHTTPException):
 
-    def __init__(self, status_code: int, message: str):
-        super().__init__(status_code)
+    def __init__(self, status_code: int, message: str, headers: dict[str, str] | None = None):
+        super().__init__(status_code, headers=headers)
         self.message = message
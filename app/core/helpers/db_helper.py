@@ -1,16 +1,257 @@
-from typing import Any, Sequence
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from functools import lru_cache, partial, wraps
+from typing import Any, Awaitable, Callable
 
 from core.config import get_config
-from core.database.models import Book, Review, User
+from core.database.base import get_async_session
+from core.database.models import BOOK_SEARCH_DOCUMENT, Book, Review, User
+from core.database.replicas import ReplicaUnavailableError, get_read_replica, mark_writes
+from core.deadlines import is_deadline_exceeded, raise_deadline_exceeded
 from core.exceptions import HTTPException
 from core.logger import logger
-from core.schemas import BookSchema, ReviewSchema
-from sqlalchemy import delete, insert, select, update
+from core.schemas import BookSchema, BookUpdateSchema, ReviewSchema
+from sqlalchemy import Float, bindparam, delete, func, insert, literal_column, select, text, true, tuple_, update
+from sqlalchemy.exc import InterfaceError, OperationalError
 from sqlalchemy.ext.asyncio import AsyncSession
 from starlette import status
 
 config = get_config()
 
+# SQLSTATE of a statement cancelled by the statement timeout
+QUERY_CANCELED = "57014"
+
+# Pre-built statements for the fixed lookup shapes. Building a select and generating its
+# cache key costs far more than the lookup of the compiled statement in the cache, and a
+# pre-built statement memoizes its cache key. The values are sent as bound parameters,
+# so asyncpg reuses the same server side prepared statement for every call.
+GET_BOOK_BY_ID = select(Book).where(Book.id == bindparam("id"))
+GET_BOOK_BY_TITLE_AND_AUTHOR = select(Book).where(
+    Book.title == bindparam("title"),
+    Book.author == bindparam("author")
+)
+GET_USER_BY_USERNAME = select(User).where(User.username == bindparam("username"))
+GET_BOOKS_BY_IDS = select(Book).where(Book.id.in_(bindparam("ids", expanding=True)))
+# The summary and the rating histogram of a book. A single row, whatever the number of reviews
+GET_BOOK_SUMMARY_AND_HISTOGRAM = select(Book.summary, Book.rating_histogram, Book.version).where(
+    Book.id == bindparam("id")
+)
+# Recounts the rating histograms of the given books from their reviews. Only the books
+# whose histogram was wrong are updated, and their version is incremented, so their
+# cached summaries are replaced
+RECOMPUTE_RATING_HISTOGRAMS = text("""
+    UPDATE books SET rating_histogram = counted.histogram, version = books.version + 1
+    FROM (
+        SELECT books.id, ARRAY(
+            SELECT count(reviews.id)
+            FROM generate_series(0, 10) AS bucket
+            LEFT JOIN reviews ON reviews.book_id = books.id AND round(reviews.rating * 2) = bucket
+            GROUP BY bucket
+            ORDER BY bucket
+        ) AS histogram
+        FROM books
+        WHERE books.id IN :ids
+    ) AS counted
+    WHERE books.id = counted.id AND books.rating_histogram IS DISTINCT FROM counted.histogram
+    RETURNING books.id
+""").bindparams(bindparam("ids", expanding=True))
+# A page of the book ids, in order, after the given one
+GET_BOOK_IDS_AFTER = (
+    select(Book.id).where(Book.id > bindparam("after")).order_by(Book.id).limit(bindparam("limit"))
+)
+# Every review of a book, oldest first, with the username of the reviewer. The reviews
+# are joined with their users, rather than loading the user of every review
+GET_REVIEWS_FOR_BOOK = (
+    select(Review.review_text, User.username.label("user"))
+    .join(User, Review.user_id == User.id)
+    .where(Review.book_id == bindparam("book_id"))
+    .order_by(Review.created_at, Review.id)
+)
+# A page of the reviews of a book, newest first, with the username of the reviewer. The
+# version of the book is read along, from the same snapshot, so the page can be cached
+# under it. A book without reviews gives a single row without review, a missing book none
+_reviews_page = (
+    select(Review.id, Review.created_at, Review.review_text, Review.rating, User.username.label("user"))
+    .join(User, Review.user_id == User.id)
+    .where(Review.book_id == bindparam("book_id"))
+    .order_by(Review.created_at.desc(), Review.id)
+    .offset(bindparam("offset"))
+    .limit(bindparam("limit"))
+    .subquery()
+)
+GET_REVIEWS_PAGE = (
+    select(Book.version, _reviews_page.c.review_text, _reviews_page.c.rating, _reviews_page.c.user)
+    .outerjoin(_reviews_page, true())
+    .where(Book.id == bindparam("book_id"))
+    .order_by(_reviews_page.c.created_at.desc(), _reviews_page.c.id)
+)
+# The review count, rating sum and trending score of every reviewed book, from the reviews
+# created until a time. The trending score is the log of the sum of exp(decay_rate * t)
+# over the reviews, computed as max + ln(sum(exp(x - max))), so it doesn't overflow
+_review_score = func.extract("epoch", Review.created_at) * bindparam("decay_rate", type_=Float)
+_scored_reviews = select(
+    Review.book_id,
+    Review.rating,
+    _review_score.label("score"),
+    func.max(_review_score).over(partition_by=Review.book_id).label("max_score")
+).where(Review.created_at <= bindparam("until", type_=Review.created_at.type)).subquery()
+GET_REVIEW_STATS = (
+    select(
+        Book.id,
+        Book.title,
+        Book.author,
+        Book.genre,
+        Book.year_published,
+        func.count(_scored_reviews.c.rating).label("count"),
+        func.sum(_scored_reviews.c.rating).label("sum"),
+        (
+            func.max(_scored_reviews.c.max_score)
+            + func.ln(func.sum(func.exp(_scored_reviews.c.score - _scored_reviews.c.max_score)))
+        ).label("trend")
+    )
+    .join(_scored_reviews, _scored_reviews.c.book_id == Book.id)
+    .group_by(Book.id)
+)
+# The time the stats of a leaderboards rebuild are computed until. The reviews get the start
+# time of their transaction, so the ones created a bit earlier may not be committed yet.
+# They are left out of the stats and replayed with the reviews created after
+GET_REVIEW_STATS_UNTIL = select(func.localtimestamp() - timedelta(minutes=1))
+# A batch of the reviews created after a review, with the details of their book, in the
+# order of creation. The batches follow each other with a keyset on (created_at, id)
+GET_REVIEWS_CREATED_AFTER = (
+    select(
+        Review.id,
+        Review.rating,
+        func.extract("epoch", Review.created_at).label("reviewed_at"),
+        Review.created_at,
+        Book.id.label("book_id"),
+        Book.title,
+        Book.author,
+        Book.genre,
+        Book.year_published
+    )
+    .join(Book, Review.book_id == Book.id)
+    .where(
+        tuple_(Review.created_at, Review.id) > tuple_(
+            bindparam("after_created_at", type_=Review.created_at.type), bindparam("after_id", type_=Review.id.type)
+        )
+    )
+    .order_by(Review.created_at, Review.id)
+    .limit(bindparam("limit"))
+)
+# The books matching a full text query, the best first. The query is written like in a
+# web search engine, e.g. dragon -fire "young girl". The books are ranked by how often
+# and where the words occur, the title weighing more, and the rank is scaled to 0..1
+_search_document = literal_column(BOOK_SEARCH_DOCUMENT)
+_search_query = func.websearch_to_tsquery(literal_column("'english'"), bindparam("query"))
+_search_rank = func.ts_rank(_search_document, _search_query, literal_column("32"))
+SEARCH_BOOKS = (
+    select(Book, _search_rank.label("score"))
+    .where(_search_document.op("@@")(_search_query), Book.id != bindparam("exclude_id"))
+    .order_by(_search_rank.desc(), Book.id)
+    .limit(bindparam("limit"))
+)
+
+BOOK_LOOKUPS = {
+    frozenset({"id"}): GET_BOOK_BY_ID,
+    frozenset({"title", "author"}): GET_BOOK_BY_TITLE_AND_AUTHOR,
+}
+USER_LOOKUPS = {
+    frozenset({"username"}): GET_USER_BY_USERNAME,
+}
+
+# The columns a book can be projected to
+BOOK_COLUMNS = {
+    column.key: column
+    for column in (
+        Book.id, Book.title, Book.author, Book.genre, Book.year_published, Book.summary, Book.version,
+        Book.average_rating
+    )
+}
+# The filters of the book list and the condition each one adds
+BOOK_FILTERS = {
+    "genre": Book.genre == bindparam("genre"),
+    "author": Book.author == bindparam("author"),
+    "year_from": Book.year_published >= bindparam("year_from"),
+    "year_to": Book.year_published <= bindparam("year_to"),
+}
+# The orders of the book list, as the column and whether it is descending. The ties are
+# broken by the id, so every order is total and can be paginated with a keyset
+BOOK_SORTS = {
+    "id": (Book.id, False),
+    "title": (Book.title, False),
+    "year": (Book.year_published, False),
+    "rating": (Book.average_rating, True),
+}
+
+
+def get_book_sort_keys(sort_by: str) -> tuple[str, ...]:
+    """
+    Returns the fields a page of the given order is paginated on
+    """
+    column, _ = BOOK_SORTS[sort_by]
+    return tuple(dict.fromkeys((column.key, "id")))
+
+
+@lru_cache(maxsize=512)
+def get_books_page_query(
+    fields: tuple[str, ...], filters: tuple[str, ...] = (), sort_by: str = "id", after: bool = False
+):
+    """
+    Returns the pre-built paginated query for a subset of the book columns, with the given
+    filters and order. Only the selected columns, along with the ones of the order, are
+    fetched as plain rows, so no ORM object is hydrated. After a given row, the page
+    starts with a keyset condition that the index of the order answers, instead of an offset
+    """
+    column, descending = BOOK_SORTS[sort_by]
+    sort_keys = get_book_sort_keys(sort_by)
+    query = select(*(BOOK_COLUMNS[field] for field in dict.fromkeys((*fields, *sort_keys))))
+    query = query.where(*(BOOK_FILTERS[name] for name in filters))
+    if after:
+        keys = tuple_(*(BOOK_COLUMNS[key] for key in sort_keys))
+        values = tuple_(*(bindparam(f"after_{key}", type_=BOOK_COLUMNS[key].type) for key in sort_keys))
+        query = query.where(keys < values if descending else keys > values)
+    return (
+        query
+        .order_by(*(BOOK_COLUMNS[key].desc() if descending else BOOK_COLUMNS[key] for key in sort_keys))
+        .offset(bindparam("offset"))
+        .limit(bindparam("limit"))
+    )
+
+
+@lru_cache(maxsize=128)
+def get_books_count_query(filters: tuple[str, ...]):
+    """
+    Returns the pre-built query counting the books matching the given filters
+    """
+    return select(func.count()).select_from(Book).where(*(BOOK_FILTERS[name] for name in filters))
+
+
+def read_only(func):
+    """
+    Decorator that sends the queries of a read only helper method to a read replica,
+    if one is available. If the replica fails, the method is retried on the primary.
+    Unless the unit of work has pending writes, the connection goes back to the pool
+    as soon as the method returns, instead of being held until the end of the request
+    """
+    @wraps(func)
+    async def wrapped(self, *args, **kwargs):
+        replica = await get_read_replica(self.session)
+        if replica is not None:
+            self.session.info["replica"] = replica
+            try:
+                result = await func(self, *args, **kwargs)
+                await self.release_connection()
+                return result
+            except ReplicaUnavailableError:
+                pass
+            finally:
+                self.session.info.pop("replica", None)
+        result = await func(self, *args, **kwargs)
+        await self.release_connection()
+        return result
+    return wrapped
+
 
 class DbHelper:
     """
@@ -20,19 +261,123 @@ class DbHelper:
     def __init__(self, db_session: AsyncSession):
         self.session = db_session
 
-    async def execute_query(self, query):
+    async def execute_query(self, query, params: dict[str, Any] | None = None):
+        if is_deadline_exceeded():
+            raise_deadline_exceeded()
+        if not query.is_select:
+            await mark_writes(self.session)
+            # Committed once, at the end of the unit of work
+            self.session.info["has_pending_writes"] = True
         try:
-            result = await self.session.execute(query)
+            result = await self.session.execute(query, params)
             return result
         except Exception as e:
             logger.error(e)
-            try:
+            replica = self.session.info.get("replica")
+            # A replica that went down since its last health check refuses the connection
+            # with an OSError, which is not wrapped by SQLAlchemy
+            if replica is not None and isinstance(e, (InterfaceError, OperationalError, OSError)):
+                # Skipped until the next health check
+                replica.is_healthy = False
                 await self.session.rollback()
+                raise ReplicaUnavailableError from e
+            try:
+                # Inside a savepoint, only the savepoint is rolled back when the error leaves it
+                if not self.session.in_nested_transaction():
+                    await self.rollback()
+            finally:
+                if getattr(getattr(e, "orig", None), "sqlstate", None) == QUERY_CANCELED:
+                    # Cancelled by the statement timeout, i.e. the deadline of the request
+                    raise_deadline_exceeded()
+                raise HTTPException(
+                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                    message="Something went wrong!",
+                )
+
+    async def commit(self):
+        """
+        Commits the unit of work, if anything is written, and then runs the callbacks
+        registered with after_commit. A failed callback doesn't fail the committed writes
+        nor the callbacks after it
+        """
+        if not self.session.info.get("has_pending_writes"):
+            return
+        try:
+            await self.session.commit()
+        except Exception as e:
+            logger.error(e)
+            try:
+                await self.rollback()
             finally:
                 raise HTTPException(
                     status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                     message="Something went wrong!",
                 )
+        self.session.info["has_pending_writes"] = False
+        for callback in self.session.info.pop("after_commit", []):
+            await self.run_after_commit(callback)
+
+    async def release_connection(self):
+        """
+        Ends a transaction without writes, so its connections go back to the pool right away.
+        Since the objects are not expired on commit, the loaded objects stay usable
+        """
+        if self.session.in_transaction() and not self.session.info.get("has_pending_writes"):
+            await self.session.commit()
+
+    async def rollback(self):
+        """
+        Rolls back the unit of work. The callbacks registered with after_commit are dropped
+        """
+        self.session.info["has_pending_writes"] = False
+        self.session.info.pop("after_commit", None)
+        await self.session.rollback()
+
+    @asynccontextmanager
+    async def savepoint(self):
+        """
+        Runs the block in a savepoint. If the block fails, only its writes are rolled back
+        and the rest of the unit of work can still be committed
+        """
+        async with self.session.begin_nested():
+            yield
+
+    async def after_commit(self, callback: Callable[..., Awaitable], *args, **kwargs):
+        """
+        Runs the callback once the writes of the unit of work are committed, e.g. to update
+        the cache only with committed data. If nothing is pending, it runs right away
+        """
+        if not self.session.info.get("has_pending_writes"):
+            await self.run_after_commit(partial(callback, *args, **kwargs))
+            return
+        self.session.info.setdefault("after_commit", []).append(partial(callback, *args, **kwargs))
+
+    @staticmethod
+    async def run_after_commit(callback: Callable[[], Awaitable]):
+        """
+        Runs a callback of a committed unit of work. The writes are done by then, so an
+        error of the callback, e.g. a stale cache entry left behind, is only logged
+        """
+        try:
+            await callback()
+        except Exception as e:
+            logger.error(f"After commit callback failed - {e}")
+
+    @asynccontextmanager
+    async def concurrent_session(self):
+        """
+        Yields a helper on a session of its own, so its queries can run concurrently with
+        the ones of this session, on another pooled connection. Meant for reads only, since
+        its writes would not be part of the unit of work
+        """
+        session = get_async_session()()
+        # Keeps reading the writes of the same user from the primary
+        session.info["user_id"] = self.session.info.get("user_id")
+        try:
+            yield DbHelper(db_session=session)
+        finally:
+            await session.close()
+            self.session.info["checkouts"] = self.session.info.get("checkouts", 0) + session.info.get("checkouts", 0)
 
     async def add_book_row(self, book: dict):
         """
@@ -41,40 +386,90 @@ class DbHelper:
         query = insert(Book).values(**book).returning(Book)
         result = await self.execute_query(query)
         book = result.scalar_one()
-        await self.session.commit()
         return book
 
+    @read_only
     async def get_book(self, filters: dict[str, str]) -> Book | None:
         """
-        Fetches a book based on given filters. Returns the book or none
+        Fetches a book based on given filters. Returns the book or none.
+        The common lookups use the pre-built statements
         """
-        query = select(Book)
-        for key, val in filters.items():
-            query = query.where(getattr(Book, key) == val)
-        result = await self.execute_query(query)
+        query = BOOK_LOOKUPS.get(frozenset(filters))
+        if query is None:
+            query = select(Book)
+            for key, val in filters.items():
+                query = query.where(getattr(Book, key) == val)
+            filters = None
+        result = await self.execute_query(query, filters)
         book = result.scalar_one_or_none()
         return book
 
-    async def get_all_books(self, page_size: int, current_page: int) -> Sequence[Book]:
+    @read_only
+    async def get_books_by_ids(self, book_ids: list[str]) -> list[Book]:
         """
-        Fetches all the books with pagination
+        Fetches the books with the given ids in one query. Missing books are skipped
         """
-        query = select(Book).offset((current_page - 1) * page_size).limit(page_size)
-        result = await self.execute_query(query)
-        all_books = result.scalars().all()
-        return all_books
+        result = await self.execute_query(GET_BOOKS_BY_IDS, {"ids": book_ids})
+        return list(result.scalars().all())
 
-    async def update_book_record(self, book_id: str, payload: BookSchema):
+    @read_only
+    async def search_books(self, query: str, limit: int, exclude_id: str = "") -> list[tuple[Book, float]]:
         """
-        Updates a book record with the provided values
+        Fetches the books matching the full text query, the best first, with their rank
+        """
+        result = await self.execute_query(SEARCH_BOOKS, {"query": query, "limit": limit, "exclude_id": exclude_id})
+        return [(book, score) for book, score in result.all()]
+
+    @read_only
+    async def get_all_books(
+        self,
+        page_size: int,
+        current_page: int,
+        fields: tuple[str, ...],
+        filters: dict[str, Any] | None = None,
+        sort_by: str = "id",
+        after: dict[str, Any] | None = None
+    ) -> list[dict[str, Any]]:
+        """
+        Fetches the given columns of the books matching the filters, in the given order.
+        A page starts after the given sort keys if any, else at the current page. The
+        rows also hold the sort keys of the order
+        """
+        filters = filters or {}
+        query = get_books_page_query(fields, tuple(sorted(filters)), sort_by, after is not None)
+        params = {**filters, "limit": page_size}
+        if after is not None:
+            params.update({f"after_{key}": value for key, value in after.items()}, offset=0)
+        else:
+            params["offset"] = (current_page - 1) * page_size
+        result = await self.execute_query(query, params)
+        return [dict(row) for row in result.mappings()]
+
+    async def count_books(self, filters: dict[str, Any]) -> int:
+        """
+        Counts the books matching the given filters. The count is cached until the next
+        write to the books, so it is read on the primary. A lagging replica could return
+        a count from before a write whose invalidation has already run, and it would stay
+        cached until the following write
+        """
+        result = await self.execute_query(get_books_count_query(tuple(sorted(filters))), filters)
+        return result.scalar_one()
+
+    async def update_book_record(self, book_id: str, payload: BookSchema | BookUpdateSchema) -> Book | None:
+        """
+        Updates a book record with the provided values and increments the version.
+        Returns the updated row or none if the book does not exist
         """
         query = (
             update(Book)
             .where(Book.id == book_id)
-            .values(**payload.model_dump(exclude_none=True))
+            .values(**payload.model_dump(exclude_none=True, exclude={"id", "version"}), version=Book.version + 1)
+            .returning(Book)
+            .execution_options(populate_existing=True)
         )
-        await self.execute_query(query)
-        await self.session.commit()
+        result = await self.execute_query(query)
+        book = result.scalar_one_or_none()
+        return book
 
     async def delete_book_record(self, book_id: str):
         """
@@ -82,45 +477,145 @@ class DbHelper:
         """
         query = delete(Book).where(Book.id == book_id)
         await self.execute_query(query)
-        await self.session.commit()
 
-    async def create_review_for_book(self, book_id: str, review: ReviewSchema):
+    async def create_review_for_book(self, book_id: str, review: ReviewSchema) -> Book:
         """
-        Creates a review record in DB
+        Creates a review record in DB and increments the version of the book.
+        Returns the updated book
         """
         query = insert(Review).values(**{**review.model_dump(), "book_id": book_id})
         await self.execute_query(query)
-        await self.session.commit()
+        book = await self.increment_book_version(book_id=book_id)
+        return book
 
-    async def get_all_reviews_for_book(self, book_id: str):
+    async def increment_book_version(self, book_id: str) -> Book | None:
         """
-        Fetches all reviews for a book
+        Increments the version of a book without changing anything else.
+        Returns the updated book
         """
-        query = select(Book).where(Book.id == book_id)
+        query = (
+            update(Book)
+            .where(Book.id == book_id)
+            .values(version=Book.version + 1)
+            .returning(Book)
+            .execution_options(populate_existing=True)
+        )
         result = await self.execute_query(query)
-        book = result.scalar_one_or_none()
-        # Since we are using async sqlalchemy, we need to refresh the attributes
-        # to load (lazy loading)
-        await self.session.refresh(book, ["reviews"])
-        if book.reviews:
-            for review in book.reviews:
-                await self.session.refresh(review, ["user"])
-        return book.reviews, book
+        return result.scalar_one_or_none()
 
-    async def store_summary(self, book_id: str, summary: str):
+    @read_only
+    async def get_all_reviews_for_book(self, book_id: str) -> list[dict[str, Any]]:
         """
-        Stores the summary of a book
+        Fetches the text and the username of all the reviews of a book, in a single query
         """
-        query = update(Book).where(Book.id == book_id).values(summary=summary)
-        await self.execute_query(query)
-        await self.session.commit()
+        result = await self.execute_query(GET_REVIEWS_FOR_BOOK, {"book_id": book_id})
+        return [dict(row) for row in result.mappings()]
+
+    @read_only
+    async def get_book_summary_and_histogram(self, book_id: str) -> dict[str, Any] | None:
+        """
+        Fetches the summary, the rating histogram and the version of a book.
+        Returns none if the book does not exist
+        """
+        result = await self.execute_query(GET_BOOK_SUMMARY_AND_HISTOGRAM, {"id": book_id})
+        row = result.mappings().one_or_none()
+        return dict(row) if row else None
+
+    async def get_book_ids_after(self, after: str, limit: int) -> list[str]:
+        """
+        Fetches the ids of the next books after the given id, to go through all the books in batches
+        """
+        result = await self.execute_query(GET_BOOK_IDS_AFTER, {"after": after, "limit": limit})
+        return list(result.scalars().all())
+
+    async def recompute_rating_histograms(self, book_ids: list[str]) -> list[str]:
+        """
+        Recounts the rating histograms of the given books. Returns the ids of the books
+        whose histogram was wrong
+        """
+        result = await self.execute_query(RECOMPUTE_RATING_HISTOGRAMS, {"ids": book_ids})
+        return list(result.scalars().all())
 
+    @read_only
+    async def get_reviews_page(self, book_id: str, page_size: int, current_page: int = 1) -> dict[str, Any] | None:
+        """
+        Fetches a page of the reviews of a book, newest first, with the version of the book
+        they belong to. Returns none if the book does not exist
+        """
+        result = await self.execute_query(
+            GET_REVIEWS_PAGE, {"book_id": book_id, "offset": (current_page - 1) * page_size, "limit": page_size}
+        )
+        rows = result.mappings().all()
+        if not rows:
+            return None
+        return {
+            "version": rows[0]["version"],
+            "reviews": [
+                {"review_text": row["review_text"], "user": row["user"], "rating": row["rating"]}
+                for row in rows
+                if row["review_text"] is not None
+            ]
+        }
+
+    async def get_review_stats_until(self) -> datetime:
+        """
+        Returns the time until which the review stats of a leaderboards rebuild are computed
+        """
+        result = await self.execute_query(GET_REVIEW_STATS_UNTIL)
+        return result.scalar_one()
+
+    async def get_review_stats(self, decay_rate: float, until: datetime) -> list[dict[str, Any]]:
+        """
+        Fetches the review stats of every reviewed book, from the reviews created until the
+        given time, to rebuild the leaderboards. They are read on the primary, since the
+        reviews created later are replayed from it
+        """
+        result = await self.execute_query(GET_REVIEW_STATS, {"decay_rate": decay_rate, "until": until})
+        return [dict(row) for row in result.mappings()]
+
+    async def get_reviews_created_after(
+        self, after_created_at: datetime, after_id: str, limit: int
+    ) -> list[dict[str, Any]]:
+        """
+        Fetches a batch of the reviews created after the given one, with their book
+        """
+        result = await self.execute_query(
+            GET_REVIEWS_CREATED_AFTER, {"after_created_at": after_created_at, "after_id": after_id, "limit": limit}
+        )
+        return [dict(row) for row in result.mappings()]
+
+    async def store_summary(self, book_id: str, summary: str) -> Book | None:
+        """
+        Stores the summary of a book and increments the version. Returns the updated book
+        """
+        query = (
+            update(Book)
+            .where(Book.id == book_id)
+            .values(summary=summary, version=Book.version + 1)
+            .returning(Book)
+            .execution_options(populate_existing=True)
+        )
+        result = await self.execute_query(query)
+        book = result.scalar_one_or_none()
+        return book
+
+    @read_only
     async def get_user(self, filters: dict[str, Any]) -> User:
         """
         Fetches a user based on provided filters
         """
-        query = select(User)
-        for key, val in filters.items():
-            query = query.where(getattr(User, key) == val)
-        result = await self.execute_query(query)
+        query = USER_LOOKUPS.get(frozenset(filters))
+        if query is None:
+            query = select(User)
+            for key, val in filters.items():
+                query = query.where(getattr(User, key) == val)
+            filters = None
+        result = await self.execute_query(query, filters)
         return result.scalar_one_or_none()
+
+    async def update_user_password(self, user_id: str, password_hash: str):
+        """
+        Replaces the stored password of a user with a new hash
+        """
+        query = update(User).where(User.id == user_id).values(password=password_hash)
+        await self.execute_query(query)
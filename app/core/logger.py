@@ -1,18 +1,190 @@
+import atexit
+import copy
+import json
 import logging
+import os
+import queue
+import threading
+import time
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener
+
+from core.config import get_config
+from core.metrics import Counter
+
+config = get_config()
+
+# Id of the request being served, set by the RequestIdMiddleware and added to its log records
+request_id: ContextVar[str | None] = ContextVar("request_id", default=None)
+
+log_records_dropped = Counter(
+    "log_records_dropped_total",
+    "Number of log records dropped because the log queue was full",
+    ("level",)
+)
+log_records_suppressed = Counter(
+    "log_records_suppressed_total",
+    "Number of log records suppressed because the same message was logged too often",
+    ("level",)
+)
+
+
+class RepeatedMessageFilter(logging.Filter):
+    """
+    Lets at most burst records of the same level and message through per interval
+    seconds, e.g. the same redis error logged by every request during an outage. The
+    number of records suppressed in the previous interval is added to the next one let through
+    """
+
+    # The state of the oldest messages is dropped beyond this
+    max_messages = 1024
+
+    def __init__(self, interval: float, burst: int):
+        super().__init__()
+        self.interval = interval
+        self.burst = burst
+        # (level, message) -> [start of the interval, records of the interval, records suppressed]
+        self.messages: dict[tuple[int, str], list] = {}
+        self.lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        key = (record.levelno, record.getMessage())
+        now = time.monotonic()
+        with self.lock:
+            state = self.messages.get(key)
+            if state is None:
+                if len(self.messages) >= self.max_messages:
+                    del self.messages[next(iter(self.messages))]
+                state = self.messages[key] = [now, 0, 0]
+            elif now - state[0] >= self.interval:
+                state[0], state[1] = now, 0
+            state[1] += 1
+            if state[1] > self.burst:
+                state[2] += 1
+                log_records_suppressed.inc(level=record.levelname)
+                return False
+            if state[2]:
+                record.suppressed = state[2]
+                state[2] = 0
+        return True
+
+
+class RequestIdFilter(logging.Filter):
+    """
+    Adds the id of the current request to the record. It runs in the thread logging the
+    record, where the context of the request is visible, before the record is queued
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        current_request_id = request_id.get()
+        if current_request_id is not None:
+            record.request_id = current_request_id
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats a record as a single line JSON object
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record, "%Y-%m-%dT%H:%M:%S") + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "message": record.getMessage(),
+            "process": record.process
+        }
+        if getattr(record, "request_id", None):
+            entry["request_id"] = record.request_id
+        if getattr(record, "suppressed", 0):
+            entry["suppressed"] = record.suppressed
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class BoundedQueueHandler(QueueHandler):
+    """
+    Queues the records for the listener thread, so logging never blocks the event loop on
+    I/O. The queue is bounded and the records logged while it is full are dropped and counted
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The message is rendered here, since its arguments may change once queued, but the
+        # formatting is left to the listener
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            log_records_dropped.inc(level=record.levelname)
+
+
+class LogPipeline:
+    """
+    Writes the log records to stderr from a background thread. A thread doesn't survive a
+    fork, so a forked worker starts its own listener, on a queue of its own
+    """
+
+    def __init__(self, log_format: str, queue_size: int):
+        output_handler = logging.StreamHandler()
+        if log_format == "json":
+            output_handler.setFormatter(JsonFormatter())
+        else:
+            output_handler.setFormatter(logging.Formatter(
+                fmt="[%(levelname)s %(asctime)s %(request_id)s - %(message)s]",
+                datefmt="%Y-%m-%d %H:%M:%S",
+                defaults={"request_id": "-"}
+            ))
+        self.output_handler = output_handler
+        self.queue_size = queue_size
+        self.handler = BoundedQueueHandler(queue.Queue(maxsize=queue_size))
+        self.listener: QueueListener | None = None
+
+    def start(self):
+        self.listener = QueueListener(self.handler.queue, self.output_handler)
+        self.listener.start()
+
+    def stop(self):
+        """
+        Writes the queued records and stops the listener
+        """
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+
+    def restart_after_fork(self):
+        # The queue may have been locked by another thread of the parent during the fork
+        self.handler.queue = queue.Queue(maxsize=self.queue_size)
+        self.listener = None
+        self.start()
 
 
 class CommonLogger(logging.Logger):
     def __init__(self, *args, **kwargs):
-        logger_format = kwargs.pop("logger_format")
+        pipeline = kwargs.pop("pipeline")
         super().__init__(*args, **kwargs)
-        formatter = logging.Formatter(fmt=logger_format, datefmt="%Y-%m-%d %H:%M:%S")
-        handler = logging.StreamHandler()
-        handler.setFormatter(formatter)
-        self.addHandler(handler)
-        self.setLevel(logging.INFO)
+        self.addFilter(RepeatedMessageFilter(
+            interval=config.logging.repeated_message_interval,
+            burst=config.logging.repeated_message_burst
+        ))
+        pipeline.handler.addFilter(RequestIdFilter())
+        self.addHandler(pipeline.handler)
+        self.setLevel(config.logging.level)
 
 
-logger = CommonLogger(
-    name="common_logger",
-    logger_format="[%(levelname)s %(asctime)s - %(message)s]"
-)
+log_pipeline = LogPipeline(log_format=config.logging.format, queue_size=config.logging.queue_size)
+log_pipeline.start()
+os.register_at_fork(after_in_child=log_pipeline.restart_after_fork)
+atexit.register(log_pipeline.stop)
+
+logger = CommonLogger(name="common_logger", pipeline=log_pipeline)
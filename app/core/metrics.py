@@ -0,0 +1,65 @@
+import threading
+from collections import defaultdict
+
+# Label values of a sample, in the order of the label names of its metric
+LabelValues = tuple[str, ...]
+
+
+class Metric:
+    """
+    A metric with optional labels, rendered in the Prometheus text format.
+    The values are kept per worker process
+    """
+
+    type = "untyped"
+
+    def __init__(self, name: str, description: str, label_names: tuple[str, ...] = ()):
+        self.name = name
+        self.description = description
+        self.label_names = label_names
+        self.values: defaultdict[LabelValues, float] = defaultdict(float)
+        # Some metrics are updated from the threads of the executors
+        self.lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def get_label_values(self, labels: dict[str, str]) -> LabelValues:
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.type}"]
+        with self.lock:
+            samples = list(self.values.items())
+        for label_values, value in samples:
+            labels = ",".join(f'{name}="{label_value}"' for name, label_value in zip(self.label_names, label_values))
+            lines.append(f"{self.name}{{{labels}}} {value}" if labels else f"{self.name} {value}")
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels: str):
+        label_values = self.get_label_values(labels)
+        with self.lock:
+            self.values[label_values] += amount
+
+
+class Gauge(Metric):
+
+    type = "gauge"
+
+    def set(self, value: float, **labels: str):
+        label_values = self.get_label_values(labels)
+        with self.lock:
+            self.values[label_values] = value
+
+
+REGISTRY: list[Metric] = []
+
+
+def render_metrics() -> str:
+    """
+    Renders all the registered metrics in the Prometheus text format
+    """
+    return "\n".join(metric.render() for metric in REGISTRY) + "\n"
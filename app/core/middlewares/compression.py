@@ -0,0 +1,178 @@
+import zlib
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - brotli is optional
+    brotli = None
+
+
+COMPRESSIBLE_CONTENT_TYPES = ("application/json", "text/", "application/javascript", "application/xml")
+
+
+def select_encoding(accept_encoding: str) -> str | None:
+    """
+    Selects the preferred encoding supported by the client. Brotli is preferred over gzip
+    if it is available
+    """
+    accepted = set()
+    for item in accept_encoding.split(","):
+        coding, _, params = item.strip().partition(";")
+        # Codings with q=0 are explicitly refused by the client
+        if params.replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        accepted.add(coding.strip().lower())
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+
+class _Compressor:
+    """
+    Incremental compressor for the selected encoding
+    """
+
+    def __init__(self, encoding: str, gzip_level: int, brotli_quality: int):
+        if encoding == "br":
+            self._compressor = brotli.Compressor(quality=brotli_quality)
+            self._compress = self._compressor.process
+            self._flush = self._compressor.finish
+        else:
+            # wbits=31 produces the gzip container
+            self._compressor = zlib.compressobj(gzip_level, zlib.DEFLATED, 31)
+            self._compress = self._compressor.compress
+            self._flush = self._compressor.flush
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compress(data)
+
+    def flush(self) -> bytes:
+        return self._flush()
+
+
+class CompressionMiddleware:
+    """
+    Compresses responses with brotli or gzip based on the Accept-Encoding header of the request.
+    Responses smaller than the minimum size are sent as is, since compressing them costs
+    more CPU than it saves on the wire. The minimum size can be overridden per route prefix
+    and a route can be excluded entirely.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        minimum_size: int = 1024,
+        gzip_level: int = 6,
+        brotli_quality: int = 4,
+        minimum_sizes: dict[str, int] | None = None,
+        exclude_paths: list[str] | None = None
+    ):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        # Longest prefix wins
+        self.minimum_sizes = sorted((minimum_sizes or {}).items(), key=lambda item: len(item[0]), reverse=True)
+        self.exclude_paths = tuple(exclude_paths or ())
+
+    def get_minimum_size(self, path: str) -> int:
+        for prefix, minimum_size in self.minimum_sizes:
+            if path.startswith(prefix):
+                return minimum_size
+        return self.minimum_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["path"].startswith(self.exclude_paths):
+            await self.app(scope, receive, send)
+            return
+        encoding = select_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        responder = _CompressionResponder(
+            send=send,
+            encoding=encoding,
+            minimum_size=self.get_minimum_size(scope["path"]),
+            gzip_level=self.gzip_level,
+            brotli_quality=self.brotli_quality
+        )
+        await self.app(scope, receive, responder)
+
+
+class _CompressionResponder:
+    """
+    Wraps the send callable. It holds back the response start until the first body chunk
+    is available, so that it can decide whether the response is worth compressing.
+    """
+
+    def __init__(self, send: Send, encoding: str | None, minimum_size: int, gzip_level: int, brotli_quality: int):
+        self.send = send
+        self.encoding = encoding
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.start_message: Message | None = None
+        self.compressor: _Compressor | None = None
+        self.is_passthrough = False
+
+    async def __call__(self, message: Message) -> None:
+        if self.is_passthrough:
+            await self.send(message)
+            return
+
+        if message["type"] == "http.response.start":
+            headers = Headers(raw=message["headers"])
+            content_type = headers.get("content-type", "")
+            if (
+                "content-encoding" in headers
+                or message["status"] < 200
+                or message["status"] in (204, 304)
+                or not content_type.startswith(COMPRESSIBLE_CONTENT_TYPES)
+            ):
+                self.is_passthrough = True
+                await self.send(message)
+                return
+            # The representation depends on Accept-Encoding, even if it is not compressed this time
+            MutableHeaders(raw=message["headers"]).add_vary_header("Accept-Encoding")
+            if self.encoding is None:
+                self.is_passthrough = True
+                await self.send(message)
+                return
+            self.start_message = message
+            return
+
+        if message["type"] != "http.response.body":
+            await self.send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if self.compressor is None:
+            if not more_body and len(body) < self.minimum_size:
+                # Small response, send it as is
+                await self.send(self.start_message)
+                await self.send(message)
+                self.is_passthrough = True
+                return
+            self.compressor = _Compressor(self.encoding, self.gzip_level, self.brotli_quality)
+            headers = MutableHeaders(raw=self.start_message["headers"])
+            headers["Content-Encoding"] = self.encoding
+            # Compressed bytes are a different representation, so a strong ETag is weakened
+            if "etag" in headers and not headers["etag"].startswith("W/"):
+                headers["ETag"] = f"W/{headers['etag']}"
+            if more_body:
+                del headers["Content-Length"]
+            else:
+                body = self.compressor.compress(body) + self.compressor.flush()
+                headers["Content-Length"] = str(len(body))
+                await self.send(self.start_message)
+                await self.send({"type": "http.response.body", "body": body})
+                return
+            await self.send(self.start_message)
+
+        compressed = self.compressor.compress(body)
+        if not more_body:
+            compressed += self.compressor.flush()
+        await self.send({"type": "http.response.body", "body": compressed, "more_body": more_body})
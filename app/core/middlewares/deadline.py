@@ -0,0 +1,71 @@
+import hmac
+
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from core.deadlines import deadline
+
+
+class DeadlineMiddleware:
+    """
+    Gives every request a deadline, the timeout of its route. The queries and the redis
+    calls of the request are bounded by the time left, so a stuck query can't hold a worker
+    and a pooled connection for longer. A caller can shorten its timeout with the timeout
+    header. Only an internal caller, sending the internal token, can lengthen it, up to max_timeout
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        timeout: float,
+        max_timeout: float,
+        header: str,
+        timeouts: dict[str, float] | None = None,
+        internal_token: str | None = None,
+        internal_token_header: str = "X-Internal-Token"
+    ):
+        self.app = app
+        self.timeout = timeout
+        self.max_timeout = max_timeout
+        self.header = header
+        # The longest prefix matches first
+        self.timeouts = sorted((timeouts or {}).items(), key=lambda item: len(item[0]), reverse=True)
+        self.internal_token = internal_token
+        self.internal_token_header = internal_token_header
+
+    def get_route_timeout(self, path: str) -> float:
+        for prefix, timeout in self.timeouts:
+            if path.startswith(prefix):
+                return timeout
+        return self.timeout
+
+    def is_internal(self, headers: Headers) -> bool:
+        token = headers.get(self.internal_token_header)
+        return bool(self.internal_token) and token is not None and hmac.compare_digest(
+            token.encode(), self.internal_token.encode()
+        )
+
+    def get_timeout(self, scope: Scope) -> float:
+        route_timeout = self.get_route_timeout(scope["path"])
+        headers = Headers(scope=scope)
+        requested_timeout = headers.get(self.header)
+        if requested_timeout is None:
+            return route_timeout
+        try:
+            timeout = float(requested_timeout)
+        except ValueError:
+            return route_timeout
+        if not timeout > 0:
+            return route_timeout
+        if self.is_internal(headers):
+            return min(timeout, self.max_timeout)
+        # Anyone else can only shorten it, so a client can't hold a pooled connection for longer
+        return min(timeout, route_timeout)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        with deadline(self.get_timeout(scope)):
+            await self.app(scope, receive, send)
@@ -0,0 +1,39 @@
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from core.database.query_counter import count_queries
+from core.logger import logger
+
+
+class QueryCounterMiddleware:
+    """
+    Counts the queries of every request and sends the count in the X-Query-Count header.
+    The requests over the query budget and the statements repeated at least
+    repeated_threshold times, the sign of a N+1 pattern, are logged. Meant for development
+    """
+
+    def __init__(self, app: ASGIApp, budget: int, repeated_threshold: int):
+        self.app = app
+        self.budget = budget
+        self.repeated_threshold = repeated_threshold
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        with count_queries() as query_counter:
+
+            async def send_wrapper(message: Message):
+                if message["type"] == "http.response.start":
+                    headers = MutableHeaders(raw=message["headers"])
+                    headers["X-Query-Count"] = str(query_counter.count)
+                await send(message)
+
+            await self.app(scope, receive, send_wrapper)
+
+        request = f"{scope['method']} {scope['path']}"
+        if query_counter.count > self.budget:
+            logger.warning(f"Query budget exceeded - {request} sent {query_counter.count} queries")
+        for fingerprint, count in query_counter.get_repeated(self.repeated_threshold).items():
+            logger.warning(f"Repeated query - {request} sent {count} times: {fingerprint}")
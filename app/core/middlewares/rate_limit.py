@@ -0,0 +1,29 @@
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+
+class RateLimitHeadersMiddleware:
+    """
+    Sends the RateLimit-Limit, RateLimit-Remaining and RateLimit-Reset headers for the
+    requests checked by the RateLimiter dependency
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        async def send_wrapper(message: Message):
+            if message["type"] == "http.response.start":
+                rate_limit = scope.get("state", {}).get("rate_limit")
+                if rate_limit is not None:
+                    headers = MutableHeaders(raw=message["headers"])
+                    headers["RateLimit-Limit"] = str(rate_limit.limit)
+                    headers["RateLimit-Remaining"] = str(rate_limit.remaining)
+                    headers["RateLimit-Reset"] = str(rate_limit.reset)
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
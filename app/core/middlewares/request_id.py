@@ -0,0 +1,41 @@
+import re
+import uuid
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from core.logger import request_id
+
+# An id set by a proxy is kept only if it is reasonably short and printable
+VALID_REQUEST_ID = re.compile(r"[\w.:-]{1,64}")
+
+
+class RequestIdMiddleware:
+    """
+    Gives every request an id, the X-Request-ID header of the request if any, sent back in the
+    X-Request-ID header of the response. The records logged while serving the request carry it
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        current_request_id = Headers(scope=scope).get("x-request-id", "")
+        if not VALID_REQUEST_ID.fullmatch(current_request_id):
+            current_request_id = uuid.uuid4().hex
+
+        async def send_wrapper(message: Message):
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(raw=message["headers"])
+                headers["X-Request-ID"] = current_request_id
+            await send(message)
+
+        token = request_id.set(current_request_id)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            request_id.reset(token)
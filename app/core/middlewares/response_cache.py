@@ -0,0 +1,151 @@
+import base64
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Any
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from core.caching.redis import RedisClient
+from core.responses import is_etag_matching
+
+
+class MemoryResponseStore:
+    """
+    A bounded, per-process LRU store for cached responses
+    """
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self.entries: OrderedDict[str, tuple[float, dict[str, Any]]] = OrderedDict()
+
+    async def get(self, key: str) -> dict[str, Any] | None:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: dict[str, Any], expire: int):
+        self.entries[key] = (time.monotonic() + expire, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+
+class RedisResponseStore:
+    """
+    A store for cached responses shared by all the workers
+    """
+
+    async def get(self, key: str) -> dict[str, Any] | None:
+        return await RedisClient().get_cache(key=key)
+
+    async def set(self, key: str, value: dict[str, Any], expire: int):
+        await RedisClient().set_cache(key=key, value=value, expire=expire)
+
+
+class ResponseCacheMiddleware:
+    """
+    Caches successful GET responses of the configured paths. Only paths whose response is the
+    same for every caller (anonymous-safe) should be configured. The cache key is built from
+    the path, the query string and the auth scope (a digest of the Authorization header),
+    so a request never gets a response cached for other credentials.
+    """
+
+    def __init__(self, app: ASGIApp, paths: dict[str, int], backend: str = "memory", max_entries: int = 1024):
+        self.app = app
+        # Exact path -> ttl in seconds
+        self.paths = paths
+        self.store = RedisResponseStore() if backend == "redis" else MemoryResponseStore(max_entries=max_entries)
+
+    @staticmethod
+    def get_cache_key(scope: Scope, headers: Headers) -> str:
+        authorization = headers.get("authorization")
+        auth_scope = hashlib.sha256(authorization.encode()).hexdigest() if authorization else "anonymous"
+        query_string = scope.get("query_string", b"").decode("latin-1")
+        digest = hashlib.sha256(f"{scope['path']}?{query_string}|{auth_scope}".encode()).hexdigest()
+        return f"response:{digest}"
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["method"] != "GET" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        headers = Headers(scope=scope)
+        if "no-cache" in headers.get("cache-control", ""):
+            await self.app(scope, receive, send)
+            return
+
+        cache_key = self.get_cache_key(scope, headers)
+        cached_response = await self.store.get(cache_key)
+        if cached_response:
+            await self.send_cached_response(cached_response, headers, send)
+            return
+
+        start_message: Message | None = None
+        body = bytearray()
+
+        async def send_wrapper(message: Message):
+            nonlocal start_message
+            if message["type"] == "http.response.start":
+                start_message = message
+                response_headers = MutableHeaders(raw=message["headers"])
+                response_headers["X-Cache"] = "MISS"
+                response_headers.add_vary_header("Authorization")
+            elif message["type"] == "http.response.body" and start_message is not None:
+                body.extend(message.get("body", b""))
+                if not message.get("more_body", False):
+                    await self.store_response(cache_key, scope["path"], start_message, bytes(body))
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+    async def store_response(self, cache_key: str, path: str, start_message: Message, body: bytes):
+        """
+        Stores the response if it is cacheable
+        """
+        response_headers = Headers(raw=start_message["headers"])
+        if (
+            start_message["status"] != 200
+            or "set-cookie" in response_headers
+            or "content-encoding" in response_headers
+            or any(
+                directive in response_headers.get("cache-control", "")
+                for directive in ("no-store", "private")
+            )
+        ):
+            return
+        value = {
+            "status": start_message["status"],
+            "headers": [
+                [key.decode("latin-1"), value.decode("latin-1")]
+                for key, value in start_message["headers"]
+                if key.lower() != b"x-cache"
+            ],
+            "body": base64.b64encode(body).decode("ascii")
+        }
+        await self.store.set(cache_key, value, expire=self.paths[path])
+
+    @staticmethod
+    async def send_cached_response(cached_response: dict, request_headers: Headers, send: Send):
+        """
+        Sends the cached response. A matching If-None-Match is answered with 304
+        """
+        raw_headers = [(key.encode("latin-1"), value.encode("latin-1")) for key, value in cached_response["headers"]]
+        response_headers = MutableHeaders(raw=raw_headers)
+        response_headers["X-Cache"] = "HIT"
+        etag = response_headers.get("etag")
+        if etag and is_etag_matching(if_none_match=request_headers.get("if-none-match"), etag=etag):
+            del response_headers["Content-Length"]
+            del response_headers["Content-Type"]
+            await send({"type": "http.response.start", "status": 304, "headers": raw_headers})
+            await send({"type": "http.response.body", "body": b""})
+            return
+        await send({"type": "http.response.start", "status": cached_response["status"], "headers": raw_headers})
+        await send({"type": "http.response.body", "body": base64.b64decode(cached_response["body"])})
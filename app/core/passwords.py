@@ -0,0 +1,155 @@
+import asyncio
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from core.config import get_config
+
+config = get_config()
+
+PASSWORD_HASH_ALGORITHM = "scrypt"
+# 16 MiB of memory and a few tens of milliseconds of CPU per hash. The parameters are
+# stored along with every hash, so they can be raised later without breaking old hashes
+SCRYPT_N = 2 ** 14
+SCRYPT_R = 8
+SCRYPT_P = 1
+SALT_SIZE = 16
+KEY_SIZE = 32
+
+# hashlib.scrypt releases the GIL, so the hashes run in parallel on these threads while
+# the event loop keeps serving other requests. The threads are started on first use,
+# so they are not shared with the forked workers of a preloaded app
+PASSWORD_HASHER = ThreadPoolExecutor(
+    max_workers=config.auth.password_hash_workers,
+    thread_name_prefix="password-hasher"
+)
+
+
+def _encode(value: bytes) -> str:
+    return base64.b64encode(value).decode("ascii")
+
+
+def _scrypt(password: str, salt: bytes, n: int, r: int, p: int) -> bytes:
+    return hashlib.scrypt(
+        password.encode("utf8"), salt=salt, n=n, r=r, p=p, maxmem=2 * 128 * n * r * p, dklen=KEY_SIZE
+    )
+
+
+def hash_password(password: str) -> str:
+    """
+    Hashes the password with a random salt. The result looks like
+    scrypt$<n>$<r>$<p>$<salt>$<hash>
+    """
+    salt = os.urandom(SALT_SIZE)
+    key = _scrypt(password, salt, SCRYPT_N, SCRYPT_R, SCRYPT_P)
+    return "$".join(
+        [PASSWORD_HASH_ALGORITHM, str(SCRYPT_N), str(SCRYPT_R), str(SCRYPT_P), _encode(salt), _encode(key)]
+    )
+
+
+def is_password_hashed(password_hash: str) -> bool:
+    return password_hash.startswith(f"{PASSWORD_HASH_ALGORITHM}$")
+
+
+def needs_rehash(password_hash: str) -> bool:
+    """
+    Returns True for the plaintext passwords stored before hashing was introduced
+    and for the hashes made with weaker parameters than the current ones
+    """
+    if not is_password_hashed(password_hash):
+        return True
+    try:
+        _, n, r, p, _, _ = password_hash.split("$")
+        return (int(n), int(r), int(p)) != (SCRYPT_N, SCRYPT_R, SCRYPT_P)
+    except ValueError:
+        return True
+
+
+def check_password(password: str, password_hash: str) -> bool:
+    """
+    Verifies the password against the stored hash. It is CPU bound, so it should not be
+    called from the event loop. Use verify_password instead
+    """
+    if not is_password_hashed(password_hash):
+        # Plaintext password, not yet migrated. Uses compare digest from secrets to prevent timing analysis
+        return secrets.compare_digest(password.encode("utf8"), password_hash.encode("utf8"))
+    # A malformed hash, e.g. with a bad cost, fails the verification instead of the request
+    try:
+        _, n, r, p, salt, key = password_hash.split("$")
+        salt, key = base64.b64decode(salt), base64.b64decode(key)
+        return secrets.compare_digest(_scrypt(password, salt, int(n), int(r), int(p)), key)
+    except (ValueError, TypeError, OverflowError):
+        return False
+
+
+class VerifiedCredentialCache:
+    """
+    A bounded, per-process LRU of the recently verified credentials, so a client sending
+    its password on every request doesn't pay for a hash every time. Only a keyed digest of
+    the password and its stored hash is kept, never the password. Since the stored hash is
+    part of the key, a password change invalidates the entry.
+    """
+
+    def __init__(self, max_entries: int, ttl: int):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries: OrderedDict[bytes, float] = OrderedDict()
+
+    @staticmethod
+    def get_key(password: str, password_hash: str) -> bytes:
+        return hmac.digest(
+            config.auth.secret_key.encode("utf8"),
+            f"{password_hash}\0{password}".encode("utf8"),
+            "sha256"
+        )
+
+    def is_verified(self, password: str, password_hash: str) -> bool:
+        key = self.get_key(password, password_hash)
+        expires_at = self.entries.get(key)
+        if expires_at is None:
+            return False
+        if expires_at < time.monotonic():
+            del self.entries[key]
+            return False
+        self.entries.move_to_end(key)
+        return True
+
+    def add(self, password: str, password_hash: str):
+        key = self.get_key(password, password_hash)
+        self.entries[key] = time.monotonic() + self.ttl
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+
+verified_credentials = VerifiedCredentialCache(
+    max_entries=config.auth.credential_cache_size,
+    ttl=config.auth.credential_cache_ttl
+)
+
+
+async def verify_password(password: str, password_hash: str) -> bool:
+    """
+    Verifies the password on the hasher threads. Recently verified credentials are
+    answered from the cache without hashing
+    """
+    if verified_credentials.is_verified(password, password_hash):
+        return True
+    loop = asyncio.get_running_loop()
+    is_correct_password = await loop.run_in_executor(PASSWORD_HASHER, check_password, password, password_hash)
+    if is_correct_password:
+        verified_credentials.add(password, password_hash)
+    return is_correct_password
+
+
+async def make_password_hash(password: str) -> str:
+    """
+    Hashes the password on the hasher threads
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(PASSWORD_HASHER, hash_password, password)
@@ -1,14 +1,56 @@
 from typing import Any
 from fastapi.responses import JSONResponse
+from starlette import status
+from starlette.responses import Response
 
+from core.config import get_config
 from core.schemas import ResponseSchema, Meta
 
+config = get_config()
+
 
 def generate_json_response(
     message: str,
     status_code: int,
-    data: dict[str, Any] | None = None
+    data: dict[str, Any] | None = None,
+    headers: dict[str, str] | None = None
 ) -> JSONResponse:
     meta = Meta(message=message)
     response = ResponseSchema(meta=meta, data=data)
-    return JSONResponse(content=response.model_dump(exclude_none=True), status_code=status_code)
+    return JSONResponse(content=response.model_dump(exclude_none=True), status_code=status_code, headers=headers)
+
+
+def generate_etag(book_id: str, version: int, representation: str) -> str:
+    """
+    Generates a strong ETag for a representation derived from a book version. The
+    representations of the same book version, e.g. its reviews and its summary, get different ETags
+    """
+    return f'"{book_id}-{representation}-{version}"'
+
+
+def is_etag_matching(if_none_match: str | None, etag: str) -> bool:
+    """
+    Checks if the If-None-Match header of the request matches the ETag
+    """
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        # Weak comparison is used for If-None-Match
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
+
+
+def generate_cache_headers(etag: str) -> dict[str, str]:
+    """
+    Generates the caching headers for a response with the ETag
+    """
+    return {"ETag": etag, "Cache-Control": config.cache_control}
+
+
+def generate_not_modified_response(etag: str) -> Response:
+    """
+    Generates a 304 response without a body
+    """
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=generate_cache_headers(etag=etag))
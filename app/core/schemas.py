@@ -14,6 +14,19 @@ class BookSchema(BaseModel):
     genre: str = Field(min_length=1)
     year_published: int = Field(gt=1000, le=date.today().year)
     id: SkipJsonSchema[str | None] = None
+    version: SkipJsonSchema[int | None] = None
+
+
+class BookUpdateSchema(BaseModel):
+    """
+    Payload for partial updates. Only the provided fields are updated.
+    """
+    model_config = ConfigDict(str_strip_whitespace=True)
+
+    title: str | None = Field(default=None, min_length=1)
+    author: str | None = Field(default=None, min_length=1)
+    genre: str | None = Field(default=None, min_length=1)
+    year_published: int | None = Field(default=None, gt=1000, le=date.today().year)
 
 
 class ReviewSchema(BaseModel):
@@ -28,7 +41,8 @@ class UserSchema(BaseModel):
     model_config = ConfigDict(from_attributes=True)
 
     username: str
-    password: str
+    # Not available when the user is taken from an access token
+    password: str | None = None
     id: str
 
 
@@ -0,0 +1,108 @@
+import time
+import uuid
+from typing import Any
+
+import jwt
+import redis.asyncio as redis
+from starlette import status
+
+from core.caching.redis import get_redis_connection
+from core.config import get_config
+from core.exceptions import HTTPException
+from core.logger import logger
+from core.schemas import UserSchema
+
+config = get_config()
+
+REVOKED_TOKENS_KEY = "revoked_tokens"
+
+
+def create_access_token(user: UserSchema) -> tuple[str, int]:
+    """
+    Creates a signed access token for the user. Returns the token and its lifetime in seconds
+    """
+    issued_at = int(time.time())
+    claims = {
+        "sub": user.id,
+        "username": user.username,
+        "jti": uuid.uuid4().hex,
+        "iat": issued_at,
+        "exp": issued_at + config.auth.access_token_ttl,
+    }
+    token = jwt.encode(claims, config.auth.secret_key, algorithm=config.auth.algorithm)
+    return token, config.auth.access_token_ttl
+
+
+def decode_access_token(token: str) -> dict[str, Any]:
+    """
+    Verifies the signature and the expiry of an access token and returns its claims
+    """
+    try:
+        return jwt.decode(
+            token,
+            config.auth.secret_key,
+            algorithms=[config.auth.algorithm],
+            options={"require": ["sub", "username", "jti", "exp"]}
+        )
+    except jwt.ExpiredSignatureError:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, message="Token has expired")
+    except jwt.InvalidTokenError:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, message="Invalid token")
+
+
+class TokenRevocationList:
+    """
+    The ids of the revoked (logged out) tokens are kept in a redis sorted set scored by
+    their expiry, so the set only holds tokens that would still be valid. Every worker
+    keeps a copy of the set and refreshes it periodically. So, checking a token doesn't
+    need a round trip to redis, and a logout reaches all the workers within the refresh interval.
+    """
+
+    def __init__(self):
+        self.revoked_tokens: set[str] = set()
+        self.refreshed_at = float("-inf")
+
+    async def refresh(self):
+        """
+        Drops the expired entries and reloads the set from redis
+        """
+        # Set before the round trip, so that concurrent requests don't refresh as well
+        self.refreshed_at = time.monotonic()
+        try:
+            async with get_redis_connection().pipeline(transaction=False) as pipe:
+                pipe.zremrangebyscore(REVOKED_TOKENS_KEY, "-inf", int(time.time()))
+                pipe.zrange(REVOKED_TOKENS_KEY, 0, -1)
+                _, revoked_tokens = await pipe.execute()
+            self.revoked_tokens = set(revoked_tokens)
+        except redis.RedisError as er:
+            # The last known set is used until redis is back
+            logger.info(f"Redis error - {er}")
+
+    async def is_revoked(self, token_id: str) -> bool:
+        if time.monotonic() - self.refreshed_at > config.auth.revocation_refresh_interval:
+            await self.refresh()
+        return token_id in self.revoked_tokens
+
+    async def revoke(self, token_id: str, expires_at: int):
+        self.revoked_tokens.add(token_id)
+        try:
+            await get_redis_connection().zadd(REVOKED_TOKENS_KEY, {token_id: expires_at})
+        except redis.RedisError as er:
+            logger.info(f"Redis error - {er}")
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                message="Logout is not available right now"
+            )
+
+
+revocation_list = TokenRevocationList()
+
+
+async def get_user_from_token(token: str) -> UserSchema:
+    """
+    Returns the user of a valid access token. No DB query is made
+    """
+    claims = decode_access_token(token)
+    if await revocation_list.is_revoked(claims["jti"]):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, message="Token has been revoked")
+    return UserSchema(id=claims["sub"], username=claims["username"])
@@ -0,0 +1,99 @@
+import asyncio
+import time
+
+import pytest
+import pytest_asyncio
+from sqlalchemy import func, select
+
+from core.database.base import get_async_session
+from core.deadlines import deadline
+from core.exceptions import HTTPException
+from core.helpers.db_helper import DbHelper
+from core.middlewares.deadline import DeadlineMiddleware
+
+
+@pytest_asyncio.fixture(scope='session')
+def event_loop(request):
+    """Create an instance of the default event loop for each test case."""
+    loop = asyncio.get_event_loop_policy().new_event_loop()
+    yield loop
+    loop.close()
+
+
+@pytest_asyncio.fixture(scope="function")
+async def db_session():
+    session_object = get_async_session()()
+    yield session_object
+    await session_object.close()
+
+
+def get_scope(path: str, headers: dict[str, str]) -> dict:
+    return {
+        "type": "http",
+        "path": path,
+        "headers": [(name.lower().encode(), value.encode()) for name, value in headers.items()]
+    }
+
+
+def test_request_timeout():
+    deadline_middleware = DeadlineMiddleware(
+        app=None,
+        timeout=10,
+        max_timeout=30,
+        header="X-Request-Timeout",
+        timeouts={"/api/v1/generate-summary": 20},
+        internal_token="test-internal-token"
+    )
+    assert deadline_middleware.get_timeout(get_scope("/api/v1/books", {})) == 10
+    assert deadline_middleware.get_timeout(get_scope("/api/v1/generate-summary", {})) == 20
+
+    # anyone can shorten the timeout of the route
+    assert deadline_middleware.get_timeout(get_scope("/api/v1/books", {"X-Request-Timeout": "2.5"})) == 2.5
+    # but only an internal caller can lengthen it, up to max_timeout
+    assert deadline_middleware.get_timeout(get_scope("/api/v1/books", {"X-Request-Timeout": "20"})) == 10
+    assert deadline_middleware.get_timeout(get_scope(
+        "/api/v1/books", {"X-Request-Timeout": "20", "X-Internal-Token": "invalid-token"}
+    )) == 10
+    assert deadline_middleware.get_timeout(get_scope(
+        "/api/v1/books", {"X-Request-Timeout": "20", "X-Internal-Token": "test-internal-token"}
+    )) == 20
+    assert deadline_middleware.get_timeout(get_scope(
+        "/api/v1/books", {"X-Request-Timeout": "60", "X-Internal-Token": "test-internal-token"}
+    )) == 30
+
+    # an invalid timeout is ignored
+    for requested_timeout in ["abc", "0", "-1", "nan"]:
+        assert deadline_middleware.get_timeout(
+            get_scope("/api/v1/books", {"X-Request-Timeout": requested_timeout})
+        ) == 10
+
+    # without an internal token configured, nobody can lengthen it
+    deadline_middleware.internal_token = None
+    assert deadline_middleware.get_timeout(get_scope(
+        "/api/v1/books", {"X-Request-Timeout": "20", "X-Internal-Token": ""}
+    )) == 10
+
+
+@pytest.mark.asyncio
+async def test_deadline_exceeded_before_query(db_session):
+    db_helper = DbHelper(db_session)
+    with deadline(0):
+        with pytest.raises(HTTPException) as he:
+            await db_helper.get_book(filters={"id": "test_book"})
+    assert he.value.status_code == 504
+    assert he.value.message == "Request deadline exceeded"
+    # no connection is checked out for it
+    assert not db_session.info.get("checkouts")
+
+
+@pytest.mark.asyncio
+async def test_statement_timeout(db_session):
+    db_helper = DbHelper(db_session)
+    started_at = time.monotonic()
+    # the query is cancelled by the server, with SQLSTATE 57014, once the deadline has passed
+    with deadline(0.5):
+        with pytest.raises(HTTPException) as he:
+            await db_helper.execute_query(select(func.pg_sleep(5)))
+    assert he.value.status_code == 504
+    assert he.value.message == "Request deadline exceeded"
+    assert time.monotonic() - started_at < 2
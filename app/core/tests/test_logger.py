@@ -0,0 +1,78 @@
+import io
+import json
+import logging
+
+import pytest
+
+from core.logger import CommonLogger, LogPipeline, RepeatedMessageFilter, request_id
+
+
+@pytest.fixture(scope="function")
+def log_output():
+    """
+    Yields a JSON logger writing to a buffer, and a function returning the records written so far
+    """
+    pipeline = LogPipeline(log_format="json", queue_size=100)
+    output = io.StringIO()
+    pipeline.output_handler.setStream(output)
+    pipeline.start()
+    json_logger = CommonLogger(name="test_logger", pipeline=pipeline)
+
+    def get_records() -> list[dict]:
+        # Writes the queued records
+        pipeline.stop()
+        pipeline.start()
+        return [json.loads(line) for line in output.getvalue().splitlines()]
+
+    yield json_logger, get_records
+    pipeline.stop()
+
+
+def test_json_log_fields(log_output):
+    json_logger, get_records = log_output
+    json_logger.info("Book %s is fetched", "test_book")
+    token = request_id.set("test-request-id")
+    try:
+        json_logger.warning("Within a request")
+    finally:
+        request_id.reset(token)
+    try:
+        raise ValueError("Invalid value")
+    except ValueError:
+        json_logger.exception("Something failed")
+    json_logger.debug("Below the level")
+
+    records = get_records()
+    assert len(records) == 3
+    # one JSON object per line, with the rendered message
+    assert records[0].keys() == {"time", "level", "message", "process"}
+    assert records[0]["level"] == "INFO"
+    assert records[0]["message"] == "Book test_book is fetched"
+    assert isinstance(records[0]["process"], int)
+
+    # the records logged while serving a request carry its id
+    assert records[1]["level"] == "WARNING"
+    assert records[1]["request_id"] == "test-request-id"
+
+    assert records[2]["level"] == "ERROR"
+    assert "request_id" not in records[2]
+    assert records[2]["exception"].startswith("Traceback")
+    assert "ValueError: Invalid value" in records[2]["exception"]
+
+
+def test_json_log_suppressed_count(log_output):
+    json_logger, get_records = log_output
+    # no more than burst records of the same message per interval
+    repeated_message_filter = RepeatedMessageFilter(interval=60, burst=2)
+    json_logger.filters = [repeated_message_filter]
+    for _ in range(5):
+        json_logger.error("Redis error - Connection refused")
+    # the next interval
+    repeated_message_filter.messages[(logging.ERROR, "Redis error - Connection refused")][0] -= 60
+    json_logger.error("Redis error - Connection refused")
+
+    records = get_records()
+    assert len(records) == 3
+    assert "suppressed" not in records[0]
+    # the records suppressed are counted on the next one let through
+    assert records[2]["suppressed"] == 3
@@ -0,0 +1,26 @@
+"""
+Gunicorn configuration for running the service in production:
+    gunicorn main:application -c gunicorn.conf.py
+"""
+import multiprocessing
+
+from core.config import get_config
+
+# "config" is a gunicorn setting itself, so the server config gets another name
+server_config = get_config().server
+
+bind = f"{server_config.host}:{server_config.port}"
+workers = server_config.workers or multiprocessing.cpu_count()
+worker_class = "core.workers.ProductionUvicornWorker"
+
+# The application is imported once in the master and the workers are forked afterwards.
+# It makes the startup faster and the imported modules are shared between the workers.
+# No connection is opened at import time, the pools are created in every worker on first use.
+preload_app = True
+
+graceful_timeout = server_config.graceful_timeout
+timeout = server_config.timeout
+keepalive = server_config.keepalive
+
+accesslog = "-"
+errorlog = "-"
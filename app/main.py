@@ -1,25 +1,118 @@
+import asyncio
+from contextlib import asynccontextmanager, suppress
+
 from fastapi import FastAPI
 from fastapi.exceptions import RequestValidationError, HTTPException as FastAPIHTTPException
 from starlette import status
-from starlette.responses import JSONResponse
+from starlette.responses import JSONResponse, PlainTextResponse
 from starlette.requests import Request
 
+from api.v1.books.cache_invalidator import BookCacheInvalidator
+from api.v1.books.cache_warmer import warm_book_cache_on_startup
+from api.v1.leaderboards.reconciler import reconcile_leaderboards_periodically
 from api.v1.routes import v1_router
+from core.caching.access_counter import book_access_counter
+from core.caching.redis import close_redis_connection, retry_pending_invalidations_periodically
+from core.config import get_config
+from core.database.base import dispose_async_engine
+from core.database.replicas import dispose_replica_engines
 from core.exceptions import HTTPException
+from core.metrics import render_metrics
+from core.middlewares.compression import CompressionMiddleware
+from core.middlewares.deadline import DeadlineMiddleware
+from core.middlewares.query_counter import QueryCounterMiddleware
+from core.middlewares.rate_limit import RateLimitHeadersMiddleware
+from core.middlewares.request_id import RequestIdMiddleware
+from core.middlewares.response_cache import ResponseCacheMiddleware
 from core.responses import generate_json_response
 
-application = FastAPI(debug=True)
+config = get_config()
+
+
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+    """
+    Pools are created lazily on first use. The cache is warmed and the leaderboards are
+    rebuilt in the background, so the startup is not delayed. The DB notifications of the
+    changed books are listened to in the background as well. On shutdown, the server stops
+    accepting new connections and drains the in-flight requests before this cleanup runs
+    """
+    background_tasks = [asyncio.create_task(retry_pending_invalidations_periodically())]
+    if config.cache_warmer.enabled:
+        background_tasks.append(asyncio.create_task(warm_book_cache_on_startup()))
+    if config.cache_invalidation.enabled:
+        background_tasks.append(asyncio.create_task(BookCacheInvalidator().run()))
+    if config.leaderboards.enabled:
+        background_tasks.append(asyncio.create_task(reconcile_leaderboards_periodically()))
+    yield
+    for task in background_tasks:
+        task.cancel()
+        with suppress(asyncio.CancelledError):
+            await task
+    await book_access_counter.flush()
+    await dispose_async_engine()
+    await dispose_replica_engines()
+    await close_redis_connection()
+
+
+application = FastAPI(debug=config.server.debug, lifespan=lifespan)
 
 
 application.include_router(v1_router)
 
 
+@application.get("/metrics", include_in_schema=False)
+async def get_metrics() -> PlainTextResponse:
+    """
+    Exposes the metrics of this worker in the Prometheus text format
+    """
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+application.add_middleware(RateLimitHeadersMiddleware)
+if config.database.query_counter_enabled:
+    application.add_middleware(
+        QueryCounterMiddleware,
+        budget=config.database.query_budget,
+        repeated_threshold=config.database.repeated_query_threshold
+    )
+# The middleware added last runs first. So, the response cache stores uncompressed
+# responses and compression is applied to both cached and fresh responses
+if config.response_cache.enabled:
+    application.add_middleware(
+        ResponseCacheMiddleware,
+        paths=config.response_cache.paths,
+        backend=config.response_cache.backend,
+        max_entries=config.response_cache.max_entries
+    )
+if config.compression.enabled:
+    application.add_middleware(
+        CompressionMiddleware,
+        minimum_size=config.compression.minimum_size,
+        gzip_level=config.compression.gzip_level,
+        brotli_quality=config.compression.brotli_quality,
+        minimum_sizes=config.compression.minimum_sizes,
+        exclude_paths=config.compression.exclude_paths
+    )
+if config.deadlines.enabled:
+    application.add_middleware(
+        DeadlineMiddleware,
+        timeout=config.deadlines.timeout,
+        max_timeout=config.deadlines.max_timeout,
+        header=config.deadlines.header,
+        timeouts=config.deadlines.timeouts,
+        internal_token=config.deadlines.internal_token,
+        internal_token_header=config.deadlines.internal_token_header
+    )
+# Outermost, so the records logged by the other middlewares carry the request id as well
+application.add_middleware(RequestIdMiddleware)
+
+
 @application.exception_handler(HTTPException)
 async def return_error_response(_: Request, exc: HTTPException) -> JSONResponse:
     """
     It handles HTTPException
     """
-    return generate_json_response(message=exc.message, status_code=exc.status_code)
+    return generate_json_response(message=exc.message, status_code=exc.status_code, headers=exc.headers)
 
 
 @application.exception_handler(FastAPIHTTPException)
@@ -27,7 +120,7 @@ async def return_error_response(_: Request, exc: HTTPException) -> JSONResponse:
     """
     It handles HTTPException
     """
-    return generate_json_response(message=exc.detail, status_code=exc.status_code)
+    return generate_json_response(message=exc.detail, status_code=exc.status_code, headers=exc.headers)
 
 
 @application.exception_handler(RequestValidationError)
@@ -0,0 +1,73 @@
+"""add book rating histogram
+
+Revision ID: 5d9c2e7a4b18
+Revises: 8b2e4c6d1f03
+Create Date: 2026-10-19 16:41:09.274530
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5d9c2e7a4b18'
+down_revision: Union[str, None] = '8b2e4c6d1f03'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Moves a review in and out of the half star bucket of its rating. The buckets are
+# 1-based, so a rating r is counted in the bucket r * 2 + 1. It also covers the reviews
+# deleted along with their user. The reviews deleted along with their book update nothing.
+UPDATE_RATING_HISTOGRAM_FUNCTION = """
+CREATE FUNCTION update_rating_histogram() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('DELETE', 'UPDATE') THEN
+        UPDATE books
+        SET rating_histogram[round(OLD.rating * 2)::int + 1] = rating_histogram[round(OLD.rating * 2)::int + 1] - 1
+        WHERE id = OLD.book_id;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        UPDATE books
+        SET rating_histogram[round(NEW.rating * 2)::int + 1] = rating_histogram[round(NEW.rating * 2)::int + 1] + 1
+        WHERE id = NEW.book_id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql
+"""
+
+
+def upgrade() -> None:
+    op.add_column(
+        'books',
+        sa.Column(
+            'rating_histogram',
+            postgresql.ARRAY(sa.Integer()),
+            server_default=sa.text("'{0,0,0,0,0,0,0,0,0,0,0}'"),
+            nullable=False
+        )
+    )
+    op.execute(UPDATE_RATING_HISTOGRAM_FUNCTION)
+    op.execute(
+        "CREATE TRIGGER reviews_rating_histogram AFTER INSERT OR DELETE OR UPDATE OF rating, book_id ON reviews "
+        "FOR EACH ROW EXECUTE FUNCTION update_rating_histogram()"
+    )
+    # The existing reviews
+    op.execute("""
+        UPDATE books SET rating_histogram = ARRAY(
+            SELECT count(reviews.id)
+            FROM generate_series(0, 10) AS bucket
+            LEFT JOIN reviews ON reviews.book_id = books.id AND round(reviews.rating * 2) = bucket
+            GROUP BY bucket
+            ORDER BY bucket
+        )
+    """)
+
+
+def downgrade() -> None:
+    op.execute("DROP TRIGGER reviews_rating_histogram ON reviews")
+    op.execute("DROP FUNCTION update_rating_histogram()")
+    op.drop_column('books', 'rating_histogram')
@@ -0,0 +1,71 @@
+"""hash user passwords
+
+Revision ID: 8b2e4c6d1f03
+Revises: 3f1a9d2b7c41
+Create Date: 2026-10-19 13:02:17.318245
+
+"""
+import base64
+import hashlib
+import os
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8b2e4c6d1f03'
+down_revision: Union[str, None] = '3f1a9d2b7c41'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# A copy of the hashing of core.passwords as of this revision, so the migration gives the
+# same result whatever the app code becomes. The parameters are stored with every hash,
+# so the app rehashes them on login if its parameters are raised later
+SCRYPT_N = 2 ** 14
+SCRYPT_R = 8
+SCRYPT_P = 1
+SALT_SIZE = 16
+KEY_SIZE = 32
+
+
+def hash_password(password: str) -> str:
+    """
+    Hashes the password with a random salt, as scrypt$<n>$<r>$<p>$<salt>$<hash>
+    """
+    salt = os.urandom(SALT_SIZE)
+    key = hashlib.scrypt(
+        password.encode("utf8"),
+        salt=salt,
+        n=SCRYPT_N,
+        r=SCRYPT_R,
+        p=SCRYPT_P,
+        maxmem=2 * 128 * SCRYPT_N * SCRYPT_R * SCRYPT_P,
+        dklen=KEY_SIZE
+    )
+    return "$".join([
+        "scrypt",
+        str(SCRYPT_N),
+        str(SCRYPT_R),
+        str(SCRYPT_P),
+        base64.b64encode(salt).decode("ascii"),
+        base64.b64encode(key).decode("ascii")
+    ])
+
+
+def upgrade() -> None:
+    connection = op.get_bind()
+    users = connection.execute(sa.text("SELECT id, password FROM users")).all()
+    for user_id, password in users:
+        if password.startswith("scrypt$"):
+            continue
+        connection.execute(
+            sa.text("UPDATE users SET password = :password WHERE id = :id"),
+            {"password": hash_password(password), "id": user_id}
+        )
+
+
+def downgrade() -> None:
+    # The plaintext passwords can't be recovered from the hashes
+    pass
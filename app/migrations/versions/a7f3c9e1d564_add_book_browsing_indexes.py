@@ -0,0 +1,92 @@
+"""add book browsing indexes
+
+Revision ID: a7f3c9e1d564
+Revises: 5d9c2e7a4b18
+Create Date: 2026-10-19 18:05:52.613904
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a7f3c9e1d564'
+down_revision: Union[str, None] = '5d9c2e7a4b18'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+REVIEW_COUNT = " + ".join(f"rating_histogram[{bucket + 1}]" for bucket in range(11))
+RATING_SUM = " + ".join(f"rating_histogram[{bucket + 1}] * {bucket / 2}" for bucket in range(1, 11))
+AVERAGE_RATING = f"CASE WHEN {REVIEW_COUNT} = 0 THEN 0 ELSE (({RATING_SUM}) / ({REVIEW_COUNT}))::double precision END"
+
+# Keeps the average rating of a book from its histogram. A plain column kept by a trigger is
+# added without rewriting the table, unlike a stored generated column, which would hold an
+# ACCESS EXCLUSIVE lock on the books for the whole rewrite
+SET_AVERAGE_RATING_FUNCTION = f"""
+CREATE FUNCTION set_average_rating() RETURNS trigger AS $$
+BEGIN
+    NEW.average_rating := {AVERAGE_RATING.replace("rating_histogram", "NEW.rating_histogram")};
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql
+"""
+
+# The existing books are filled in batches, each in a transaction of its own, so the rows
+# of a batch are only locked for a short time
+BACKFILL_BATCH_SIZE = 10000
+BACKFILL_BATCH = f"""
+WITH batch AS (
+    SELECT id FROM books WHERE id > :last_id ORDER BY id LIMIT {BACKFILL_BATCH_SIZE}
+)
+UPDATE books SET average_rating = {AVERAGE_RATING}
+FROM batch WHERE books.id = batch.id
+RETURNING books.id
+"""
+
+INDEXES = {
+    "ix_books_genre_title": ["genre", "title", "id"],
+    "ix_books_genre_year_published": ["genre", "year_published", "id"],
+    "ix_books_genre_average_rating": ["genre", "average_rating", "id"],
+    "ix_books_author_title": ["author", "title", "id"],
+    "ix_books_author_year_published": ["author", "year_published", "id"],
+    "ix_books_title": ["title", "id"],
+    "ix_books_year_published": ["year_published", "id"],
+    "ix_books_average_rating": ["average_rating", "id"],
+}
+
+
+def upgrade() -> None:
+    # A constant default only changes the catalog, the rows aren't rewritten
+    op.add_column(
+        'books',
+        sa.Column('average_rating', sa.Float(), nullable=False, server_default=sa.text("0"))
+    )
+    op.execute(SET_AVERAGE_RATING_FUNCTION)
+    # Created before the backfill, so the books written meanwhile are already kept
+    op.execute(
+        "CREATE TRIGGER books_set_average_rating BEFORE INSERT OR UPDATE OF rating_histogram ON books "
+        "FOR EACH ROW EXECUTE FUNCTION set_average_rating()"
+    )
+    with op.get_context().autocommit_block():
+        connection = op.get_bind()
+        last_id = ""
+        while True:
+            book_ids = connection.execute(sa.text(BACKFILL_BATCH), {"last_id": last_id}).scalars().all()
+            if not book_ids:
+                break
+            last_id = max(book_ids)
+    # Built without locking the writes to the books
+    with op.get_context().autocommit_block():
+        for name, columns in INDEXES.items():
+            op.create_index(name, 'books', columns, postgresql_concurrently=True, if_not_exists=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name in INDEXES:
+            op.drop_index(name, table_name='books', postgresql_concurrently=True, if_exists=True)
+    op.execute("DROP TRIGGER books_set_average_rating ON books")
+    op.execute("DROP FUNCTION set_average_rating()")
+    op.drop_column('books', 'average_rating')
@@ -0,0 +1,35 @@
+"""add book search index
+
+Revision ID: b3c7e1a9d5f4
+Revises: e4b8d2f6a913
+Create Date: 2026-10-19 21:14:52.730418
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b3c7e1a9d5f4'
+down_revision: Union[str, None] = 'e4b8d2f6a913'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Same expression as BOOK_SEARCH_DOCUMENT of the models, so the search queries use the index
+BOOK_SEARCH_DOCUMENT = (
+    "setweight(to_tsvector('english', title), 'A') || setweight(to_tsvector('english', summary), 'B')"
+)
+
+
+def upgrade() -> None:
+    # Built without locking the writes to the books
+    with op.get_context().autocommit_block():
+        op.execute(
+            f"CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_books_search ON books USING gin (({BOOK_SEARCH_DOCUMENT}))"
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS ix_books_search")
@@ -0,0 +1,63 @@
+"""notify book changes
+
+Revision ID: e4b8d2f6a913
+Revises: a7f3c9e1d564
+Create Date: 2026-10-19 19:12:37.518204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e4b8d2f6a913'
+down_revision: Union[str, None] = 'a7f3c9e1d564'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Sends the id of every changed book on the cache_invalidation channel, whoever made the
+# change, so the app can drop its cached entries. The payload is "books:<id>" if the
+# change can alter the book lists, i.e. a book is added, removed or one of its filtered
+# columns changed, and "book:<id>" otherwise. Postgres sends identical notifications of
+# a transaction only once, on commit.
+NOTIFY_BOOK_CHANGE_FUNCTION = """
+CREATE FUNCTION notify_book_change() RETURNS trigger AS $$
+BEGIN
+    IF TG_TABLE_NAME = 'reviews' THEN
+        IF TG_OP IN ('DELETE', 'UPDATE') THEN
+            PERFORM pg_notify('cache_invalidation', 'book:' || OLD.book_id);
+        END IF;
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            PERFORM pg_notify('cache_invalidation', 'book:' || NEW.book_id);
+        END IF;
+    ELSIF TG_OP = 'DELETE' THEN
+        PERFORM pg_notify('cache_invalidation', 'books:' || OLD.id);
+    ELSIF TG_OP = 'INSERT' OR (OLD.title, OLD.author, OLD.genre, OLD.year_published)
+            IS DISTINCT FROM (NEW.title, NEW.author, NEW.genre, NEW.year_published) THEN
+        PERFORM pg_notify('cache_invalidation', 'books:' || NEW.id);
+    ELSE
+        PERFORM pg_notify('cache_invalidation', 'book:' || NEW.id);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql
+"""
+
+
+def upgrade() -> None:
+    op.execute(NOTIFY_BOOK_CHANGE_FUNCTION)
+    op.execute(
+        "CREATE TRIGGER books_notify_change AFTER INSERT OR DELETE OR UPDATE ON books "
+        "FOR EACH ROW EXECUTE FUNCTION notify_book_change()"
+    )
+    op.execute(
+        "CREATE TRIGGER reviews_notify_change AFTER INSERT OR DELETE OR UPDATE ON reviews "
+        "FOR EACH ROW EXECUTE FUNCTION notify_book_change()"
+    )
+
+
+def downgrade() -> None:
+    op.execute("DROP TRIGGER reviews_notify_change ON reviews")
+    op.execute("DROP TRIGGER books_notify_change ON books")
+    op.execute("DROP FUNCTION notify_book_change()")